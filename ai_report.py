@@ -0,0 +1,624 @@
+"""ผลวิเคราะห์ของ AI แบบมีโครงสร้าง (JSON) และการจัดรูปแบบรายงานภาษาไทยในเครื่อง
+
+AI ตอบเป็น JSON สั้นๆ ตาม schema (คะแนน, sentiment รายข่าว, แนวรับ/แนวต้าน, คำแนะนำ)
+แทนข้อความยาว จึงสร้างคำตอบเร็วขึ้นและได้ค่าที่แน่นอน ไม่ต้องเดาจาก emoji หรือ regex
+ตัวเลขที่คำนวณได้เอง (สัดส่วนข่าว, ระยะห่างจากราคาปัจจุบัน) คำนวณตอน render
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SENTIMENTS = ('positive', 'neutral', 'negative')
+SENTIMENT_EMOJI = {'positive': '🟢', 'neutral': '🟡', 'negative': '🔴'}
+
+_NEWS_ITEMS = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'i': {'type': 'integer'},
+            'sentiment': {'type': 'string', 'enum': list(SENTIMENTS)},
+            'impact': {'type': 'string'},
+        },
+        'required': ['i', 'sentiment', 'impact'],
+    },
+}
+
+NEWS_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'summary': {'type': 'string'},
+    },
+    'required': ['summary'],
+}
+
+HEADLINE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'headlines': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'i': {'type': 'integer'},
+                    'sentiment': {'type': 'string', 'enum': list(SENTIMENTS)},
+                    'score': {'type': 'integer'},
+                    'gist': {'type': 'string'},
+                },
+                'required': ['i', 'sentiment', 'score', 'gist'],
+            },
+        },
+    },
+    'required': ['headlines'],
+}
+
+COMBINED_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'news': _NEWS_ITEMS,
+        'key_points': {'type': 'array', 'items': {'type': 'string'}},
+        'news_score': {'type': 'integer'},
+        'technical': {
+            'type': 'object',
+            'properties': {
+                'signal': {'type': 'string', 'enum': ['bullish', 'bearish', 'neutral']},
+                'rsi': {'type': 'string'},
+                'macd': {'type': 'string'},
+                'ema': {'type': 'string'},
+                'bollinger': {'type': 'string'},
+                'score': {'type': 'integer'},
+            },
+            'required': ['signal', 'score'],
+        },
+        'support': {'type': 'array', 'items': {'type': 'number'}},
+        'resistance': {'type': 'array', 'items': {'type': 'number'}},
+        'valuation': {
+            'type': 'object',
+            'properties': {
+                'analyst_view': {'type': 'string'},
+                'margin_of_safety': {'type': 'string', 'enum': ['high', 'medium', 'low', 'none']},
+            },
+        },
+        'conflicts': {'type': 'array', 'items': {'type': 'string'}},
+        'risk': {'type': 'string', 'enum': ['low', 'medium', 'high']},
+        'timeframe': {'type': 'string', 'enum': ['short', 'mid', 'long']},
+        'action': {'type': 'string', 'enum': ['buy', 'wait', 'sell']},
+        'entry': {
+            'type': 'object',
+            'properties': {
+                'price': {'type': 'number', 'nullable': True},
+                'reason': {'type': 'string'},
+            },
+        },
+        'stop_loss': {'type': 'number', 'nullable': True},
+        'take_profit': {'type': 'array', 'items': {'type': 'number'}},
+        'overall_score': {'type': 'integer'},
+        'summary': {'type': 'string'},
+    },
+    'required': ['news', 'news_score', 'technical', 'risk', 'action', 'overall_score', 'summary'],
+}
+
+BATCH_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'stocks': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'symbol': {'type': 'string'},
+                    'score': {'type': 'integer'},
+                    'signal': {'type': 'string', 'enum': ['bullish', 'bearish', 'neutral']},
+                    'news': {'type': 'string', 'enum': list(SENTIMENTS)},
+                    'action': {'type': 'string', 'enum': ['buy', 'wait', 'sell']},
+                    'reason': {'type': 'string'},
+                },
+                'required': ['symbol', 'score', 'signal', 'news', 'action', 'reason'],
+            },
+        },
+        'summary': {'type': 'string'},
+    },
+    'required': ['stocks', 'summary'],
+}
+
+COMPARE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'stocks': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'symbol': {'type': 'string'},
+                    'technical': {'type': 'string'},
+                    'technical_score': {'type': 'integer'},
+                    'valuation': {'type': 'string'},
+                    'valuation_score': {'type': 'integer'},
+                    'news': {'type': 'string'},
+                    'news_score': {'type': 'integer'},
+                    'overall_score': {'type': 'integer'},
+                    'weakness': {'type': 'string'},
+                },
+                'required': ['symbol', 'technical_score', 'valuation_score', 'news_score', 'overall_score'],
+            },
+        },
+        'winners': {
+            'type': 'object',
+            'properties': {
+                'technical': {'type': 'string'},
+                'valuation': {'type': 'string'},
+                'news': {'type': 'string'},
+            },
+        },
+        'timeframes': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'term': {'type': 'string', 'enum': ['short', 'mid', 'long']},
+                    'pick': {'type': 'string'},
+                    'reason': {'type': 'string'},
+                    'entry': {'type': 'number', 'nullable': True},
+                    'stop_loss': {'type': 'number', 'nullable': True},
+                    'target': {'type': 'number', 'nullable': True},
+                    'confidence': {'type': 'string', 'enum': ['high', 'medium', 'low']},
+                    'risk': {'type': 'string', 'enum': ['low', 'medium', 'high']},
+                },
+                'required': ['term', 'pick', 'reason'],
+            },
+        },
+        'pick': {'type': 'string'},
+        'reason': {'type': 'string'},
+        'strategy': {'type': 'string'},
+    },
+    'required': ['stocks', 'pick', 'reason'],
+}
+
+
+def schema_outline(schema):
+    """รูปย่อของ schema สำหรับใส่ใน prompt ของ provider ที่บังคับ schema ไม่ได้ (เช่น Groq)"""
+    kind = schema.get('type')
+    if kind == 'object':
+        fields = ','.join(f'"{name}":{schema_outline(sub)}' for name, sub in schema['properties'].items())
+        return '{' + fields + '}'
+    if kind == 'array':
+        return f"[{schema_outline(schema['items'])}]"
+    if 'enum' in schema:
+        return '"' + '|'.join(schema['enum']) + '"'
+    name = {'string': 'str', 'integer': 'int', 'number': 'float'}[kind]
+    return f"{name}|null" if schema.get('nullable') else name
+
+
+def parse_json_reply(text):
+    """แปลงคำตอบของ AI เป็น dict (รองรับ ```json ... ``` ที่บางโมเดลใส่มา) คืน None ถ้าไม่ใช่ JSON"""
+    if not text:
+        return None
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end <= start:
+        return None
+    try:
+        value = json.loads(text[start:end + 1])
+    except ValueError as e:
+        logger.warning(f"⚠️ AI reply is not valid JSON: {e}")
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _score(value):
+    try:
+        return max(-10, min(10, int(round(float(value)))))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _price(value):
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return price if price > 0 else None
+
+
+def _prices(values):
+    return [price for price in (_price(v) for v in values or []) if price is not None]
+
+
+def _choice(value, options, default):
+    value = str(value or '').strip().lower()
+    return value if value in options else default
+
+
+def _news_items(items, news_count):
+    """sentiment รายข่าว (เรียงตามเลขข่าว ตัดรายการซ้ำหรือเลขที่ไม่มีจริง)"""
+    result = {}
+    for item in items or []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get('i'))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= index <= news_count and index not in result:
+            result[index] = {
+                'i': index,
+                'sentiment': _choice(item.get('sentiment'), SENTIMENTS, 'neutral'),
+                'impact': str(item.get('impact') or '').strip(),
+            }
+    return [result[index] for index in sorted(result)]
+
+
+def normalize_headline_scores(data, count):
+    """คะแนนรายหัวข้อข่าว: list ยาว count ตามลำดับข่าว (None = AI ไม่ได้ให้คะแนนข่าวนั้น)"""
+    scores = [None] * count
+    for item in data.get('headlines') or []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get('i'))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= index <= count and scores[index - 1] is None:
+            scores[index - 1] = {
+                'sentiment': _choice(item.get('sentiment'), SENTIMENTS, 'neutral'),
+                'score': _score(item.get('score')),
+                'gist': str(item.get('gist') or '').strip(),
+            }
+    return scores
+
+
+def news_analysis_from_scores(news_list, scores, summary=''):
+    """ผลวิเคราะห์ข่าว (รูปเดียวกับที่ render_news_analysis ใช้) จากคะแนนรายข่าวที่คำนวณไว้แล้ว
+
+    scores = {news id: คะแนนจาก sentiment_index} คะแนนรวมคือค่าเฉลี่ยของข่าวที่มีคะแนน
+    """
+    items = []
+    for i, news in enumerate(news_list, 1):
+        entry = scores.get(news.get('id'))
+        if entry:
+            items.append({'i': i, 'sentiment': entry['sentiment'], 'impact': entry.get('gist', ''), 'score': entry['score']})
+    score = _score(sum(item['score'] for item in items) / len(items)) if items else 0
+    return {'summary': summary, 'news': items, 'score': score}
+
+
+def normalize_combined_analysis(data, news_count):
+    technical = data.get('technical') if isinstance(data.get('technical'), dict) else {}
+    valuation = data.get('valuation') if isinstance(data.get('valuation'), dict) else {}
+    entry = data.get('entry') if isinstance(data.get('entry'), dict) else {}
+    return {
+        'news': _news_items(data.get('news'), news_count),
+        'key_points': [str(p).strip() for p in data.get('key_points') or [] if str(p).strip()][:3],
+        'news_score': _score(data.get('news_score')),
+        'technical': {
+            'signal': _choice(technical.get('signal'), ('bullish', 'bearish', 'neutral'), 'neutral'),
+            'rsi': str(technical.get('rsi') or '').strip(),
+            'macd': str(technical.get('macd') or '').strip(),
+            'ema': str(technical.get('ema') or '').strip(),
+            'bollinger': str(technical.get('bollinger') or '').strip(),
+            'score': _score(technical.get('score')),
+        },
+        'support': _prices(data.get('support'))[:2],
+        'resistance': _prices(data.get('resistance'))[:2],
+        'valuation': {
+            'analyst_view': str(valuation.get('analyst_view') or '').strip(),
+            'margin_of_safety': _choice(valuation.get('margin_of_safety'), ('high', 'medium', 'low', 'none'), 'none'),
+        },
+        'conflicts': [str(c).strip() for c in data.get('conflicts') or [] if str(c).strip()],
+        'risk': _choice(data.get('risk'), ('low', 'medium', 'high'), 'medium'),
+        'timeframe': _choice(data.get('timeframe'), ('short', 'mid', 'long'), 'mid'),
+        'action': _choice(data.get('action'), ('buy', 'wait', 'sell'), 'wait'),
+        'entry': {'price': _price(entry.get('price')), 'reason': str(entry.get('reason') or '').strip()},
+        'stop_loss': _price(data.get('stop_loss')),
+        'take_profit': _prices(data.get('take_profit'))[:3],
+        'overall_score': _score(data.get('overall_score')),
+        'summary': str(data.get('summary') or '').strip(),
+    }
+
+
+def normalize_batch_analysis(data, symbols):
+    """ผลวิเคราะห์ทั้งหมวด: เฉพาะ symbol ที่ขอ (ไม่ซ้ำ) เรียงตามคะแนนจากมากไปน้อย"""
+    wanted = {symbol.upper() for symbol in symbols}
+    stocks = {}
+    for item in data.get('stocks') or []:
+        if not isinstance(item, dict):
+            continue
+        symbol = str(item.get('symbol') or '').strip().upper()
+        if symbol in wanted and symbol not in stocks:
+            stocks[symbol] = {
+                'symbol': symbol,
+                'score': _score(item.get('score')),
+                'signal': _choice(item.get('signal'), ('bullish', 'bearish', 'neutral'), 'neutral'),
+                'news': _choice(item.get('news'), SENTIMENTS, 'neutral'),
+                'action': _choice(item.get('action'), ('buy', 'wait', 'sell'), 'wait'),
+                'reason': str(item.get('reason') or '').strip(),
+            }
+    return {
+        'stocks': sorted(stocks.values(), key=lambda stock: -stock['score']),
+        'missing': [symbol for symbol in symbols if symbol.upper() not in stocks],
+        'summary': str(data.get('summary') or '').strip(),
+    }
+
+
+def _text(value):
+    return str(value or '').strip()
+
+
+def normalize_comparison(data, symbols):
+    """ผลเปรียบเทียบหุ้น: ทุก symbol ที่ขอ (ตามลำดับ) ตัวที่เลือกต้องเป็นหนึ่งใน symbols"""
+    symbols = [symbol.upper() for symbol in symbols]
+    stocks = {}
+    for item in data.get('stocks') or []:
+        if not isinstance(item, dict):
+            continue
+        symbol = _text(item.get('symbol')).upper()
+        if symbol in symbols and symbol not in stocks:
+            stocks[symbol] = {
+                'symbol': symbol,
+                'technical': _text(item.get('technical')),
+                'technical_score': _score(item.get('technical_score')),
+                'valuation': _text(item.get('valuation')),
+                'valuation_score': _score(item.get('valuation_score')),
+                'news': _text(item.get('news')),
+                'news_score': _score(item.get('news_score')),
+                'overall_score': _score(item.get('overall_score')),
+                'weakness': _text(item.get('weakness')),
+            }
+    stocks = [stocks.get(symbol) or {
+        'symbol': symbol, 'technical': '', 'technical_score': 0, 'valuation': '', 'valuation_score': 0,
+        'news': '', 'news_score': 0, 'overall_score': 0, 'weakness': '',
+    } for symbol in symbols]
+    best = max(stocks, key=lambda stock: stock['overall_score'])['symbol']
+
+    def pick(value):
+        value = _text(value).upper()
+        return value if value in symbols else None
+
+    winners = data.get('winners') if isinstance(data.get('winners'), dict) else {}
+    timeframes = {}
+    for item in data.get('timeframes') or []:
+        if not isinstance(item, dict):
+            continue
+        term = _choice(item.get('term'), ('short', 'mid', 'long'), None)
+        if term and term not in timeframes:
+            timeframes[term] = {
+                'term': term,
+                'pick': pick(item.get('pick')) or best,
+                'reason': _text(item.get('reason')),
+                'entry': _price(item.get('entry')),
+                'stop_loss': _price(item.get('stop_loss')),
+                'target': _price(item.get('target')),
+                'confidence': _choice(item.get('confidence'), ('high', 'medium', 'low'), 'medium'),
+                'risk': _choice(item.get('risk'), ('low', 'medium', 'high'), 'medium'),
+            }
+    return {
+        'stocks': stocks,
+        'winners': {area: pick(winners.get(area)) for area in ('technical', 'valuation', 'news')},
+        'timeframes': [timeframes[term] for term in ('short', 'mid', 'long') if term in timeframes],
+        'pick': pick(data.get('pick')) or best,
+        'reason': _text(data.get('reason')),
+        'strategy': _text(data.get('strategy')),
+    }
+
+
+def sentiment_counts(news_items, news_count):
+    """คืน {sentiment: (จำนวน, เปอร์เซ็นต์)} ข่าวที่ AI ไม่ได้ระบุนับเป็นกลาง"""
+    counts = {sentiment: 0 for sentiment in SENTIMENTS}
+    for item in news_items:
+        counts[item['sentiment']] += 1
+    counts['neutral'] += max(0, news_count - len(news_items))
+    total = max(news_count, len(news_items), 1)
+    return {sentiment: (count, int(count / total * 100)) for sentiment, count in counts.items()}
+
+
+def sentiment_label(score):
+    if score >= 7:
+        return "ข่าวดีมาก 🟢"
+    if score >= 4:
+        return "ข่าวดี 🟢"
+    if score >= 1:
+        return "ค่อนข้างดี 🟢"
+    if score == 0:
+        return "เป็นกลาง 🟡"
+    if score >= -3:
+        return "ค่อนข้างไม่ดี 🔴"
+    if score >= -6:
+        return "ข่าวไม่ดี 🔴"
+    return "ข่าวไม่ดีมาก 🔴"
+
+
+def _overall_label(score):
+    if score <= -5:
+        return "ไม่ควรลงทุน"
+    if score <= -1:
+        return "ระมัดระวังสูง"
+    if score <= 3:
+        return "ระมัดระวังปานกลาง/รอดู"
+    if score <= 6:
+        return "น่าสนใจ"
+    return "แนะนำให้พิจารณา"
+
+
+def _headline(news, limit=80):
+    headline = news.get('headline_th', news.get('headline', '')) if news else ''
+    return headline if len(headline) <= limit else headline[:limit - 3] + '...'
+
+
+def render_news_analysis(report, analysis, news_list):
+    """เขียนผลวิเคราะห์ข่าวลง ReportBuilder"""
+    if analysis['summary']:
+        report.bold("📰 สรุปภาพรวม").line()
+        report.line(analysis['summary']).line()
+    report.bold("📌 ผลกระทบต่อหุ้น").line()
+    for item in analysis['news']:
+        news = news_list[item['i'] - 1] if item['i'] <= len(news_list) else None
+        title = _headline(news) or f"ข่าวที่ {item['i']}"
+        report.line(f"{SENTIMENT_EMOJI[item['sentiment']]} {title}")
+        if item['impact']:
+            report.line(f"   → {item['impact']}")
+    return report
+
+
+_SEPARATOR = '═' * 27
+_SIGNAL_TEXT = {'bullish': '🟢 Bullish (แนวโน้มขึ้น)', 'bearish': '🔴 Bearish (แนวโน้มลง)',
+                'neutral': '🟡 Neutral/Sideways (เทรนด์ไม่ชัด)'}
+_MARGIN_TEXT = {'high': 'สูง', 'medium': 'กลาง', 'low': 'ต่ำ', 'none': 'ไม่มี'}
+_RISK_TEXT = {'low': '🟢 ต่ำ', 'medium': '🟡 กลาง', 'high': '🔴 สูง'}
+_TIMEFRAME_TEXT = {'short': 'Short-term (1-7 วัน)', 'mid': 'Mid-term (1-4 สัปดาห์)',
+                   'long': 'Long-term (1-6 เดือน+)'}
+_ACTION_TEXT = {'buy': '🟢 ซื้อ (BUY)', 'wait': '🟡 รอดู (WAIT)', 'sell': '🔴 ขาย/หลีกเลี่ยง (SELL/AVOID)'}
+
+_SIGNAL_EMOJI = {'bullish': '📈', 'bearish': '📉', 'neutral': '➖'}
+_ACTION_SHORT = {'buy': '🟢 BUY', 'wait': '🟡 WAIT', 'sell': '🔴 SELL'}
+
+
+def render_batch_analysis(report, analysis, quotes):
+    """ตารางจัดอันดับหุ้นทั้งหมวดลง ReportBuilder (quotes = {symbol: quote} สำหรับแสดงราคา)"""
+    for rank, stock in enumerate(analysis['stocks'], 1):
+        quote = quotes.get(stock['symbol']) or {}
+        report.bold(f"{rank}. {stock['symbol']}")
+        report.line(f"  {stock['score']:+d}/10 {_ACTION_SHORT[stock['action']]}")
+        details = [f"เทคนิค {_SIGNAL_EMOJI[stock['signal']]}", f"ข่าว {SENTIMENT_EMOJI[stock['news']]}"]
+        if quote.get('close'):
+            price = float(quote['close'])
+            previous = float(quote.get('previous_close') or price)
+            change = (price - previous) / previous * 100 if previous else 0.0
+            details.insert(0, f"${price:.2f} ({change:+.2f}%)")
+        report.line("   " + " | ".join(details))
+        if stock['reason']:
+            report.line(f"   → {stock['reason']}")
+    if analysis['missing']:
+        report.line().line(f"⚠️ ไม่มีผลวิเคราะห์: {', '.join(analysis['missing'])}")
+    if analysis['summary']:
+        report.line().bold("📝 ภาพรวมหมวด").line()
+        report.line(analysis['summary'])
+    return report
+
+
+def _with_distance(price, current):
+    if not current:
+        return f"${price:.2f}"
+    return f"${price:.2f} ({(price - current) / current * 100:+.1f}%)"
+
+
+def _section(lines, title):
+    lines.extend(['', _SEPARATOR, title, _SEPARATOR])
+
+
+def render_combined_analysis(analysis, technical_data, news_count):
+    """ข้อความรายงานวิเคราะห์แบบรวม (ข้อความล้วน ไม่มี markdown)"""
+    current = technical_data.get('current') or 0
+    lines = []
+
+    _section(lines, "📰 PART 1: วิเคราะห์จากข่าว")
+    counts = sentiment_counts(analysis['news'], news_count)
+    lines.append(" | ".join(
+        f"{SENTIMENT_EMOJI[sentiment]} {count} ({pct}%)" for sentiment, (count, pct) in counts.items()
+    ))
+    for item in analysis['news']:
+        if item['impact']:
+            lines.append(f"{SENTIMENT_EMOJI[item['sentiment']]} ข่าวที่ {item['i']}: {item['impact']}")
+    for point in analysis['key_points']:
+        lines.append(f"• {point}")
+    lines.append(f"📊 News Sentiment: {analysis['news_score']:+d}/10 ({sentiment_label(analysis['news_score'])})")
+
+    technical = analysis['technical']
+    _section(lines, "📈 PART 2: วิเคราะห์จากเทคนิค")
+    lines.append(f"สัญญาณรวม: {_SIGNAL_TEXT[technical['signal']]}")
+    for label, key in (('RSI', 'rsi'), ('MACD', 'macd'), ('EMA', 'ema'), ('Bollinger Bands', 'bollinger')):
+        if technical[key]:
+            lines.append(f"• {label}: {technical[key]}")
+    if analysis['support']:
+        lines.append("🟩 แนวรับ: " + ", ".join(_with_distance(p, current) for p in analysis['support']))
+    if analysis['resistance']:
+        lines.append("🟥 แนวต้าน: " + ", ".join(_with_distance(p, current) for p in analysis['resistance']))
+    lines.append(f"📊 Technical Score: {technical['score']:+d}/10")
+
+    valuation = analysis['valuation']
+    _section(lines, "💎 PART 3: Valuation & Analyst View")
+    if technical_data.get('upside_pct') is not None:
+        lines.append(f"Upside/Downside Potential: {technical_data['upside_pct']:+.1f}%")
+    if technical_data.get('analyst_buy_pct') is not None:
+        lines.append(f"นักวิเคราะห์แนะนำซื้อ: {technical_data['analyst_buy_pct']:.0f}%")
+    if valuation['analyst_view']:
+        lines.append(f"ความเห็น: {valuation['analyst_view']}")
+    lines.append(f"Margin of Safety: {_MARGIN_TEXT[valuation['margin_of_safety']]}")
+
+    _section(lines, "🎯 PART 4: สรุปรวมและคำแนะนำ")
+    for conflict in analysis['conflicts']:
+        lines.append(f"⚠️ {conflict}")
+    lines.append(f"ระดับความเสี่ยง: {_RISK_TEXT[analysis['risk']]}")
+    lines.append(f"📊 Timeframe: {_TIMEFRAME_TEXT[analysis['timeframe']]}")
+    lines.append(f"🎯 Action: {_ACTION_TEXT[analysis['action']]}")
+    entry = analysis['entry']
+    if entry['price']:
+        reason = f" - {entry['reason']}" if entry['reason'] else ""
+        lines.append(f"💰 จุดเข้า: {_with_distance(entry['price'], current)}{reason}")
+    if analysis['stop_loss']:
+        lines.append(f"🛡️ Stop Loss: {_with_distance(analysis['stop_loss'], current)}")
+    for i, target in enumerate(analysis['take_profit'], 1):
+        lines.append(f"🎯 TP{i}: {_with_distance(target, current)}")
+    score = analysis['overall_score']
+    lines.append(f"⭐ Overall Score: {score:+d}/10 ({_overall_label(score)})")
+    if analysis['summary']:
+        lines.extend(['', f"📝 สรุป: {analysis['summary']}"])
+
+    return "\n".join(lines).strip()
+
+
+_COMPARE_MARKERS = ('🔴', '🔵')
+_COMPARE_TERMS = {'short': '📅 ระยะสั้น (1-4 สัปดาห์)', 'mid': '📅 ระยะกลาง (1-3 เดือน)',
+                  'long': '📅 ระยะยาว (6 เดือน - 1 ปี+)'}
+
+
+def render_comparison(analysis, stock_data):
+    """ข้อความผลเปรียบเทียบ (ข้อความล้วน ไม่มี markdown) stock_data = {symbol: ข้อมูลที่ส่งให้ AI}"""
+    markers = dict(zip((stock['symbol'] for stock in analysis['stocks']), _COMPARE_MARKERS))
+    lines = []
+    for title, area, text_key, score_key in (
+            ("📈 PART 1: เปรียบเทียบตัวชี้วัดเทคนิค", 'technical', 'technical', 'technical_score'),
+            ("💎 PART 2: เปรียบเทียบ Valuation", 'valuation', 'valuation', 'valuation_score'),
+            ("📰 PART 3: เปรียบเทียบข่าวและ Sentiment", 'news', 'news', 'news_score')):
+        _section(lines, title)
+        for stock in analysis['stocks']:
+            data = stock_data.get(stock['symbol']) or {}
+            lines.append(f"{markers.get(stock['symbol'], '•')} {stock['symbol']}: {stock[score_key]:+d}/10")
+            if area == 'valuation':
+                if data.get('upside_pct') is not None:
+                    lines.append(f"   Upside Potential: {data['upside_pct']:+.1f}%")
+                if data.get('analyst_buy_pct') is not None:
+                    lines.append(f"   นักวิเคราะห์แนะนำซื้อ: {data['analyst_buy_pct']:.0f}%")
+            if stock[text_key]:
+                lines.append(f"   → {stock[text_key]}")
+        if analysis['winners'][area]:
+            lines.append(f"🏆 Winner: {analysis['winners'][area]}")
+
+    if analysis['timeframes']:
+        _section(lines, "⏱️ PART 4: แยกตาม Timeframe")
+        for frame in analysis['timeframes']:
+            current = (stock_data.get(frame['pick']) or {}).get('current')
+            lines.append(f"{_COMPARE_TERMS[frame['term']]}: 🎯 {frame['pick']}")
+            if frame['reason']:
+                lines.append(f"   เหตุผล: {frame['reason']}")
+            if frame['entry']:
+                lines.append(f"   💰 จุดเข้า: {_with_distance(frame['entry'], current)}")
+            if frame['stop_loss']:
+                lines.append(f"   🛡️ Stop Loss: {_with_distance(frame['stop_loss'], current)}")
+            if frame['target']:
+                lines.append(f"   🎯 Target: {_with_distance(frame['target'], current)}")
+            lines.append(f"   ความมั่นใจ: {_MARGIN_TEXT[frame['confidence']]} | ความเสี่ยง: {_RISK_TEXT[frame['risk']]}")
+
+    _section(lines, "🏁 PART 5: คะแนนรวมและคำแนะนำสุดท้าย")
+    for stock in analysis['stocks']:
+        lines.append(f"{markers.get(stock['symbol'], '•')} {stock['symbol']}: {stock['overall_score']:+d}/10 "
+                     f"({_overall_label(stock['overall_score'])})")
+    lines.extend(['', f"🏆 ถ้าเลือกได้อันเดียว ควรซื้อ: {analysis['pick']}"])
+    if analysis['reason']:
+        lines.append(f"เหตุผล: {analysis['reason']}")
+    weaknesses = [stock for stock in analysis['stocks'] if stock['weakness']]
+    if weaknesses:
+        lines.extend(['', "⚠️ ข้อควรระวัง:"])
+        lines.extend(f"- {stock['symbol']}: {stock['weakness']}" for stock in weaknesses)
+    if analysis['strategy']:
+        lines.extend(['', f"💡 กลยุทธ์ทางเลือก: {analysis['strategy']}"])
+
+    return "\n".join(lines).strip()
@@ -0,0 +1,165 @@
+"""Backtest กฎสัญญาณเดียวกับรายงานของ get_stock_analysis บนราคาย้อนหลังรายวัน
+
+ทุกกฎเป็น boolean mask ของ NumPy บนทั้งชุดข้อมูล (ไม่มี loop รายวัน):
+RSI(14) <= 30 ซื้อ / >= 70 ขาย, MACD เหนือ/ใต้ Signal, ราคา > EMA20 > EMA50 (ขาขึ้น) / กลับกัน (ขาลง)
+วันที่มีสัญญาณถูกวัดด้วยผลตอบแทนล่วงหน้า (forward return) ที่หลาย horizon
+hit = ราคาไปทางเดียวกับสัญญาณ ส่วน drawdown คิดจาก equity ของการถือตามสัญญาณ (เข้าแท่งถัดไป)
+
+Valuation (upside เทียบราคาเป้าหมายนักวิเคราะห์) ไม่มีข้อมูลย้อนหลังแบบ ณ วันนั้น จึงไม่ได้ backtest
+"""
+import numpy as np
+
+import indicators
+
+HORIZONS = (5, 20, 60)  # วันทำการ (~1 สัปดาห์, 1 เดือน, 3 เดือน)
+MIN_BARS = 200          # ต้องมีข้อมูลพอให้ EMA 50 / MACD นิ่ง
+
+# ชื่อกฎ -> (ข้อความในรายงาน, ทิศทาง +1 = ซื้อ/ขาขึ้น, -1 = ขาย/ขาลง)
+RULES = {
+    'rsi_buy': ('RSI ≤ 30 (ซื้อ)', 1),
+    'rsi_sell': ('RSI ≥ 70 (ขาย)', -1),
+    'macd_bullish': ('MACD > Signal', 1),
+    'macd_bearish': ('MACD ≤ Signal', -1),
+    'ema_uptrend': ('ราคา > EMA20 > EMA50', 1),
+    'ema_downtrend': ('ราคา < EMA20 < EMA50', -1),
+}
+
+
+def signal_masks(close):
+    """mask ของทุกกฎ (ตามลำดับ RULES) วันที่ตัวชี้วัดยังเป็น NaN ไม่นับเป็นสัญญาณ"""
+    close = np.asarray(close, dtype=np.float64)
+    rsi = indicators.rsi(close, 14)
+    macd_line, macd_signal, _ = indicators.macd(close)
+    ema_20 = indicators.ema(close, 20)
+    ema_50 = indicators.ema(close, 50)
+    with np.errstate(invalid='ignore'):
+        has_macd = ~np.isnan(macd_line) & ~np.isnan(macd_signal)
+        return {
+            'rsi_buy': rsi <= 30,
+            'rsi_sell': rsi >= 70,
+            'macd_bullish': has_macd & (macd_line > macd_signal),
+            'macd_bearish': has_macd & (macd_line <= macd_signal),
+            'ema_uptrend': (close > ema_20) & (ema_20 > ema_50),
+            'ema_downtrend': (close < ema_20) & (ema_20 < ema_50),
+        }
+
+
+def forward_returns(close, horizon):
+    """ผลตอบแทนจากวันนี้ถึง horizon วันข้างหน้า (NaN ช่วงท้ายที่ยังไม่มีข้อมูล)"""
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(len(close), np.nan)
+    if len(close) > horizon:
+        out[:-horizon] = close[horizon:] / close[:-horizon] - 1
+    return out
+
+
+def max_drawdown(close, position):
+    """drawdown สูงสุดของ equity เมื่อถือ position (+1/-1/0) ที่ตัดสินจากแท่งก่อนหน้า"""
+    close = np.asarray(close, dtype=np.float64)
+    if len(close) < 2:
+        return 0.0
+    daily = close[1:] / close[:-1] - 1
+    equity = np.cumprod(1 + position[:-1] * daily)
+    return float(np.min(equity / np.maximum.accumulate(equity) - 1, initial=0.0))
+
+
+def _symbol_samples(close, horizons):
+    """ผลตอบแทนล่วงหน้าของวันที่มีสัญญาณ ต่อกฎต่อ horizon และ drawdown ต่อกฎ ของ symbol เดียว"""
+    masks = signal_masks(close)
+    returns = {horizon: forward_returns(close, horizon) for horizon in horizons}
+    samples = {}
+    for rule, (_, direction) in RULES.items():
+        mask = masks[rule]
+        samples[rule] = {
+            'days': int(mask.sum()),
+            'returns': {horizon: values[mask & ~np.isnan(values)] for horizon, values in returns.items()},
+            'max_drawdown': max_drawdown(close, np.where(mask, direction, 0)),
+        }
+    baseline = {
+        'returns': {horizon: values[~np.isnan(values)] for horizon, values in returns.items()},
+        'max_drawdown': max_drawdown(close, np.ones(len(close))),
+    }
+    return samples, baseline
+
+
+def _summarize(returns, direction):
+    if not len(returns):
+        return {'count': 0, 'hit_rate': None, 'avg_return': None}
+    return {
+        'count': int(len(returns)),
+        'hit_rate': float(np.mean(direction * returns > 0)),
+        'avg_return': float(np.mean(returns)),
+    }
+
+
+def backtest_many(closes, horizons=HORIZONS):
+    """backtest ทุกกฎบนหลาย symbol ({symbol: close array}) แล้วรวมผลทุกวันที่มีสัญญาณ
+
+    คืน {'symbols', 'bars', 'horizons', 'baseline', 'rules'} โดยแต่ละกฎมี hit_rate / avg_return
+    ต่อ horizon และ max_drawdown (แย่สุดในทุก symbol) symbol ที่ข้อมูลไม่ถึง MIN_BARS ถูกข้าม
+    """
+    per_symbol = {symbol: _symbol_samples(np.asarray(close, dtype=np.float64), horizons)
+                  for symbol, close in closes.items() if len(close) >= MIN_BARS}
+    bars = sum(len(closes[symbol]) for symbol in per_symbol)
+
+    rules = []
+    for rule, (label, direction) in RULES.items():
+        samples = [per_symbol[symbol][0][rule] for symbol in per_symbol]
+        rules.append({
+            'rule': rule,
+            'label': label,
+            'direction': direction,
+            'days': sum(sample['days'] for sample in samples),
+            'horizons': {
+                horizon: _summarize(np.concatenate([s['returns'][horizon] for s in samples] or [np.empty(0)]),
+                                    direction)
+                for horizon in horizons
+            },
+            'max_drawdown': min((sample['max_drawdown'] for sample in samples), default=0.0),
+        })
+    baselines = [per_symbol[symbol][1] for symbol in per_symbol]
+    baseline = {
+        'horizons': {
+            horizon: _summarize(np.concatenate([b['returns'][horizon] for b in baselines] or [np.empty(0)]), 1)
+            for horizon in horizons
+        },
+        'max_drawdown': min((b['max_drawdown'] for b in baselines), default=0.0),
+    }
+    return {'symbols': list(per_symbol), 'bars': bars, 'horizons': horizons, 'baseline': baseline, 'rules': rules}
+
+
+def backtest(close, horizons=HORIZONS):
+    return backtest_many({'': close}, horizons)
+
+
+def _pct(value):
+    return '-' if value is None else f"{value * 100:+.1f}%"
+
+
+def render_report(title, result, period=''):
+    """รายงาน Markdown ของผล backtest_many"""
+    horizons = result['horizons']
+    lines = [f"🧪 **Backtest: {title}**"]
+    if period:
+        lines.append(f"📅 {period} ({result['bars']:,} แท่ง)")
+    lines.append(f"ผลตอบแทนล่วงหน้า {' / '.join(f'{h}' for h in horizons)} วันทำการ\n")
+
+    baseline = result['baseline']
+    lines.append("📊 **ซื้อแล้วถือ (เทียบ):**")
+    lines.append("• เฉลี่ย: " + ' / '.join(_pct(baseline['horizons'][h]['avg_return']) for h in horizons))
+    lines.append(f"• Drawdown สูงสุด: {_pct(baseline['max_drawdown'])}\n")
+
+    for rule in result['rules']:
+        lines.append(f"{'🟢' if rule['direction'] > 0 else '🔴'} **{rule['label']}** ({rule['days']:,} วัน)")
+        if not rule['days']:
+            lines.append("• ไม่เคยเกิดสัญญาณในช่วงนี้\n")
+            continue
+        stats = [rule['horizons'][h] for h in horizons]
+        lines.append("• ถูกทาง: " + ' / '.join('-' if s['hit_rate'] is None else f"{s['hit_rate'] * 100:.0f}%"
+                                              for s in stats))
+        lines.append("• ผลตอบแทนเฉลี่ย: " + ' / '.join(_pct(s['avg_return']) for s in stats))
+        lines.append(f"• Drawdown ถือตามสัญญาณ: {_pct(rule['max_drawdown'])}\n")
+
+    lines.append("💎 Valuation ไม่ได้ทดสอบ (ไม่มีราคาเป้าหมายนักวิเคราะห์ย้อนหลัง)")
+    lines.append("⚠️ ผลในอดีตไม่ได้รับประกันผลในอนาคต")
+    return '\n'.join(lines)
@@ -0,0 +1,307 @@
+"""Load generator: ยิง Telegram Update สังเคราะห์เข้า webhook ของบอท
+
+โดย default จะเปิด stub upstream (benchmarks/stubs.py) แล้วรัน stock_bot.py เป็น
+subprocess ในโหมด webhook ที่ชี้ Bot API มาที่ stub จากนั้นยิง update ตาม rate ที่กำหนด
+
+แต่ละ update ใช้ chat_id ไม่ซ้ำกัน จึงจับคู่กับ Bot API call ที่บอทส่งกลับมาได้:
+- queueing delay  = เวลาตั้งแต่ POST จนบอทเรียก Bot API ครั้งแรกของ chat นั้น
+                    (เริ่มประมวลผลแล้ว เช่นส่งข้อความ "กำลังวิเคราะห์...")
+- completion      = เวลาตั้งแต่ POST จน Bot API call ครั้งสุดท้ายของ chat นั้น
+
+ตัวอย่าง:
+    python benchmarks/loadgen.py --rate 5 --duration 60
+    python benchmarks/loadgen.py --rate 20 --duration 30 --zipf 1.2 --latency gemini=4 --csv updates.csv
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.run import build_configs, percentile  # noqa: E402
+from benchmarks.stubs import StubUpstreams  # noqa: E402
+
+BOT_TOKEN = '123456:LOADGEN'
+
+SYMBOLS = (
+    'NVDA', 'AAPL', 'MSFT', 'TSLA', 'AMZN', 'GOOGL', 'META', 'AMD', 'NFLX', 'AVGO',
+    'PLTR', 'V', 'MA', 'JPM', 'CRM', 'ORCL', 'COST', 'WMT', 'LLY', 'UNH',
+    'XOM', 'CVX', 'RKLB', 'BA', 'DIS', 'KO', 'PEP', 'SPY', 'QQQ', 'COIN',
+)
+CATEGORIES = (
+    'cat_toppicks', 'cat_ai_tech', 'cat_finance', 'cat_consumer', 'cat_healthcare',
+    'cat_energy', 'cat_aerospace', 'cat_media', 'cat_industrial', 'cat_etf',
+)
+# สัดส่วนประเภท update (ประมาณการใช้งานจริง: พิมพ์ symbol เยอะสุด)
+DEFAULT_MIX = {
+    'symbol': 0.40,
+    'news': 0.18,
+    'ai': 0.12,
+    'aiplus': 0.08,
+    'compare': 0.07,
+    'category': 0.10,
+    'stock_button': 0.05,
+}
+
+
+class UpdateFactory:
+    """สร้าง Update JSON แบบที่ Telegram ส่งเข้า webhook"""
+
+    def __init__(self, mix, zipf_s, seed):
+        self.random = random.Random(seed)
+        self.kinds = list(mix)
+        self.kind_weights = [mix[k] for k in self.kinds]
+        self.symbol_weights = [1 / (rank ** zipf_s) for rank in range(1, len(SYMBOLS) + 1)]
+        self.update_ids = itertools.count(1)
+        self.chat_ids = itertools.count(10_000_000)
+
+    def symbol(self):
+        return self.random.choices(SYMBOLS, self.symbol_weights)[0]
+
+    def make(self):
+        kind = self.random.choices(self.kinds, self.kind_weights)[0]
+        update_id = next(self.update_ids)
+        chat_id = next(self.chat_ids)
+        if kind == 'category':
+            return kind, chat_id, self._callback(update_id, chat_id, self.random.choice(CATEGORIES))
+        if kind == 'stock_button':
+            return kind, chat_id, self._callback(update_id, chat_id, f"aiplus_{self.symbol()}")
+        if kind == 'symbol':
+            text = self.symbol()
+        elif kind == 'compare':
+            first = self.symbol()
+            second = self.symbol()
+            while second == first:
+                second = self.symbol()
+            text = f"/compare {first} {second}"
+        else:
+            text = f"/{kind} {self.symbol()}"
+        return kind, chat_id, self._message(update_id, chat_id, text)
+
+    @staticmethod
+    def _user(chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': 'Load', 'language_code': 'th'}
+
+    def _message(self, update_id, chat_id, text):
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Load'},
+            'from': self._user(chat_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def _callback(self, update_id, chat_id, data):
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(chat_id),
+                'chat_instance': str(chat_id),
+                'data': data,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Load'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'Stub'},
+                    'text': '🚀 AI วิเคราะห์เต็มรูปแบบ',
+                },
+            },
+        }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def spawn_bot(stubs, port, extra_env):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env.update(stubs.env())
+    env.update({
+        'BOT_TOKEN': BOT_TOKEN,
+        'PORT': str(port),
+        'WEBHOOK_URL': f'http://127.0.0.1:{port}',
+        'USE_WEBHOOK': '1',
+    })
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, os.path.join(root, 'stock_bot.py')],
+        cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def fire(session, url, factory, rate, duration, poisson, records):
+    """ยิง update ตามตารางเวลา (Poisson หรือคงที่) โดยไม่รอ response ก่อนยิงตัวถัดไป"""
+    tasks = []
+    start = time.monotonic()
+    scheduled = start
+    rng = random.Random(factory.random.random())
+    while scheduled - start < duration:
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind, chat_id, payload = factory.make()
+        record = {'kind': kind, 'chat_id': str(chat_id), 'scheduled': scheduled}
+        records.append(record)
+        tasks.append(asyncio.create_task(post(session, url, payload, record)))
+        gap = rng.expovariate(rate) if poisson else 1 / rate
+        scheduled += gap
+    await asyncio.gather(*tasks)
+
+
+async def post(session, url, payload, record):
+    record['sent'] = time.monotonic()
+    try:
+        async with session.post(url, json=payload) as response:
+            record['status'] = response.status
+            await response.read()
+    except Exception as e:
+        record['status'] = f'error: {type(e).__name__}'
+    record['acked'] = time.monotonic()
+
+
+async def drain(stubs, quiet, timeout):
+    """รอจนบอทไม่มี Bot API call ใหม่นาน `quiet` วินาที (หรือครบ timeout)"""
+    deadline = time.monotonic() + timeout
+    last_count = -1
+    last_change = time.monotonic()
+    while time.monotonic() < deadline:
+        count = len(stubs.telegram_log)
+        if count != last_count:
+            last_count = count
+            last_change = time.monotonic()
+        elif time.monotonic() - last_change >= quiet:
+            return
+        await asyncio.sleep(0.25)
+
+
+def attach_bot_calls(stubs, records):
+    calls = defaultdict(list)
+    for timestamp, method, chat_id in list(stubs.telegram_log):
+        if chat_id is not None:
+            calls[chat_id].append(timestamp)
+    for record in records:
+        timestamps = calls.get(record['chat_id'])
+        if timestamps and 'sent' in record:
+            record['queueing'] = min(timestamps) - record['sent']
+            record['completion'] = max(timestamps) - record['sent']
+            record['bot_calls'] = len(timestamps)
+
+
+def summarize(records, duration):
+    by_kind = defaultdict(list)
+    for record in records:
+        by_kind[record['kind']].append(record)
+    by_kind['ALL'] = records
+
+    header = (f"{'kind':<13}{'n':>6}{'done':>6}{'queue p50':>11}{'p95':>8}{'p99':>8}"
+              f"{'complete p50':>14}{'p95':>8}{'p99':>8}")
+    print(header)
+    print('─' * len(header))
+    for kind in sorted(by_kind, key=lambda k: (k == 'ALL', k)):
+        items = by_kind[kind]
+        done = [r for r in items if 'completion' in r]
+        queueing = [r['queueing'] for r in done]
+        completion = [r['completion'] for r in done]
+        print(f"{kind:<13}{len(items):>6}{len(done):>6}"
+              f"{percentile(queueing, 50):>11.2f}{percentile(queueing, 95):>8.2f}{percentile(queueing, 99):>8.2f}"
+              f"{percentile(completion, 50):>14.2f}{percentile(completion, 95):>8.2f}{percentile(completion, 99):>8.2f}")
+
+    failed = [r for r in records if r.get('status') != 200]
+    print(f"\nsent {len(records)} updates in {duration:.0f}s "
+          f"({len(records) / duration:.2f}/s), webhook errors: {len(failed)}")
+
+
+def write_csv(path, records):
+    fields = ['kind', 'chat_id', 'status', 'scheduled', 'sent', 'acked', 'queueing', 'completion', 'bot_calls']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records)
+
+
+async def main_async(args):
+    stubs = StubUpstreams(configs=build_configs(args), news_per_symbol=args.news_per_symbol).start()
+    bot = None
+    try:
+        if args.target:
+            url = args.target
+            print(f"Target bot must use TELEGRAM_API_BASE_URL={stubs.urls['telegram']} for completion tracking")
+        else:
+            port = free_port()
+            bot = spawn_bot(stubs, port, dict(value.split('=', 1) for value in args.bot_env or []))
+            if not wait_for_port(port, args.startup_timeout):
+                raise SystemExit('bot did not open its webhook port in time')
+            url = f'http://127.0.0.1:{port}/{BOT_TOKEN}'
+
+        factory = UpdateFactory(DEFAULT_MIX, args.zipf, args.seed)
+        records = []
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await fire(session, url, factory, args.rate, args.duration, not args.constant, records)
+        await drain(stubs, args.drain, args.drain_timeout)
+        attach_bot_calls(stubs, records)
+        summarize(records, args.duration)
+        if args.csv:
+            write_csv(args.csv, records)
+    finally:
+        if bot:
+            bot.terminate()
+            try:
+                bot.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+        stubs.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=2.0, help='updates per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--constant', action='store_true', help='constant gaps instead of Poisson arrivals')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent for symbol popularity')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--target', help='webhook URL of an already running bot (default: spawn one)')
+    parser.add_argument('--bot-env', action='append', metavar='KEY=VALUE', help='extra env for the spawned bot')
+    parser.add_argument('--startup-timeout', type=float, default=30.0)
+    parser.add_argument('--drain', type=float, default=5.0, help='quiet seconds that mark the end of the run')
+    parser.add_argument('--drain-timeout', type=float, default=600.0)
+    parser.add_argument('--news-per-symbol', type=int, default=40)
+    parser.add_argument('--latency', action='append', metavar='PROVIDER=SECONDS')
+    parser.add_argument('--jitter', action='append', metavar='PROVIDER=SECONDS')
+    parser.add_argument('--error-rate', action='append', metavar='PROVIDER=P')
+    parser.add_argument('--rate-limit-rate', action='append', metavar='PROVIDER=P')
+    parser.add_argument('--csv', help='write one row per update to this file')
+    args = parser.parse_args(argv)
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
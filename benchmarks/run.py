@@ -0,0 +1,219 @@
+"""Benchmark handler จริงของบอทกับ stub upstream (ไม่ต้องมี API key / network)
+
+ตัวอย่าง:
+    python benchmarks/run.py
+    python benchmarks/run.py --iterations 20 --concurrency 4 --commands news ai
+    python benchmarks/run.py --latency gemini=3.0 --error-rate twelvedata=0.2 --json result.json
+
+รายงาน p50/p95/p99, throughput และจำนวนการเรียก upstream ต่อการรัน 1 ครั้งของแต่ละคำสั่ง
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import PROVIDERS, StubUpstreams, default_configs  # noqa: E402
+
+COMMANDS = ('symbol', 'news', 'ai', 'aiplus', 'compare', 'category', 'inline', 'chart', 'backtest')
+SYMBOLS = ('AAPL', 'MSFT', 'NVDA', 'TSLA', 'AMZN', 'META', 'GOOGL', 'AMD')
+CATEGORIES = ('cat_toppicks', 'cat_ai_tech', 'cat_finance', 'cat_energy')
+CHAT_ID = 424242
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_message_update(update_id, text, chat_id=CHAT_ID):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_inline_update(update_id, query, chat_id=CHAT_ID):
+    return {
+        'update_id': update_id,
+        'inline_query': {
+            'id': str(update_id),
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'query': query,
+            'offset': '',
+        },
+    }
+
+
+class Bench:
+    def __init__(self, stubs):
+        self.stubs = stubs
+        self.update_id = 0
+
+    async def setup(self):
+        os.environ.update(self.stubs.env())
+        import stock_bot
+        from telegram.ext import Application
+
+        self.stock_bot = stock_bot
+        self.application = Application.builder() \
+            .token('123456:STUB') \
+            .base_url(f"{self.stubs.urls['telegram']}/bot") \
+            .request(stock_bot.InstrumentedRequest(connection_pool_size=64)) \
+            .updater(None) \
+            .build()
+        stock_bot.register_handlers(self.application)
+        await self.application.initialize()
+
+    async def teardown(self):
+        await self.application.shutdown()
+        # เหมือน post_shutdown ของบอท (ไม่เขียน snapshot): ไม่ให้ worker ให้คะแนนข่าวยิง upstream หลังปิด stub
+        await asyncio.to_thread(self.stock_bot.SENTIMENT.stop)
+
+    def _next_update_id(self):
+        self.update_id += 1
+        return self.update_id
+
+    async def run_once(self, command, index):
+        from telegram import Update
+
+        symbol = SYMBOLS[index % len(SYMBOLS)]
+        if command == 'aiplus':
+            # เรียก perform_aiplus_analysis ตรงๆ กับข้อความ placeholder (เหมือนกดปุ่มหุ้น)
+            placeholder = await self.application.bot.send_message(CHAT_ID, f"🚀 กำลังวิเคราะห์ {symbol}...")
+            await self.stock_bot.perform_aiplus_analysis(placeholder, symbol)
+            return
+        if command == 'category':
+            # ปุ่ม "วิเคราะห์ทั้งหมวด" (AI คำขอเดียวทั้งหมวด)
+            category = CATEGORIES[index % len(CATEGORIES)]
+            placeholder = await self.application.bot.send_message(CHAT_ID, f"🧠 กำลังวิเคราะห์ {category}...")
+            await self.stock_bot.perform_category_analysis(placeholder, category)
+            return
+        if command == 'inline':
+            # @bot SYMBOL (ครั้งแรกของแต่ละ symbol ต้องดึงข้อมูล ครั้งถัดไปอ่านการ์ดจาก cache)
+            update = Update.de_json(make_inline_update(self._next_update_id(), symbol), self.application.bot)
+            await self.application.process_update(update)
+            return
+        text = {
+            'symbol': symbol,
+            'news': f'/news {symbol}',
+            'ai': f'/ai {symbol}',
+            'compare': f'/compare {symbol} {SYMBOLS[(index + 1) % len(SYMBOLS)]}',
+            'chart': f'/chart {symbol}',
+            'backtest': f'/backtest {symbol}',
+        }[command]
+        update = Update.de_json(make_message_update(self._next_update_id(), text), self.application.bot)
+        await self.application.process_update(update)
+
+    async def run_command(self, command, iterations, concurrency):
+        latencies = []
+        errors = 0
+        before = self.stubs.snapshot_calls()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(index):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await self.run_once(command, index)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(iterations)))
+        wall = time.perf_counter() - wall_start
+
+        calls = self.stubs.snapshot_calls() - before
+        per_provider = Counter()
+        for (provider, _endpoint), count in calls.items():
+            per_provider[provider] += count
+        return {
+            'command': command,
+            'iterations': iterations,
+            'concurrency': concurrency,
+            'errors': errors,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': statistics.fmean(latencies) if latencies else 0.0,
+            'throughput': iterations / wall if wall else 0.0,
+            'upstream_calls_per_run': {p: round(per_provider[p] / iterations, 2) for p in PROVIDERS},
+            'upstream_endpoints': {f'{p}.{e}': c for (p, e), c in sorted(calls.items())},
+        }
+
+
+def build_configs(args):
+    """รวม --latency / --jitter / --error-rate / --rate-limit-rate เข้ากับค่า default"""
+    configs = default_configs()
+    for field, values in (('latency', args.latency), ('jitter', args.jitter),
+                          ('error_rate', args.error_rate), ('rate_limit_rate', args.rate_limit_rate)):
+        for value in values or []:
+            provider, _, number = value.partition('=')
+            if provider not in PROVIDERS:
+                raise SystemExit(f"unknown provider '{provider}' (choose from {', '.join(PROVIDERS)})")
+            setattr(configs[provider], field, float(number))
+    return configs
+
+
+def print_report(results):
+    header = f"{'command':<10}{'n':>5}{'err':>5}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'req/s':>8}  upstream calls / run"
+    print(header)
+    print('─' * len(header))
+    for r in results:
+        calls = ', '.join(f"{p}={c:g}" for p, c in r['upstream_calls_per_run'].items() if c)
+        print(f"{r['command']:<10}{r['iterations']:>5}{r['errors']:>5}{r['p50']:>9.3f}{r['p95']:>9.3f}"
+              f"{r['p99']:>9.3f}{r['throughput']:>8.2f}  {calls}")
+
+
+async def main_async(args):
+    stubs = StubUpstreams(configs=build_configs(args), news_per_symbol=args.news_per_symbol).start()
+    bench = Bench(stubs)
+    try:
+        await bench.setup()
+        results = []
+        for command in args.commands:
+            results.append(await bench.run_command(command, args.iterations, args.concurrency))
+        await bench.teardown()
+    finally:
+        stubs.stop()
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--commands', nargs='+', default=list(COMMANDS), choices=COMMANDS)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--news-per-symbol', type=int, default=40)
+    parser.add_argument('--latency', action='append', metavar='PROVIDER=SECONDS')
+    parser.add_argument('--jitter', action='append', metavar='PROVIDER=SECONDS')
+    parser.add_argument('--error-rate', action='append', metavar='PROVIDER=P')
+    parser.add_argument('--rate-limit-rate', action='append', metavar='PROVIDER=P')
+    parser.add_argument('--json', help='write raw results to this file')
+    args = parser.parse_args(argv)
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+"""Stub server ของ upstream ทั้งหมดสำหรับ benchmark แบบ offline
+
+แต่ละ provider รันเป็น aiohttp app บนพอร์ตของตัวเองใน thread แยก
+(บอทเรียก upstream แบบ blocking จึงต้องไม่ใช้ event loop เดียวกับบอท)
+
+ตั้งค่า latency / error ต่อ provider ได้ผ่าน StubConfig และนับจำนวนครั้งที่ถูกเรียก
+แยกตาม provider และ endpoint
+"""
+import asyncio
+import calendar
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from aiohttp import web
+
+PROVIDERS = ('twelvedata', 'finnhub', 'supabase', 'translate', 'gemini', 'groq', 'telegram')
+
+# JWT รูปแบบถูกต้องพอให้ supabase-py ยอมรับ
+FAKE_SUPABASE_KEY = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.c3R1Yg'
+
+
+@dataclass
+class StubConfig:
+    """latency เป็นวินาที, error_rate / rate_limit_rate เป็นความน่าจะเป็นต่อ request"""
+    latency: float = 0.05
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+
+
+def _seed(*parts):
+    return int(hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()[:8], 16)
+
+
+def _price(symbol):
+    return 20 + _seed(symbol) % 480
+
+
+# latency ของ yfinance stand-in (เรียกใน process ของบอทโดยตรง ไม่ผ่าน HTTP)
+YF_LATENCY = 0.3
+
+
+def yf_download(tickers, period=None, start=None, interval='1d', group_by='column', **kwargs):
+    """stand-in ของ yfinance.download: คืน DataFrame คอลัมน์ (ticker, field) แบบ group_by='ticker'
+
+    ราคาสุ่มแบบ deterministic ต่อ symbol และต่อเนื่องกับราคา quote ของ stub Twelve Data
+    """
+    import numpy as np
+    import pandas as pd
+
+    time.sleep(YF_LATENCY)
+    if isinstance(tickers, str):
+        tickers = tickers.split()
+    days = {'5d': 5, '1mo': 22, '1y': 252, '5y': 1260, '20y': 5040}.get(period, 5040)
+    if start:
+        days = max(1, (pd.Timestamp.utcnow().tz_localize(None) - pd.Timestamp(start)).days)
+    index = pd.bdate_range(end=pd.Timestamp.utcnow().normalize().tz_localize(None), periods=days)
+    frames = {}
+    for ticker in tickers:
+        rng = np.random.default_rng(_seed(ticker, 'yf'))
+        returns = rng.normal(0, 0.015, days)
+        close = _price(ticker) / np.exp(np.cumsum(returns[::-1]))[::-1] * np.exp(returns[-1])
+        frames[ticker] = pd.DataFrame({
+            'Open': close * (1 - returns / 2), 'High': close * 1.01, 'Low': close * 0.99,
+            'Close': close, 'Adj Close': close, 'Volume': rng.integers(10 ** 5, 10 ** 7, days).astype(float),
+        }, index=index)
+    return pd.concat(frames, axis=1)
+
+
+def default_configs():
+    """latency ตั้งต้นใกล้เคียงของจริงคร่าวๆ (LLM ช้ากว่า data API มาก)"""
+    configs = {name: StubConfig() for name in PROVIDERS}
+    configs['gemini'] = StubConfig(latency=1.5)
+    configs['groq'] = StubConfig(latency=0.8)
+    configs['telegram'] = StubConfig(latency=0.03)
+    return configs
+
+
+class StubUpstreams:
+    """รวม stub ของทุก provider และตัวนับการเรียก"""
+
+    def __init__(self, configs=None, news_per_symbol=40, seed=0):
+        self.configs = default_configs()
+        self.configs.update(configs or {})
+        self.news_per_symbol = news_per_symbol
+        self.calls = Counter()
+        self.urls = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._runners = []
+        self._message_id = 0
+        self.telegram_log = []  # (timestamp, method, chat_id)
+
+    # --- lifecycle ---
+
+    def start(self):
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name='stub-upstreams', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop:
+            future = asyncio.run_coroutine_threadsafe(self._cleanup(), self._loop)
+            future.result(timeout=10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+
+    def _run(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start_sites())
+        ready.set()
+        self._loop.run_forever()
+
+    async def _start_sites(self):
+        for name in PROVIDERS:
+            app = web.Application(middlewares=[self._middleware(name)])
+            app.router.add_route('*', '/{tail:.*}', getattr(self, f'_handle_{name}'))
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            self.urls[name] = f'http://127.0.0.1:{port}'
+            self._runners.append(runner)
+
+    async def _cleanup(self):
+        for runner in self._runners:
+            await runner.cleanup()
+
+    def env(self):
+        """environment สำหรับ stock_bot ให้เรียก stub แทน upstream จริง"""
+        return {
+            'TWELVE_DATA_KEY': 'stub',
+            'FINNHUB_KEY': 'stub',
+            'GEMINI_API_KEY': 'stub',
+            'GROQ_API_KEY': 'stub',
+            'SUPABASE_URL': self.urls['supabase'],
+            'SUPABASE_KEY': FAKE_SUPABASE_KEY,
+            'TWELVE_DATA_BASE_URL': self.urls['twelvedata'],
+            'FINNHUB_BASE_URL': f"{self.urls['finnhub']}/api/v1",
+            'GEMINI_API_ENDPOINT': self.urls['gemini'],
+            'GROQ_BASE_URL': self.urls['groq'],
+            'GOOGLE_TRANSLATE_URL': f"{self.urls['translate']}/m",
+            'TELEGRAM_API_BASE_URL': self.urls['telegram'],
+            'METRICS_PORT': '',
+            # cache ใหม่ทุกรัน (ไม่ใช้ไฟล์ SQLite ที่ค้างจากรันก่อน) เว้นแต่กำหนด CACHE_URL เอง
+            'CACHE_URL': os.environ.get('CACHE_URL', 'memory://'),
+            'YFINANCE_DOWNLOAD': 'benchmarks.stubs:yf_download',
+            # ทุกคำขอมาจาก chat เดียว จึงปิด rate/quota ต่อผู้ใช้ (กำหนดเองได้ถ้าต้องการวัดผลของมัน)
+            'COMMAND_RATE_LIMITS': os.environ.get('COMMAND_RATE_LIMITS', ''),
+            'COMMAND_DAILY_QUOTAS': os.environ.get('COMMAND_DAILY_QUOTAS', ''),
+        }
+
+    def snapshot_calls(self):
+        with self._lock:
+            return Counter(self.calls)
+
+    # --- latency / error injection ---
+
+    def _middleware(self, provider):
+        @web.middleware
+        async def middleware(request, handler):
+            endpoint = request.path.rsplit('/', 1)[-1] or '/'
+            if provider == 'gemini':
+                endpoint = endpoint.split(':')[-1]
+            with self._lock:
+                self.calls[(provider, endpoint)] += 1
+                roll = self._random.random()
+            config = self.configs[provider]
+            delay = config.latency + (self._random.uniform(0, config.jitter) if config.jitter else 0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if roll < config.rate_limit_rate:
+                if provider == 'twelvedata':
+                    return web.json_response({'status': 'error', 'code': 429, 'message': 'stub rate limit'})
+                if provider == 'telegram':
+                    return web.json_response(
+                        {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                         'parameters': {'retry_after': 1}}, status=429)
+                return web.json_response({'error': {'code': 429, 'message': 'quota exceeded'}}, status=429)
+            if roll < config.rate_limit_rate + config.error_rate:
+                if provider == 'telegram':
+                    return web.json_response(
+                        {'ok': False, 'error_code': 500, 'description': 'stub error'}, status=500)
+                return web.json_response({'error': {'code': 500, 'message': 'stub error'}}, status=500)
+            return await handler(request)
+        return middleware
+
+    # --- providers ---
+
+    async def _handle_twelvedata(self, request):
+        endpoint = request.path.strip('/')
+        symbol = request.query.get('symbol', 'AAPL').upper()
+        price = _price(symbol)
+        if endpoint == 'quote':
+            if ',' in symbol:
+                return web.json_response({s: self._quote(s) for s in symbol.split(',')})
+            return web.json_response(self._quote(symbol))
+        if endpoint == 'rsi':
+            return web.json_response({'status': 'ok', 'values': [{'rsi': str(20 + _seed(symbol, 'rsi') % 60)}]})
+        if endpoint == 'macd':
+            macd = (_seed(symbol, 'macd') % 200 - 100) / 25
+            return web.json_response({'status': 'ok', 'values': [
+                {'macd': str(macd), 'macd_signal': str(macd * 0.8), 'macd_hist': str(macd * 0.2)}]})
+        if endpoint == 'ema':
+            period = int(request.query.get('time_period', 20))
+            return web.json_response({'status': 'ok', 'values': [{'ema': str(price * (1 - period / 2000))}]})
+        if endpoint == 'bbands':
+            return web.json_response({'status': 'ok', 'values': [
+                {'upper_band': str(price * 1.05), 'middle_band': str(price), 'lower_band': str(price * 0.95)}]})
+        if endpoint == 'time_series':
+            return web.json_response(self._time_series(symbol, request.query))
+        return web.json_response({'status': 'error', 'code': 404, 'message': f'unknown endpoint {endpoint}'})
+
+    def _quote(self, symbol):
+        price = _price(symbol)
+        return {
+            'symbol': symbol, 'name': f'{symbol} Stub Inc.', 'close': str(price),
+            'previous_close': str(price * 0.99), 'open': str(price * 0.995),
+            'high': str(price * 1.01), 'low': str(price * 0.98), 'volume': '1000000',
+        }
+
+    def _time_series(self, symbol, query):
+        outputsize = int(query.get('outputsize', 30))
+        rng = random.Random(_seed(symbol, 'series'))
+        price = float(_price(symbol))
+        now = int(time.time()) // 86400 * 86400
+        values = []
+        for day in range(outputsize):
+            change = rng.gauss(0, 0.015)
+            close = price
+            price = price / (1 + change)
+            values.append({
+                'datetime': time.strftime('%Y-%m-%d', time.gmtime(now - day * 86400)),
+                'open': f'{price:.4f}', 'high': f'{max(price, close) * 1.005:.4f}',
+                'low': f'{min(price, close) * 0.995:.4f}', 'close': f'{close:.4f}',
+                'volume': str(rng.randint(10 ** 5, 10 ** 7)),
+            })
+        return {'meta': {'symbol': symbol, 'interval': '1day'}, 'values': values, 'status': 'ok'}
+
+    async def _handle_finnhub(self, request):
+        endpoint = request.path.rsplit('/', 1)[-1]
+        symbol = request.query.get('symbol', 'AAPL').upper()
+        price = _price(symbol)
+        if endpoint == 'recommendation':
+            return web.json_response([{'buy': 20, 'hold': 8, 'sell': 2, 'strongBuy': 5, 'strongSell': 0,
+                                       'period': '2026-10-01', 'symbol': symbol}])
+        if endpoint == 'price-target':
+            return web.json_response({'symbol': symbol, 'targetMean': price * 1.12, 'targetHigh': price * 1.4,
+                                      'targetLow': price * 0.8, 'numberOfAnalysts': 30})
+        if endpoint == 'quote':
+            return web.json_response({'c': price, 'pc': price * 0.99, 'o': price * 0.995,
+                                      'h': price * 1.01, 'l': price * 0.98, 't': int(time.time())})
+        if endpoint == 'company-news':
+            now = int(time.time())
+            since = calendar.timegm(time.strptime(request.query['from'], '%Y-%m-%d')) if 'from' in request.query else 0
+            news = [{
+                'id': _seed(symbol) % 10 ** 6 * 1000 + i,
+                'datetime': now - i * 3600,
+                'headline': f'{symbol} headline number {i}: revenue beats estimates as demand grows',
+                'summary': f'{symbol} reported results for item {i}. ' * 8,
+                'source': 'StubWire', 'url': f'https://example.com/{symbol}/{i}',
+                'category': 'company', 'related': symbol, 'image': '',
+            } for i in range(self.news_per_symbol) if now - i * 3600 >= since]
+            return web.json_response(news)
+        return web.json_response({'error': 'unknown endpoint'}, status=404)
+
+    async def _handle_supabase(self, request):
+        symbol = request.query.get('symbol', 'eq.AAPL').split('.', 1)[-1].upper()
+        price = _price(symbol)
+        return web.json_response([{
+            'symbol': symbol, 'rsi': 48.5, 'macd': 1.2, 'macd_signal': 0.9,
+            'ema_20': price * 0.99, 'ema_50': price * 0.97, 'ema_200': price * 0.9,
+            'bb_lower': price * 0.95, 'bb_upper': price * 1.05,
+            'recorded_at': '2026-10-18T16:00:00+00:00',
+        }])
+
+    async def _handle_translate(self, request):
+        text = request.query.get('q', '')
+        return web.Response(
+            text=f'<html><body><div class="result-container">[TH] {text}</div></body></html>',
+            content_type='text/html')
+
+    def _llm_text(self):
+        return (
+            "1. สรุปภาพรวม: ข่าวส่วนใหญ่เป็นบวก\n"
+            "2. ผลกระทบต่อหุ้น:\n🟢 ข่าวที่ 1\n🟢 ข่าวที่ 2\n🟡 ข่าวที่ 3\n🟢 ข่าวที่ 4\n🔴 ข่าวที่ 5\n"
+            "3. คะแนนความเชื่อมั่น: +4\n"
+        )
+
+    def _llm_json(self, prompt=''):
+        """คำตอบ JSON ที่มีทุก field ของ schema ข่าว, คะแนนรายหัวข้อข่าว, วิเคราะห์แบบรวม, จัดอันดับทั้งหมวด และเปรียบเทียบ
+
+        หุ้นใน 'stocks' คือ symbol ที่ขึ้นต้นบรรทัดข้อมูลเทคนิคใน prompt (หรือบรรทัด "หุ้น SYMBOL:" ของ /compare)
+        รายการใน 'headlines' คือบรรทัดหัวข้อข่าวที่ขึ้นต้นด้วยเลข ("1. ...")
+        """
+        sentiments = ['positive', 'positive', 'neutral', 'positive', 'negative']
+        symbols = re.findall(r'^([A-Z][A-Z.]{0,5}) \$', prompt, re.MULTILINE) \
+            or re.findall(r'^หุ้น ([A-Z][A-Z.]{0,5}):', prompt, re.MULTILINE)
+        headlines = [int(i) for i in re.findall(r'^(\d+)\. ', prompt, re.MULTILINE)]
+        return json.dumps({
+            'stocks': [{'symbol': symbol, 'score': _seed('score', symbol) % 21 - 10, 'signal': 'neutral',
+                        'news': 'neutral', 'action': 'wait', 'reason': f'สัญญาณของ {symbol} ยังไม่ชัด',
+                        'technical_score': 3, 'valuation_score': 2, 'news_score': 4,
+                        'overall_score': _seed('score', symbol) % 21 - 10, 'weakness': 'ราคาผันผวนสูง'}
+                       for symbol in symbols],
+            'winners': {area: symbols[0] if symbols else '' for area in ('technical', 'valuation', 'news')},
+            'timeframes': [{'term': term, 'pick': symbols[0] if symbols else '', 'reason': 'เทรนด์ยังแข็งแรง',
+                            'entry': 98.0, 'stop_loss': 88.0, 'target': 120.0,
+                            'confidence': 'medium', 'risk': 'medium'} for term in ('short', 'mid', 'long')],
+            'pick': symbols[0] if symbols else '', 'strategy': 'ทยอยซื้อแบบ DCA',
+            'headlines': [{'i': i, 'sentiment': sentiments[i % 5], 'score': (i % 5) - 1,
+                           'gist': f'ใจความของข่าวที่ {i}'} for i in headlines],
+            'summary': 'ข่าวส่วนใหญ่เป็นบวก',
+            'news': [{'i': i, 'sentiment': s, 'impact': f'ผลกระทบของข่าวที่ {i}'}
+                     for i, s in enumerate(sentiments, 1)],
+            'score': 4,
+            'key_points': ['รายได้เติบโต', 'ต้นทุนสูงขึ้น'],
+            'news_score': 4,
+            'technical': {'signal': 'bullish', 'rsi': 'Neutral', 'macd': 'Bullish Crossover',
+                          'ema': 'Uptrend', 'bollinger': 'กลางแบนด์', 'score': 3},
+            'support': [95.0, 90.0], 'resistance': [110.0, 120.0],
+            'valuation': {'analyst_view': 'Buy 60%', 'margin_of_safety': 'medium'},
+            'conflicts': [], 'risk': 'medium', 'timeframe': 'mid', 'action': 'wait',
+            'entry': {'price': 98.0, 'reason': 'รอย่อใกล้แนวรับ'},
+            'stop_loss': 88.0, 'take_profit': [110.0, 120.0], 'overall_score': 3,
+        }, ensure_ascii=False)
+
+    async def _handle_gemini(self, request):
+        body = await request.json()
+        wants_json = body.get('generationConfig', {}).get('responseMimeType') == 'application/json'
+        prompt = ''.join(part.get('text', '') for content in body.get('contents', [])
+                         for part in content.get('parts', []))
+        text = self._llm_json(prompt) if wants_json else self._llm_text()
+        return web.json_response({
+            'candidates': [{
+                'content': {'parts': [{'text': text}], 'role': 'model'},
+                'finishReason': 'STOP', 'index': 0,
+            }],
+            'usageMetadata': {'promptTokenCount': 1000, 'candidatesTokenCount': 200, 'totalTokenCount': 1200},
+        })
+
+    async def _handle_groq(self, request):
+        body = await request.json()
+        wants_json = (body.get('response_format') or {}).get('type') == 'json_object'
+        prompt = ''.join(str(message.get('content', '')) for message in body.get('messages', []))
+        text = self._llm_json(prompt) if wants_json else self._llm_text()
+        return web.json_response({
+            'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 1000, 'completion_tokens': 200, 'total_tokens': 1200},
+        })
+
+    async def _handle_telegram(self, request):
+        method = request.path.rsplit('/', 1)[-1]
+        if request.content_type == 'application/json':
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        chat_id = data.get('chat_id')
+        with self._lock:
+            self.telegram_log.append((time.monotonic(), method, str(chat_id) if chat_id is not None else None))
+        if method == 'getMe':
+            return self._ok({'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot',
+                             'can_join_groups': True, 'can_read_all_group_messages': False,
+                             'supports_inline_queries': True})
+        if method in ('sendMessage', 'editMessageText', 'sendPhoto'):
+            with self._lock:
+                self._message_id += 1
+                message_id = self._message_id
+            message = {
+                'message_id': int(data.get('message_id') or message_id),
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id or 0), 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'Stub'},
+            }
+            if method == 'sendPhoto':
+                message['photo'] = [{'file_id': f'stub-photo-{message_id}', 'file_unique_id': f'u{message_id}',
+                                     'width': 1200, 'height': 800}]
+            else:
+                message['text'] = data.get('text', '')
+            return self._ok(message)
+        return self._ok(True)
+
+    @staticmethod
+    def _ok(result):
+        return web.Response(text=json.dumps({'ok': True, 'result': result}), content_type='application/json')
@@ -0,0 +1,299 @@
+"""Cache backend ที่แชร์กันได้ระหว่าง worker process
+
+เลือก backend ด้วย CACHE_URL:
+    sqlite:///path/to/cache.sqlite3   (default, โหมด WAL ใช้ร่วมกันหลาย process บนเครื่องเดียว)
+    redis://host:6379/0               (ต้องติดตั้ง redis-py; ใช้ได้กับ server ที่พูด Redis protocol)
+    memory://                         (ใน process เดียว)
+
+ค่าใน cache ต้องแปลงเป็น JSON ได้ แยกกลุ่มด้วย namespace เช่น market, translate, ai, supabase
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(*parts):
+    """สร้าง key สั้นๆ คงที่จากส่วนประกอบใดๆ ที่ JSON ได้"""
+    body = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+class CacheBackend:
+    """interface ของ backend: get/set/delete ตาม (namespace, key) พร้อม TTL เป็นวินาที"""
+
+    name = 'base'
+    snapshot = None  # CacheSnapshot ที่ restore มาตอนเริ่ม process (อ่านแบบ lazy เมื่อ cache miss)
+
+    def get(self, namespace, key):
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, namespace, key):
+        raise NotImplementedError
+
+    def items(self, namespace):
+        """คืน (key, value, expires_at) ของรายการที่ยังไม่หมดอายุ (ใช้ทำ snapshot)"""
+        raise NotImplementedError
+
+    def incr(self, namespace, key, ttl):
+        """เพิ่มตัวนับทีละ 1 แบบ atomic คืนค่าหลังเพิ่ม (TTL นับจากครั้งแรกที่สร้างตัวนับ)"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def lookup(self, namespace, key):
+        """get ที่ตกไปอ่าน snapshot เมื่อ backend หลักไม่มีค่า (ทางอ่านเดียวของทุกผู้ใช้ cache)"""
+        value = self.get(namespace, key)
+        if value is None and self.snapshot is not None:
+            value = self._get_from_snapshot(namespace, key)
+        return value
+
+    def _get_from_snapshot(self, namespace, key):
+        """ดึงจาก snapshot แล้วย้ายเข้า backend หลักด้วย TTL ที่เหลือ"""
+        found = self.snapshot.get(namespace, key)
+        if found is None:
+            return None
+        value, expires_at = found
+        self.set(namespace, key, value, expires_at - time.time())
+        return value
+
+    def get_or_compute(self, namespace, key, ttl, compute, should_cache=None):
+        """คืนค่าจาก cache หรือเรียก compute() แล้วเก็บผล
+
+        ไม่เก็บ None และไม่เก็บผลที่ should_cache(value) คืน False (เช่น error จาก API)
+        """
+        try:
+            value = self.lookup(namespace, key)
+        except Exception as e:
+            # cache พังต้องไม่ทำให้คำสั่งพัง ให้ไปดึงจาก upstream แทน
+            logger.warning(f"⚠️ Cache get failed ({self.name}/{namespace}): {e}")
+            value = None
+        metrics.record_cache(namespace, hit=value is not None)
+        if value is not None:
+            return value
+        value = compute()
+        if value is not None and (should_cache is None or should_cache(value)):
+            try:
+                self.set(namespace, key, value, ttl)
+            except Exception as e:
+                logger.warning(f"⚠️ Cache set failed ({self.name}/{namespace}): {e}")
+        return value
+
+
+class MemoryBackend(CacheBackend):
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, namespace, key):
+        with self._lock:
+            item = self._data.get((namespace, key))
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._data[(namespace, key)]
+                return None
+            return value
+
+    def set(self, namespace, key, value, ttl):
+        with self._lock:
+            self._data[(namespace, key)] = (value, time.time() + ttl)
+            if len(self._data) % 1000 == 0:
+                self._purge_expired()
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+    def incr(self, namespace, key, ttl):
+        with self._lock:
+            value, expires_at = self._data.get((namespace, key), (0, 0))
+            if expires_at < time.time():
+                value, expires_at = 0, time.time() + ttl
+            self._data[(namespace, key)] = (value + 1, expires_at)
+            return value + 1
+
+    def items(self, namespace):
+        now = time.time()
+        with self._lock:
+            entries = list(self._data.items())
+        for (item_namespace, key), (value, expires_at) in entries:
+            if item_namespace == namespace and expires_at >= now:
+                yield key, value, expires_at
+
+    def _purge_expired(self):
+        now = time.time()
+        for item_key in [k for k, (_, expires_at) in self._data.items() if expires_at < now]:
+            del self._data[item_key]
+
+
+class SQLiteBackend(CacheBackend):
+    """SQLite โหมด WAL: หลาย process อ่านพร้อมกันได้ เขียนทีละ process"""
+
+    name = 'sqlite'
+    purge_every = 1000  # ลบแถวที่หมดอายุทุกๆ กี่ครั้งที่เขียน (process ที่รันนานไม่สะสมแถวตาย)
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            ' namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL, PRIMARY KEY (namespace, key)) WITHOUT ROWID'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires_at)')
+        self._purge_expired()
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connection ใช้ข้าม thread ไม่ได้ จึงเปิดแยกต่อ thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=10000')
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, key):
+        row = self._connection().execute(
+            'SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at >= ?',
+            (namespace, key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace, key, value, ttl):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+            (namespace, key, json.dumps(value, ensure_ascii=False, separators=(',', ':')), time.time() + ttl),
+        )
+        self._count_write()
+
+    def _count_write(self):
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % self.purge_every == 0
+        if due:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        self._connection().execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+
+    def delete(self, namespace, key):
+        self._connection().execute('DELETE FROM cache WHERE namespace = ? AND key = ?', (namespace, key))
+
+    def incr(self, namespace, key, ttl):
+        # เพิ่มใน statement เดียวภายใต้ write lock ของ SQLite จึงไม่หายเมื่อหลาย worker นับพร้อมกัน
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO cache (namespace, key, value, expires_at) VALUES (?, ?, 1, ?)'
+                ' ON CONFLICT (namespace, key) DO UPDATE SET'
+                ' value = CASE WHEN expires_at < ? THEN 1 ELSE CAST(value AS INTEGER) + 1 END,'
+                ' expires_at = CASE WHEN expires_at < ? THEN excluded.expires_at ELSE expires_at END',
+                (namespace, key, now + ttl, now, now),
+            )
+            row = conn.execute('SELECT value FROM cache WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return int(row[0])
+
+    def items(self, namespace):
+        rows = self._connection().execute(
+            'SELECT key, value, expires_at FROM cache WHERE namespace = ? AND expires_at >= ?',
+            (namespace, time.time()),
+        )
+        for key, value, expires_at in rows:
+            yield key, json.loads(value), expires_at
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisBackend(CacheBackend):
+    name = 'redis'
+
+    def __init__(self, url):
+        import redis  # optional dependency
+        self._client = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _redis_key(namespace, key):
+        return f"stockbot:{namespace}:{key}"
+
+    def get(self, namespace, key):
+        raw = self._client.get(self._redis_key(namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, namespace, key, value, ttl):
+        payload = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        self._client.set(self._redis_key(namespace, key), payload, ex=max(1, int(ttl)))
+
+    def delete(self, namespace, key):
+        self._client.delete(self._redis_key(namespace, key))
+
+    def incr(self, namespace, key, ttl):
+        redis_key = self._redis_key(namespace, key)
+        value = self._client.incr(redis_key)
+        if value == 1:
+            self._client.expire(redis_key, max(1, int(ttl)))
+        return int(value)
+
+    def items(self, namespace):
+        prefix = self._redis_key(namespace, '')
+        now = time.time()
+        for redis_key in self._client.scan_iter(match=f"{prefix}*", count=500):
+            raw = self._client.get(redis_key)
+            ttl_ms = self._client.pttl(redis_key)
+            if raw is None or ttl_ms <= 0:
+                continue
+            key = redis_key.decode('utf-8')[len(prefix):]
+            yield key, json.loads(raw), now + ttl_ms / 1000
+
+    def close(self):
+        self._client.close()
+
+
+def create_backend(url):
+    """สร้าง backend จาก URL (ถ้าสร้างไม่ได้จะถอยไปใช้ memory)"""
+    try:
+        if url.startswith('sqlite:///'):
+            return SQLiteBackend(url[len('sqlite:///'):])
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            return RedisBackend(url)
+        if url.startswith('memory://'):
+            return MemoryBackend()
+        raise ValueError(f"unsupported CACHE_URL scheme: {url}")
+    except ImportError:
+        logger.error("❌ redis-py not installed. Install with: pip install redis")
+    except Exception as e:
+        logger.error(f"❌ Cannot open cache backend {url}: {e}")
+    logger.warning("⚠️ Falling back to in-memory cache")
+    return MemoryBackend()
@@ -0,0 +1,121 @@
+"""Snapshot ของ cache สำหรับเก็บตอนปิด process และ restore ตอนเริ่มใหม่
+
+รูปแบบไฟล์ (ต่อท้ายได้แบบ streaming ไม่ต้องถือข้อมูลทั้งหมดใน memory):
+    MAGIC | value (zlib JSON) ... | index (zlib JSON) | index offset (uint64) | MAGIC
+
+ตอน restore จะ mmap ไฟล์แล้วอ่านแค่ index ส่วนค่าจริงจะถูก decode ก็ต่อเมื่อมีการ
+ขอ key นั้น (lazy) startup จึงเร็วแม้ cache จะใหญ่
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SBCACHE1'
+_TRAILER = struct.Struct('<Q')
+
+
+def _encode(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def _live_items(backend, namespace):
+    """รายการใน backend รวมกับรายการจาก snapshot เดิมที่ยังไม่ถูกอ่าน (ไม่ให้หายตอน restart ติดกัน)"""
+    seen = set()
+    for key, value, expires_at in backend.items(namespace):
+        seen.add(key)
+        yield key, value, expires_at
+    if backend.snapshot is not None:
+        for key, value, expires_at in backend.snapshot.items(namespace):
+            if key not in seen:
+                yield key, value, expires_at
+
+
+def write_snapshot(backend, path, namespaces):
+    """เขียนรายการที่ยังไม่หมดอายุของ namespaces ลงไฟล์ (atomic) แล้วคืนจำนวนรายการ"""
+    index = {}
+    count = 0
+    tmp_path = f"{path}.{os.getpid()}.tmp"  # worker หลายตัวอาจเขียนพร้อมกัน
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        for namespace in namespaces:
+            entries = index.setdefault(namespace, {})
+            for key, value, expires_at in _live_items(backend, namespace):
+                data = _encode(value)
+                entries[key] = [f.tell(), len(data), round(expires_at, 3)]
+                f.write(data)
+                count += 1
+        index_offset = f.tell()
+        f.write(_encode({'created': time.time(), 'entries': index}))
+        f.write(_TRAILER.pack(index_offset))
+        f.write(MAGIC)
+    os.replace(tmp_path, path)
+    return count
+
+
+class CacheSnapshot:
+    """อ่าน snapshot แบบ lazy ผ่าน mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            tail = len(MAGIC) + _TRAILER.size
+            if self._mmap[:len(MAGIC)] != MAGIC or self._mmap[-len(MAGIC):] != MAGIC:
+                raise ValueError(f"not a cache snapshot: {path}")
+            (index_offset,) = _TRAILER.unpack(self._mmap[-tail:-len(MAGIC)])
+            header = json.loads(zlib.decompress(self._mmap[index_offset:len(self._mmap) - tail]))
+        except Exception:
+            self._file.close()
+            raise
+        self.created = header['created']
+        now = time.time()
+        # ตัดรายการที่หมดอายุแล้วทิ้งตั้งแต่ตอนโหลด index
+        self._index = {
+            namespace: {key: entry for key, entry in entries.items() if entry[2] > now}
+            for namespace, entries in header['entries'].items()
+        }
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._index.values())
+
+    def get(self, namespace, key):
+        """คืน (value, expires_at) หรือ None ถ้าไม่มี/หมดอายุ (แต่ละ key อ่านได้ครั้งเดียว)"""
+        entry = self._index.get(namespace, {}).pop(key, None)
+        if entry is None:
+            return None
+        offset, length, expires_at = entry
+        if expires_at <= time.time():
+            return None
+        return json.loads(zlib.decompress(self._mmap[offset:offset + length])), expires_at
+
+    def items(self, namespace):
+        """คืน (key, value, expires_at) ของรายการที่ยังไม่ถูกอ่านและยังไม่หมดอายุ"""
+        now = time.time()
+        for key, (offset, length, expires_at) in list(self._index.get(namespace, {}).items()):
+            if expires_at > now:
+                yield key, json.loads(zlib.decompress(self._mmap[offset:offset + length])), expires_at
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+def restore_snapshot(backend, path):
+    """แนบ snapshot เข้ากับ backend (ค่าจะถูกย้ายเข้า backend ตอนถูกขอครั้งแรก)"""
+    if not path or not os.path.exists(path):
+        return None
+    start = time.perf_counter()
+    snapshot = CacheSnapshot(path)
+    backend.snapshot = snapshot
+    age = time.time() - snapshot.created
+    logger.info(f"♻️ Restored cache snapshot: {len(snapshot)} live entries "
+                f"(age {age:.0f}s) in {time.perf_counter() - start:.3f}s")
+    return snapshot
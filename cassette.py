@@ -0,0 +1,175 @@
+"""บันทึก/เล่นซ้ำการเรียก upstream (cassette) เพื่อให้ benchmark และ regression run ซ้ำได้
+
+ตั้งค่าผ่าน environment:
+    CASSETTE_MODE     off (default) | record | replay
+    CASSETTE_DIR      โฟลเดอร์เก็บ cassette (default: cassettes)
+    CASSETTE_NAME     ชื่อไฟล์ cassette (default: default) -> <dir>/<name>.json.gz
+    CASSETTE_LATENCY  ตอน replay: 0 = ตอบทันที, 1 = หน่วงตาม latency ที่บันทึกไว้,
+                      ค่าอื่นเป็นตัวคูณ (เช่น 0.5)
+
+key ของแต่ละ request สร้างจาก provider + พารามิเตอร์ที่ตัด API key ออกแล้ว
+cassette จึงแชร์กันได้โดยไม่มี secret ติดไปด้วย พารามิเตอร์ช่วงวันที่ที่คำนวณจากเวลาปัจจุบัน
+(VOLATILE_PARAMS) ไม่อยู่ใน key: replay วันไหนก็ได้ผลตามลำดับที่บันทึกไว้ของ endpoint + symbol นั้น
+"""
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# พารามิเตอร์ที่ไม่ใช้เป็นส่วนของ key และไม่บันทึกลงไฟล์
+SECRET_PARAMS = frozenset({'apikey', 'api_key', 'token', 'key'})
+# endpoint -> พารามิเตอร์ที่ขึ้นกับวันที่ตอนเรียก (บันทึกไว้ แต่ไม่ใช้เป็นส่วนของ key)
+VOLATILE_PARAMS = {
+    'company-news': frozenset({'from', 'to'}),
+    'time_series': frozenset({'start_date', 'end_date', 'outputsize'}),
+}
+
+
+class CassetteMiss(LookupError):
+    """replay แล้วไม่พบ request นี้ใน cassette"""
+
+
+class ReplayedError(Exception):
+    """exception ที่เกิดตอนบันทึก ถูกโยนซ้ำตอน replay"""
+
+
+class TextResponse:
+    """แทน response ของ SDK ที่ใช้แค่ .text (เช่น Gemini) ตอน replay"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+def _strip_secrets(request):
+    if isinstance(request, dict):
+        return {k: _strip_secrets(v) for k, v in request.items() if k not in SECRET_PARAMS}
+    return request
+
+
+def _strip_volatile(request):
+    volatile = VOLATILE_PARAMS.get(request.get('endpoint')) if isinstance(request, dict) else None
+    if not volatile or not isinstance(request.get('params'), dict):
+        return request
+    return {**request, 'params': {k: v for k, v in request['params'].items() if k not in volatile}}
+
+
+def request_key(provider, request):
+    """key คงที่ของ request (ไม่ขึ้นกับลำดับ dict, วันที่ตอนเรียก และไม่มี API key)"""
+    body = json.dumps([provider, _strip_volatile(_strip_secrets(request))], sort_keys=True,
+                      ensure_ascii=False, default=str)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+class Cassette:
+    def __init__(self, mode='off', path=None, latency_scale=0.0):
+        if mode not in ('off', 'record', 'replay'):
+            raise ValueError(f"CASSETTE_MODE must be off, record or replay (got '{mode}')")
+        self.mode = mode
+        self.path = path
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries = {}    # key -> [entry, ...] ตามลำดับที่บันทึก
+        self._cursors = {}    # key -> ตำแหน่ง entry ถัดไปตอน replay
+        self._dirty = False
+        if mode == 'replay':
+            self.load()
+        elif mode == 'record' and path and os.path.exists(path):
+            # บันทึกต่อจาก cassette เดิม
+            self.load()
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            if self.mode == 'replay':
+                raise FileNotFoundError(f"cassette not found: {self.path}")
+            return
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            loaded = json.load(f)
+        # สร้าง key ใหม่จาก request ที่บันทึกไว้ cassette ที่บันทึกด้วยกฎ key แบบเก่าจึงยังใช้ได้
+        self._entries = {}
+        for recorded in loaded.values():
+            for entry in recorded:
+                self._entries.setdefault(request_key(entry['provider'], entry['request']), []).append(entry)
+        logger.info(f"📼 Loaded cassette {self.path} ({len(self._entries)} requests)")
+
+    def save(self):
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            entries = json.dumps(self._entries, ensure_ascii=False, separators=(',', ':'))
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            f.write(entries)
+        os.replace(tmp_path, self.path)
+        logger.info(f"📼 Saved cassette {self.path} ({len(self._entries)} requests)")
+
+    def call(self, provider, request, fn, encode=None, decode=None):
+        """เรียก fn() ผ่าน cassette
+
+        encode แปลงผลลัพธ์เป็นค่าที่ JSON ได้ตอนบันทึก, decode แปลงกลับตอน replay
+        """
+        if self.mode == 'off':
+            return fn()
+        key = request_key(provider, request)
+        if self.mode == 'replay':
+            return self._replay(provider, key, decode)
+
+        start = time.perf_counter()
+        entry = {'provider': provider, 'request': _strip_secrets(request)}
+        try:
+            result = fn()
+            entry['response'] = encode(result) if encode else result
+            return result
+        except Exception as e:
+            entry['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            entry['latency'] = round(time.perf_counter() - start, 4)
+            with self._lock:
+                self._entries.setdefault(key, []).append(entry)
+                self._dirty = True
+
+    def _replay(self, provider, key, decode):
+        with self._lock:
+            recorded = self._entries.get(key)
+            if not recorded:
+                raise CassetteMiss(f"no recorded {provider} request for key {key[:12]}")
+            # เล่นตามลำดับที่บันทึก ถ้าเรียกเกินจำนวนที่บันทึกไว้ให้ใช้อันสุดท้ายซ้ำ
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+            entry = recorded[min(index, len(recorded) - 1)]
+        if self.latency_scale:
+            time.sleep(entry.get('latency', 0) * self.latency_scale)
+        if 'error' in entry:
+            raise ReplayedError(entry['error'])
+        response = entry.get('response')
+        return decode(response) if decode else response
+
+
+def _from_env():
+    mode = os.environ.get('CASSETTE_MODE', 'off').lower() or 'off'
+    directory = os.environ.get('CASSETTE_DIR', 'cassettes')
+    name = os.environ.get('CASSETTE_NAME', 'default')
+    latency = float(os.environ.get('CASSETTE_LATENCY', '0') or 0)
+    return Cassette(mode, os.path.join(directory, f'{name}.json.gz'), latency)
+
+
+CASSETTE = _from_env()
+if CASSETTE.mode == 'record':
+    atexit.register(CASSETTE.save)
+
+
+def call(provider, request, fn, encode=None, decode=None):
+    """เรียก upstream ผ่าน cassette ของ process (ดู Cassette.call)"""
+    return CASSETTE.call(provider, request, fn, encode, decode)
@@ -0,0 +1,40 @@
+"""Render กราฟราคา + EMA 20/50/200 + Bollinger Bands เป็น PNG
+
+ถูกเรียกใน process pool (matplotlib ใช้ CPU และไม่ thread-safe) จึงรับเฉพาะ array ธรรมดา
+และ import matplotlib ตอนเรียกครั้งแรกใน worker ใช้ Figure ตรงๆ (backend Agg) ไม่ผ่าน pyplot
+ตัวชี้วัดคำนวณจากราคาทั้งชุดก่อนตัดช่วงที่แสดง EMA 200 จึงตรงกับค่าที่บอทรายงาน
+"""
+import io
+
+import numpy as np
+
+import indicators
+
+DEFAULT_BARS = 180
+EMA_STYLES = ((20, '#2e86de'), (50, '#f39c12'), (200, '#8e44ad'))
+
+
+def render_chart(symbol, ts, close, bars=DEFAULT_BARS):
+    """PNG (bytes) ของ bars แท่งล่าสุด ts เป็นวินาที UTC เรียงจากเก่าไปใหม่"""
+    from matplotlib.figure import Figure
+
+    close = np.asarray(close, dtype=np.float64)
+    lower, _, upper = indicators.bbands(close, 20)
+    window = slice(max(0, len(close) - bars), len(close))
+    dates = np.asarray(ts, dtype='datetime64[s]')[window]
+
+    figure = Figure(figsize=(10, 5.5), dpi=110)
+    axes = figure.subplots()
+    axes.fill_between(dates, lower[window], upper[window], color='#95a5a6', alpha=0.2,
+                      label='Bollinger Bands (20, 2)')
+    axes.plot(dates, close[window], color='#1f2933', linewidth=1.4, label='Close')
+    for period, color in EMA_STYLES:
+        axes.plot(dates, indicators.ema(close, period)[window], color=color, linewidth=1.0, label=f'EMA {period}')
+    axes.set_title(f"{symbol}  {close[-1]:,.2f}  ({np.datetime_as_string(dates[-1], unit='D')})")
+    axes.grid(alpha=0.3)
+    axes.legend(loc='upper left', fontsize=8)
+    figure.autofmt_xdate()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
@@ -0,0 +1,152 @@
+"""จำกัดจำนวนคำขอที่ค้างอยู่ต่อ upstream (Gemini, Groq, translate, Twelve Data)
+
+แต่ละ upstream มี max in-flight และคิวรอที่มีขนาดจำกัด (FIFO) คำขอที่เกินคิวหรือรอนานเกิน
+max_wait จะได้ UpstreamBusy ทันทีแทนที่จะยิงไปโดน 429 แล้ว retry เป็นทอดๆ
+ระหว่างรอคิว callback ใน QUEUE_PROGRESS (contextvar ที่ asyncio.to_thread ส่งต่อเข้า thread ให้)
+ถูกเรียกด้วย (ชื่อ upstream, ลำดับในคิว, เวลารอโดยประมาณ) ทุกครั้งที่ลำดับเปลี่ยน
+thread pool ที่ใช้ร่วมกันตั้ง WAIT_BUDGET ไว้ได้ เพื่อไม่ให้ thread ของ pool ทั้งหมดไปติดรอคิวอยู่
+เมื่อ budget หมด คำขอที่ต้องรอคิวจะได้ UpstreamBusy ทันทีให้ผู้เรียกไปใช้แหล่งอื่นแทน
+"""
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# callback(upstream, position, eta_seconds) ของคำขอปัจจุบัน (None = ไม่ต้องแจ้งใคร)
+QUEUE_PROGRESS = contextvars.ContextVar('queue_progress', default=None)
+# semaphore จำนวน thread ของ pool ปัจจุบันที่ยอม block รอคิวได้ (None = ไม่จำกัด)
+WAIT_BUDGET = contextvars.ContextVar('wait_budget', default=None)
+
+
+def in_context(fn):
+    """ห่อ fn ให้รันใน contextvars ของผู้เรียก (ThreadPoolExecutor.submit/map ไม่ส่งต่อให้เอง)"""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # context เดียวกัน run ซ้อนกันข้าม thread ไม่ได้ จึง copy ต่อการเรียก
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+class UpstreamBusy(Exception):
+    """คิวของ upstream เต็มหรือรอนานเกินกำหนด"""
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name, max_inflight, max_queue, max_wait=30.0, initial_seconds=1.0):
+        self.name = name
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.avg_seconds = initial_seconds   # EWMA ของเวลาต่อคำขอ ใช้ประมาณ ETA
+        self.inflight = 0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def eta(self, position):
+        """เวลารอโดยประมาณของลำดับที่ position (คำขอออกจากคิวทีละ max_inflight)"""
+        return math.ceil(position / self.max_inflight) * self.avg_seconds
+
+    def _report(self, position):
+        progress = QUEUE_PROGRESS.get()
+        if progress is None:
+            return
+        try:
+            progress(self.name, position, self.eta(position))
+        except Exception as e:
+            logger.debug(f"Queue progress callback failed: {e}")
+
+    def _acquire(self):
+        ticket = object()
+        with self._cond:
+            if self.inflight < self.max_inflight and not self._waiting:
+                self.inflight += 1
+                return
+            if len(self._waiting) >= self.max_queue:
+                metrics.UPSTREAM_BUSY.inc(provider=self.name)
+                raise UpstreamBusy(f"{self.name} queue is full ({self.max_queue} waiting)")
+            budget = WAIT_BUDGET.get()
+            if budget is not None and not budget.acquire(blocking=False):
+                metrics.UPSTREAM_BUSY.inc(provider=self.name)
+                raise UpstreamBusy(f"{self.name} is busy and no pool thread is free to wait")
+            self._waiting.append(ticket)
+        queued = time.monotonic()
+        deadline = queued + self.max_wait
+        reported = None
+        try:
+            while True:
+                with self._cond:
+                    if self._waiting[0] is ticket and self.inflight < self.max_inflight:
+                        self._waiting.popleft()
+                        self.inflight += 1
+                        self._cond.notify_all()
+                        break
+                    position = self._waiting.index(ticket) + 1
+                    if position == reported:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            metrics.UPSTREAM_BUSY.inc(provider=self.name)
+                            raise UpstreamBusy(f"{self.name} queue wait exceeded {self.max_wait:.0f}s")
+                        self._cond.wait(timeout=remaining)
+                        continue
+                reported = position
+                self._report(position)
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+            raise
+        finally:
+            if budget is not None:
+                budget.release()
+        metrics.UPSTREAM_QUEUE_WAIT.observe(time.monotonic() - queued, provider=self.name)
+
+    def _release(self, elapsed):
+        with self._cond:
+            self.inflight -= 1
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * elapsed
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """ครอบคำขอหนึ่งครั้งไปยัง upstream (รอคิวถ้า in-flight เต็ม)"""
+        self._acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+
+class UpstreamLimits:
+    """ConcurrencyLimiter ตามชื่อ upstream (upstream ที่ไม่ได้ตั้งไว้ไม่ถูกจำกัด)"""
+
+    def __init__(self, limits, max_wait=30.0):
+        """limits = {upstream: (max_inflight, max_queue)}"""
+        self.limiters = {
+            name: ConcurrencyLimiter(name, inflight, queue, max_wait)
+            for name, (inflight, queue) in limits.items()
+        }
+
+    def slot(self, upstream):
+        limiter = self.limiters.get(upstream)
+        return limiter.slot() if limiter else nullcontext()
+
+    @staticmethod
+    def parse(spec):
+        """"gemini=4:16,groq=4:16" -> {'gemini': (4, 16), 'groq': (4, 16)}"""
+        limits = {}
+        for part in spec.split(','):
+            name, _, value = part.partition('=')
+            inflight, _, queue = value.partition(':')
+            if name.strip() and inflight.strip():
+                limits[name.strip()] = (int(inflight), int(queue or 0))
+        return limits
@@ -0,0 +1,134 @@
+"""คิวงานหนัก (AI วิเคราะห์, เปรียบเทียบ, ทั้งหมวด) แบบยุติธรรมต่อ chat และ quota ต่อผู้ใช้
+
+FairScheduler จำกัดจำนวนงานหนักที่รันพร้อมกัน (slots) และเลือกงานถัดไปแบบ deficit round-robin:
+ทุก chat ที่มีงานรอได้ quantum เท่ากันต่อรอบ งานที่แพง (cost สูง) ต้องสะสม deficit หลายรอบ
+ผู้ใช้ที่กดสิบปุ่มจึงได้ slot ทีละงานสลับกับคนอื่น ไม่ใช่จองทั้งสิบงานไว้ก่อน
+และแต่ละ chat รันพร้อมกันได้ไม่เกิน max_per_chat งาน จึงเหลือ slot ว่างให้ chat อื่นเสมอ
+
+UsageLimiter ตรวจสองชั้นก่อนเข้าคิว: rate ต่อนาที (token bucket ในหน่วยความจำของ process)
+และ quota ต่อวัน (นับแบบ atomic ใน cache backend จึงใช้ร่วมกันระหว่าง worker process ได้)
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from cache_backend import make_key
+
+logger = logging.getLogger(__name__)
+
+
+class FairScheduler:
+    def __init__(self, slots=4, quantum=1.0, max_per_chat=2):
+        self.slots = slots
+        self.quantum = quantum
+        self.max_per_chat = max_per_chat
+        self._queues = OrderedDict()   # chat_id -> deque[(cost, future)] ตามลำดับรอบ
+        self._deficit = {}
+        self._running = 0
+        self._running_per_chat = {}
+
+    def waiting(self, chat_id=None):
+        """จำนวนงานที่รอ slot (ทั้งหมด หรือของ chat_id)"""
+        if chat_id is not None:
+            return len(self._queues.get(chat_id, ()))
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _next_chat(self):
+        """chat แรกตามรอบที่ยังรันไม่ถึง max_per_chat (None = ไม่มี chat ไหนเริ่มงานเพิ่มได้)"""
+        for chat_id in self._queues:
+            if self._running_per_chat.get(chat_id, 0) < self.max_per_chat:
+                return chat_id
+        return None
+
+    def _dispatch(self):
+        while self._running < self.slots:
+            chat_id = self._next_chat()
+            if chat_id is None:
+                return
+            queue = self._queues[chat_id]
+            cost, future = queue[0]
+            if future.done():          # ผู้รอถูกยกเลิกไปแล้ว
+                queue.popleft()
+            elif self._deficit.get(chat_id, 0.0) < cost:
+                self._deficit[chat_id] = self._deficit.get(chat_id, 0.0) + self.quantum
+                self._queues.move_to_end(chat_id)
+                continue
+            else:
+                queue.popleft()
+                self._deficit[chat_id] -= cost
+                self._running += 1
+                self._running_per_chat[chat_id] = self._running_per_chat.get(chat_id, 0) + 1
+                future.set_result(None)
+                if queue and self._deficit[chat_id] < queue[0][0]:
+                    self._queues.move_to_end(chat_id)
+            if not queue:
+                del self._queues[chat_id]
+                self._deficit.pop(chat_id, None)
+
+    def _release(self, chat_id):
+        self._running -= 1
+        remaining = self._running_per_chat.pop(chat_id, 1) - 1
+        if remaining:
+            self._running_per_chat[chat_id] = remaining
+        self._dispatch()
+
+    async def run(self, chat_id, work, cost=1.0):
+        """รอ slot ตามรอบของ chat_id แล้วรัน await work() คืนผลของ work"""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat_id, deque()).append((cost, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(chat_id)
+            raise
+        try:
+            return await work()
+        finally:
+            self._release(chat_id)
+
+
+class UsageLimiter:
+    def __init__(self, backend, rates=None, quotas=None):
+        """rates = {command: ครั้งต่อนาที}, quotas = {command: ครั้งต่อวัน} (ไม่มี/0 = ไม่จำกัด)"""
+        self.backend = backend
+        self.rates = rates or {}
+        self.quotas = quotas or {}
+        self._buckets = {}    # (chat_id, command) -> (tokens, เวลาที่เติมล่าสุด)
+        self._lock = threading.Lock()
+
+    def _take_token(self, chat_id, command):
+        """token bucket: จุได้ rate ครั้ง เติมคืน rate ครั้งต่อนาที คืนวินาทีที่ต้องรอ (0 = ผ่าน)"""
+        rate = self.rates.get(command)
+        if not rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get((chat_id, command), (float(rate), now))
+            tokens = min(float(rate), tokens + (now - updated) * rate / 60.0)
+            if tokens < 1:
+                self._buckets[(chat_id, command)] = (tokens, now)
+                return (1 - tokens) * 60.0 / rate
+            self._buckets[(chat_id, command)] = (tokens - 1, now)
+            return 0
+
+    def _count_today(self, chat_id, command):
+        """นับการใช้วันนี้ (UTC) คืน (จำนวนหลังนับ, quota) หรือ None ถ้าไม่จำกัด"""
+        quota = self.quotas.get(command)
+        if not quota:
+            return None
+        key = make_key(chat_id, command, time.strftime('%Y-%m-%d', time.gmtime()))
+        return self.backend.incr('quota', key, 86400), quota
+
+    def check(self, chat_id, command):
+        """คืน None ถ้าใช้ได้ หรือ (เหตุผล, ค่าประกอบ): ('rate', วินาทีที่ต้องรอ) / ('quota', quota ต่อวัน)"""
+        wait = self._take_token(chat_id, command)
+        if wait:
+            return 'rate', wait
+        counted = self._count_today(chat_id, command)
+        if counted and counted[0] > counted[1]:
+            return 'quota', counted[1]
+        return None
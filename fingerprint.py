@@ -0,0 +1,68 @@
+"""Fingerprint ของ input การวิเคราะห์ AI (ข่าว + สภาวะทางเทคนิค)
+
+ผลวิเคราะห์ถูกใช้ซ้ำตราบใดที่ fingerprint ยังเท่าเดิม: ชุดข่าว (id จาก Finnhub) เท่าเดิม
+และตัวชี้วัดยังอยู่ใน "ช่วง" เดิม (RSI ปัดทีละ 5, ทิศ MACD, ลำดับราคา/EMA, ราคาทีละ ~2%)
+ข่าวใหม่หรือการเปลี่ยนสภาวะตลาดทำให้ fingerprint เปลี่ยนและวิเคราะห์ใหม่ทันที
+"""
+import hashlib
+import json
+import math
+
+RSI_STEP = 5
+PRICE_STEP = 0.02       # ราคาเปลี่ยนเกิน ~2% ถือว่าแนวรับ/แนวต้าน/จุดเข้าเดิมใช้ไม่ได้แล้ว
+BB_STEP = 20
+PERCENT_STEP = 10       # analyst buy % และ upside %
+
+
+def news_ids(news_list):
+    """id ของข่าว (เรียงแล้ว) ข่าวที่ไม่มี id ใช้ hash ของหัวข้อ + เวลาแทน"""
+    ids = []
+    for news in news_list or []:
+        news_id = news.get('id')
+        if not news_id:
+            raw = f"{news.get('headline', '')}|{news.get('datetime', '')}"
+            news_id = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+        ids.append(str(news_id))
+    return sorted(ids)
+
+
+def _bucket(value, step):
+    if value is None:
+        return None
+    return int(math.floor(value / step))
+
+
+def _sign(a, b):
+    if a is None or b is None:
+        return None
+    return 1 if a > b else -1
+
+
+def technical_regime(technical_data):
+    """สภาวะทางเทคนิคแบบหยาบ (dict ที่ไม่เปลี่ยนตามราคาที่ขยับเล็กน้อย)"""
+    if not technical_data:
+        return None
+    current = technical_data.get('current')
+    rsi = technical_data.get('rsi')
+    ema_20, ema_50, ema_200 = (technical_data.get(k) for k in ('ema_20', 'ema_50', 'ema_200'))
+    return {
+        'price': _bucket(math.log(current), math.log1p(PRICE_STEP)) if current else None,
+        'rsi': _bucket(rsi, RSI_STEP),
+        'rsi_zone': None if rsi is None else (-1 if rsi <= 30 else 1 if rsi >= 70 else 0),
+        'macd': _sign(technical_data.get('macd'), technical_data.get('macd_signal')),
+        'trend': [_sign(current, ema_20), _sign(ema_20, ema_50), _sign(current, ema_200)],
+        'bb': _bucket(technical_data.get('bb_position'), BB_STEP),
+        'analyst': _bucket(technical_data.get('analyst_buy_pct'), PERCENT_STEP),
+        'upside': _bucket(technical_data.get('upside_pct'), PERCENT_STEP),
+    }
+
+
+def analysis_fingerprint(symbol, news_list, technical_data=None):
+    """hash สั้นๆ ของ symbol + ชุดข่าว + สภาวะทางเทคนิค"""
+    payload = {
+        'symbol': symbol.upper(),
+        'news': news_ids(news_list),
+        'technical': technical_regime(technical_data),
+    }
+    raw = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,105 @@
+"""Indicator ทางเทคนิคแบบ vectorized (NumPy) ให้ค่าแบบเดียวกับ endpoint ของ Twelve Data
+
+ทุกฟังก์ชันรับ array ราคา (เรียงจากเก่าไปใหม่) และคืน array ยาวเท่ากัน
+ช่วงที่ข้อมูลยังไม่พอคำนวณเป็น NaN
+"""
+import numpy as np
+
+# จำกัดขนาด block ให้ (1 - alpha) ** -n ไม่ overflow ใน float64
+_MAX_DECAY_EXPONENT = 600.0
+
+
+def _ewm(values, alpha, initial):
+    """y[t] = alpha * x[t] + (1 - alpha) * y[t-1] โดยเริ่มจาก y[-1] = initial
+
+    คำนวณทีละ block ด้วยรูปปิด y[t] = d^(t+1) * (initial + sum(alpha * x[k] / d^(k+1)))
+    เพื่อไม่ต้องวน loop ใน Python
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(values)
+    decay = 1.0 - alpha
+    if decay <= 0:
+        out[:] = values
+        return out
+    block = max(1, int(_MAX_DECAY_EXPONENT / -np.log(decay)))
+    state = initial
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        out[start:start + len(chunk)] = powers * (state + np.cumsum(alpha * chunk / powers))
+        state = out[start + len(chunk) - 1]
+    return out
+
+
+def sma(values, period):
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        cumsum = np.cumsum(np.insert(values, 0, 0.0))
+        out[period - 1:] = (cumsum[period:] - cumsum[:-period]) / period
+    return out
+
+
+def ema(values, period):
+    """EMA เริ่มต้นด้วย SMA ของ `period` แท่งแรก"""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) < period:
+        return out
+    seed = values[:period].mean()
+    out[period - 1] = seed
+    out[period:] = _ewm(values[period:], 2.0 / (period + 1), seed)
+    return out
+
+
+def rsi(close, period=14):
+    """RSI แบบ Wilder smoothing"""
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(len(close), np.nan)
+    if len(close) <= period:
+        return out
+    change = np.diff(close)
+    gain = np.clip(change, 0, None)
+    loss = np.clip(-change, 0, None)
+    alpha = 1.0 / period
+    avg_gain = np.empty(len(change))
+    avg_loss = np.empty(len(change))
+    avg_gain[period - 1] = gain[:period].mean()
+    avg_loss[period - 1] = loss[:period].mean()
+    avg_gain[period:] = _ewm(gain[period:], alpha, avg_gain[period - 1])
+    avg_loss[period:] = _ewm(loss[period:], alpha, avg_loss[period - 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = avg_gain[period - 1:] / avg_loss[period - 1:]
+        values = 100.0 - 100.0 / (1.0 + rs)
+    values[avg_loss[period - 1:] == 0] = 100.0
+    out[period:] = values
+    return out
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """คืน (macd, signal, histogram)"""
+    close = np.asarray(close, dtype=np.float64)
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = np.full(len(close), np.nan)
+    valid = np.flatnonzero(~np.isnan(line))
+    if len(valid) >= signal:
+        signal_line[valid[0]:] = ema(line[valid[0]:], signal)
+    return line, signal_line, line - signal_line
+
+
+def bbands(close, period=20, stddev=2.0):
+    """คืน (lower, middle, upper) จาก SMA ± stddev * ส่วนเบี่ยงเบนมาตรฐาน (population)"""
+    close = np.asarray(close, dtype=np.float64)
+    middle = sma(close, period)
+    deviation = np.full(len(close), np.nan)
+    if len(close) >= period:
+        windows = np.lib.stride_tricks.sliding_window_view(close, period)
+        deviation[period - 1:] = windows.std(axis=1)
+    return middle - stddev * deviation, middle, middle + stddev * deviation
+
+
+def last(values):
+    """ค่าล่าสุดเป็น float (None ถ้าไม่มีหรือเป็น NaN)"""
+    if len(values) == 0 or np.isnan(values[-1]):
+        return None
+    return float(values[-1])
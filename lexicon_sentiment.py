@@ -0,0 +1,108 @@
+"""Sentiment ข่าวการเงินจากพจนานุกรมคำ (ไม่เรียก API, ใช้เวลาระดับมิลลิวินาที)
+
+ใช้เป็น fallback เมื่อ Gemini และ Groq ใช้ไม่ได้ และเป็นผลเบื้องต้นที่แสดงระหว่างรอ AI
+ทุกคำของทุกข่าวถูกรวมเป็น array เดียว แล้วคิดน้ำหนักคำ, การปฏิเสธ (not/no/... ภายใน 3 คำก่อนหน้า)
+และผลรวมต่อข่าวแบบ vectorized (NumPy) หัวข้อข่าวมีน้ำหนักเป็นสองเท่าของรายละเอียด
+"""
+import re
+
+import numpy as np
+
+SCORER = 'Lexicon'
+
+# น้ำหนักคำ (อิงแนวคิดพจนานุกรมการเงินแบบ Loughran-McDonald แบบย่อ)
+POSITIVE = {
+    'beat': 2.0, 'beats': 2.0, 'tops': 1.5, 'exceeds': 1.5, 'exceeded': 1.5, 'surpass': 1.5, 'surpassed': 1.5,
+    'record': 1.5, 'surge': 2.0, 'surges': 2.0, 'surged': 2.0, 'soar': 2.0, 'soars': 2.0, 'soared': 2.0,
+    'jump': 1.5, 'jumps': 1.5, 'jumped': 1.5, 'rally': 1.5, 'rallies': 1.5, 'rallied': 1.5,
+    'gain': 1.0, 'gains': 1.0, 'gained': 1.0, 'rise': 1.0, 'rises': 1.0, 'rose': 1.0, 'climb': 1.0,
+    'climbs': 1.0, 'climbed': 1.0, 'higher': 0.5, 'up': 0.3, 'growth': 1.0, 'grow': 1.0, 'grows': 1.0,
+    'profit': 1.0, 'profitable': 1.5, 'strong': 1.0, 'stronger': 1.0, 'robust': 1.0, 'solid': 0.5,
+    'upgrade': 2.0, 'upgrades': 2.0, 'upgraded': 2.0, 'outperform': 1.5, 'overweight': 1.0, 'buy': 0.5,
+    'bullish': 1.5, 'optimistic': 1.0, 'optimism': 1.0, 'boost': 1.0, 'boosts': 1.0, 'boosted': 1.0,
+    'expand': 0.5, 'expands': 0.5, 'expansion': 0.5, 'approval': 1.5, 'approved': 1.5, 'approves': 1.5,
+    'launch': 0.5, 'launches': 0.5, 'partnership': 1.0, 'deal': 0.5, 'wins': 1.0, 'won': 1.0,
+    'dividend': 0.5, 'buyback': 1.0, 'raises': 1.0, 'raised': 1.0, 'breakthrough': 1.5, 'recovery': 1.0,
+    'rebound': 1.0, 'rebounds': 1.0, 'momentum': 0.5, 'innovative': 0.5, 'demand': 0.5,
+}
+NEGATIVE = {
+    'miss': 2.0, 'misses': 2.0, 'missed': 2.0, 'plunge': 2.0, 'plunges': 2.0, 'plunged': 2.0,
+    'tumble': 2.0, 'tumbles': 2.0, 'tumbled': 2.0, 'slump': 2.0, 'slumps': 2.0, 'crash': 2.5,
+    'fall': 1.0, 'falls': 1.0, 'fell': 1.0, 'drop': 1.0, 'drops': 1.0, 'dropped': 1.0, 'decline': 1.0,
+    'declines': 1.0, 'declined': 1.0, 'slide': 1.0, 'slides': 1.0, 'sink': 1.5, 'sinks': 1.5, 'lower': 0.5,
+    'down': 0.3, 'loss': 1.5, 'losses': 1.5, 'weak': 1.0, 'weaker': 1.0, 'weakness': 1.0, 'slowdown': 1.0,
+    'downgrade': 2.0, 'downgrades': 2.0, 'downgraded': 2.0, 'underperform': 1.5, 'underweight': 1.0,
+    'sell': 0.5, 'bearish': 1.5, 'pessimistic': 1.0, 'concern': 1.0, 'concerns': 1.0, 'worry': 1.0,
+    'worries': 1.0, 'fears': 1.0, 'risk': 0.5, 'risks': 0.5, 'warning': 1.5, 'warns': 1.5, 'cut': 1.0,
+    'cuts': 1.0, 'layoffs': 1.5, 'layoff': 1.5, 'lawsuit': 1.5, 'sued': 1.5, 'probe': 1.5,
+    'investigation': 1.5, 'fine': 1.0, 'fined': 1.5, 'penalty': 1.5, 'recall': 1.5, 'recalls': 1.5,
+    'fraud': 2.5, 'bankruptcy': 3.0, 'default': 2.0, 'delay': 1.0, 'delays': 1.0, 'delayed': 1.0,
+    'halt': 1.5, 'halts': 1.5, 'ban': 1.5, 'tariff': 1.0, 'tariffs': 1.0, 'volatile': 0.5,
+    'volatility': 0.5, 'selloff': 2.0, 'disappointing': 1.5, 'disappoints': 1.5, 'shortfall': 1.5,
+}
+NEGATORS = ('not', 'no', 'never', 'without', "isn't", "wasn't", "didn't", "doesn't", "won't", 'fails', 'failed')
+NEGATION_WINDOW = 3
+
+HEADLINE_WEIGHT = 2.0
+SUMMARY_WEIGHT = 1.0
+SCORE_SCALE = 4.0       # คะแนนดิบเท่านี้ ≈ ±7.6 หลัง tanh
+SENTIMENT_THRESHOLD = 2  # |score| ตั้งแต่เท่านี้จึงนับเป็นข่าวดี/ไม่ดี
+
+_TOKEN_PATTERN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+_WEIGHTS = {**POSITIVE, **{word: -weight for word, weight in NEGATIVE.items()}}
+
+
+def _tokens(texts):
+    """คำทั้งหมดของทุกข้อความเป็น array เดียว พร้อมเลขข้อความของแต่ละคำ"""
+    words, owners = [], []
+    for index, text in enumerate(texts):
+        found = _TOKEN_PATTERN.findall((text or '').lower())
+        words.extend(found)
+        owners.extend([index] * len(found))
+    return np.array(words, dtype=object), np.array(owners, dtype=np.int64)
+
+
+def _word_weights(words, owners):
+    """น้ำหนักของแต่ละคำ (0 = ไม่อยู่ในพจนานุกรม) กลับเครื่องหมายถ้ามีคำปฏิเสธนำหน้าในข้อความเดียวกัน"""
+    if not len(words):
+        return np.zeros(0)
+    unique, inverse = np.unique(words, return_inverse=True)
+    weights = np.array([_WEIGHTS.get(word, 0.0) for word in unique])[inverse]
+    negator = np.isin(unique, NEGATORS)[inverse]
+    negated = np.zeros(len(words), dtype=bool)
+    for shift in range(1, NEGATION_WINDOW + 1):
+        if shift >= len(words):
+            break
+        negated[shift:] |= negator[:-shift] & (owners[shift:] == owners[:-shift])
+    return np.where(negated, -weights, weights)
+
+
+def score_texts(headlines, summaries=None):
+    """คะแนน -10..+10 (int array) ของแต่ละข่าวจากหัวข้อ (และรายละเอียด ถ้ามี)"""
+    count = len(headlines)
+    if not count:
+        return np.zeros(0, dtype=int)
+    summaries = list(summaries) if summaries is not None else [''] * count
+    words, owners = _tokens(list(headlines) + summaries)
+    weights = _word_weights(words, owners)
+    field_weight = np.where(owners < count, HEADLINE_WEIGHT, SUMMARY_WEIGHT)
+    raw = np.bincount(owners % count, weights=weights * field_weight, minlength=count)
+    return np.rint(10 * np.tanh(raw / SCORE_SCALE)).astype(int)
+
+
+def sentiment_of(score):
+    if score >= SENTIMENT_THRESHOLD:
+        return 'positive'
+    if score <= -SENTIMENT_THRESHOLD:
+        return 'negative'
+    return 'neutral'
+
+
+def score_news(news_list):
+    """คะแนนรูปเดียวกับ sentiment_index ({'sentiment', 'score', 'gist', 'scorer'}) ตามลำดับ news_list"""
+    if not news_list:
+        return []
+    scores = score_texts([news.get('headline', '') for news in news_list],
+                         [news.get('summary', '') for news in news_list])
+    return [{'sentiment': sentiment_of(score), 'score': int(score), 'gist': '', 'scorer': SCORER}
+            for score in scores]
@@ -0,0 +1,265 @@
+"""เมตริกแบบ Prometheus (text exposition format) สำหรับ /metrics
+
+เขียนเองแบบเล็กๆ ไม่ต้องพึ่ง prometheus_client ใช้ได้ทั้งจาก event loop
+และจาก thread (มี lock ต่อเมตริก)
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# latency ของ upstream มีตั้งแต่ไม่กี่ร้อย ms (quote) ถึงหลายสิบวินาที (LLM)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs)
+    return '{' + body + '}'
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return '\n'.join(lines)
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, key, value):
+        counts, total_count, total_sum = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', repr(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key, ('le', '+Inf'))
+        lines.append(f"{self.name}_bucket{labels} {total_count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_count{labels} {total_count}")
+        lines.append(f"{self.name}_sum{labels} {total_sum}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# --- เมตริกของบอท ---
+
+UPSTREAM_LATENCY = REGISTRY.register(Histogram(
+    'stockbot_upstream_request_seconds',
+    'Latency of upstream HTTP calls (Twelve Data, Finnhub, Supabase, translate, Telegram)',
+    ('provider', 'endpoint'),
+))
+LLM_LATENCY = REGISTRY.register(Histogram(
+    'stockbot_llm_request_seconds',
+    'Latency of LLM generation calls per provider and model',
+    ('provider', 'model'),
+))
+COMMAND_LATENCY = REGISTRY.register(Histogram(
+    'stockbot_command_seconds',
+    'End-to-end handler latency per command',
+    ('command',),
+))
+INFLIGHT = REGISTRY.register(Gauge(
+    'stockbot_inflight_requests',
+    'Handlers currently running per command',
+    ('command',),
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'stockbot_cache_requests_total',
+    'Cache lookups by cache name and result (hit/miss)',
+    ('cache', 'result'),
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    'stockbot_upstream_errors_total',
+    'Failed upstream calls (exceptions and HTTP/API errors) by provider',
+    ('provider',),
+))
+UPSTREAM_RATE_LIMITED = REGISTRY.register(Counter(
+    'stockbot_upstream_rate_limited_total',
+    'Upstream responses that signalled rate limiting (HTTP 429 or quota errors) by provider',
+    ('provider',),
+))
+
+PROVIDER_SELECTED = REGISTRY.register(Counter(
+    'stockbot_provider_selected_total',
+    'Data provider whose result was used, per data kind',
+    ('kind', 'provider'),
+))
+PROVIDER_FAILOVERS = REGISTRY.register(Counter(
+    'stockbot_provider_failovers_total',
+    'Times the router moved on to another provider (reason: error, slow, incomplete)',
+    ('kind', 'reason'),
+))
+LLM_PROMPT_TOKENS = REGISTRY.register(Counter(
+    'stockbot_llm_prompt_tokens_total',
+    'Estimated prompt tokens sent to LLMs per template (part: instructions, data)',
+    ('template', 'part'),
+))
+STARTUP_STEP_SECONDS = REGISTRY.register(Gauge(
+    'stockbot_startup_step_seconds',
+    'Duration of each startup warm-up step (step="total" for the whole warm-up)',
+    ('step',),
+))
+UPSTREAM_QUEUE_WAIT = REGISTRY.register(Histogram(
+    'stockbot_upstream_queue_wait_seconds',
+    'Time calls waited for an upstream concurrency slot (only calls that had to queue)',
+    ('provider',),
+))
+UPSTREAM_BUSY = REGISTRY.register(Counter(
+    'stockbot_upstream_busy_total',
+    'Calls refused because the upstream wait queue was full or the wait timed out',
+    ('provider',),
+))
+SCHEDULER_WAIT = REGISTRY.register(Histogram(
+    'stockbot_scheduler_wait_seconds',
+    'Time expensive commands waited for a fair-scheduler slot',
+    ('command',),
+))
+COMMANDS_REJECTED = REGISTRY.register(Counter(
+    'stockbot_commands_rejected_total',
+    'Expensive commands refused by per-user limits (reason: rate, quota)',
+    ('command', 'reason'),
+))
+PROCESS_READY_SECONDS = REGISTRY.register(Gauge(
+    'stockbot_process_ready_seconds',
+    'Seconds from process start until the bot accepted updates',
+))
+
+
+def record_cache(cache, hit):
+    """นับ hit/miss ของ cache (ใช้คำนวณ hit ratio)"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """เปิด HTTP server สำหรับ /metrics ใน daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"📈 Metrics endpoint on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,95 @@
+"""คลังข่าวในหน่วยความจำต่อ symbol พร้อม cursor สำหรับดึงเฉพาะข่าวใหม่
+
+ครั้งแรกดึงข่าวย้อนหลังทั้งช่วง หลังจากนั้นดึงเฉพาะช่วงตั้งแต่วันของข่าวล่าสุดที่มีอยู่แล้ว
+(Finnhub กรองด้วยวันที่ ไม่ใช่เวลา จึงอาจได้ข่าวซ้ำของวันเดียวกัน ซึ่งถูกตัดด้วย id)
+ระหว่างรอบ refresh ข่าวถูกเสิร์ฟจากหน่วยความจำโดยไม่เรียก API เลย
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _SymbolNews:
+    def __init__(self):
+        self.items = []          # เรียงจากใหม่ไปเก่า
+        self.ids = set()
+        self.latest = None       # datetime (unix) ของข่าวล่าสุด = cursor
+        self.refreshed = None    # time.monotonic() ของการดึงครั้งล่าสุด
+        self.lock = threading.Lock()
+
+
+class NewsStore:
+    def __init__(self, fetch, refresh_seconds=120, window_days=7, max_items=200, on_new=None):
+        """fetch(symbol, from_ts, to_ts) คืน list ของข่าวแบบ Finnhub (None = ดึงไม่สำเร็จ)
+
+        on_new(symbol, items) ถูกเรียกหลังรวมข่าวที่ไม่เคยเห็นมาก่อน (ใหม่ไปเก่า) เช่นส่งไปให้คะแนน sentiment
+        """
+        self.fetch = fetch
+        self.on_new = on_new
+        self.refresh_seconds = refresh_seconds
+        self.window_days = window_days
+        self.max_items = max_items
+        self._symbols = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, symbol):
+        with self._lock:
+            return self._symbols.setdefault(symbol.upper(), _SymbolNews())
+
+    def _merge(self, entry, items, now):
+        """รวมข่าวใหม่ (ไม่ซ้ำ id) แล้วตัดข่าวที่เก่ากว่าช่วงเวลาที่เก็บ คืนข่าวที่เพิ่มและยังอยู่ในช่วง"""
+        added = []
+        for item in items:
+            news_id = item.get('id')
+            if news_id in entry.ids or not item.get('datetime'):
+                continue
+            entry.ids.add(news_id)
+            entry.items.append(item)
+            added.append(item)
+        if added:
+            entry.items.sort(key=lambda item: item['datetime'], reverse=True)
+        oldest = now - self.window_days * 86400
+        keep = [item for item in entry.items if item['datetime'] >= oldest][:self.max_items]
+        if len(keep) != len(entry.items):
+            entry.items = keep
+            entry.ids = {item.get('id') for item in keep}
+        if entry.items:
+            entry.latest = entry.items[0]['datetime']
+        added = [item for item in added if item.get('id') in entry.ids]
+        added.sort(key=lambda item: item['datetime'], reverse=True)
+        return added
+
+    def refresh(self, symbol, force=False):
+        """ดึงข่าวใหม่ถ้าถึงรอบ (หรือ force) คืนจำนวนข่าวที่เพิ่ม (None = ดึงไม่สำเร็จ)"""
+        entry = self._entry(symbol)
+        with entry.lock:
+            if not force and entry.refreshed is not None and \
+                    time.monotonic() - entry.refreshed < self.refresh_seconds:
+                return 0
+            now = time.time()
+            from_ts = entry.latest if entry.latest is not None else now - self.window_days * 86400
+            items = self.fetch(symbol.upper(), from_ts, now)
+            if items is None:
+                return None
+            added = self._merge(entry, items, now)
+            entry.refreshed = time.monotonic()
+            if added:
+                logger.info(f"📰 {symbol.upper()} news: +{len(added)} new of {len(items)} fetched "
+                            f"({len(entry.items)} stored)")
+        if added and self.on_new:
+            try:
+                self.on_new(symbol.upper(), [dict(item) for item in added])
+            except Exception as e:
+                logger.warning(f"⚠️ News hook failed for {symbol.upper()}: {e}")
+        return len(added)
+
+    def top(self, symbol, limit=5, days=None):
+        """ข่าวล่าสุด limit ข่าว (สำเนา dict เพราะผู้เรียกเติม field เช่นคำแปลลงไป)"""
+        if self.refresh(symbol) is None and self._entry(symbol).refreshed is None:
+            return None
+        entry = self._entry(symbol)
+        oldest = time.time() - (days or self.window_days) * 86400
+        with entry.lock:
+            return [dict(item) for item in entry.items if item['datetime'] >= oldest][:limit]
@@ -0,0 +1,116 @@
+"""คลังราคาย้อนหลัง (OHLCV) แบบ columnar ต่อ symbol บนดิสก์
+
+แต่ละ symbol เป็นโฟลเดอร์ที่มีไฟล์ raw ต่อคอลัมน์ (ts เป็น int64 วินาที UTC,
+ราคา/volume เป็น float64) เรียงตามเวลา อ่านด้วย np.memmap จึงไม่ copy และ
+ใช้ RAM เฉพาะหน้าที่ถูกแตะจริง การเพิ่มข้อมูลเขียนต่อท้ายไฟล์เฉพาะแท่งใหม่
+(แท่งล่าสุดที่ timestamp ซ้ำจะถูกเขียนทับ เพราะแท่งของวันนี้ยังเปลี่ยนได้)
+"""
+import logging
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('ts', 'open', 'high', 'low', 'close', 'volume')
+DTYPES = {'ts': np.dtype('<i8'), 'open': np.dtype('<f8'), 'high': np.dtype('<f8'),
+          'low': np.dtype('<f8'), 'close': np.dtype('<f8'), 'volume': np.dtype('<f8')}
+
+Bars = namedtuple('Bars', COLUMNS)
+
+
+def _empty_bars():
+    return Bars(*(np.empty(0, dtype=DTYPES[column]) for column in COLUMNS))
+
+
+class OHLCVStore:
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._symbol_locks = {}
+        self._maps = {}  # symbol -> (length, Bars) ของ memmap ที่เปิดไว้
+
+    def _dir(self, symbol):
+        return os.path.join(self.root, symbol.upper())
+
+    def _path(self, symbol, column):
+        return os.path.join(self._dir(symbol), f"{column}.bin")
+
+    def _symbol_lock(self, symbol):
+        with self._lock:
+            return self._symbol_locks.setdefault(symbol.upper(), threading.Lock())
+
+    def __len__(self):
+        return len(self.symbols())
+
+    def symbols(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def length(self, symbol):
+        """จำนวนแท่งที่เขียนครบทุกคอลัมน์แล้ว"""
+        lengths = []
+        for column in COLUMNS:
+            try:
+                lengths.append(os.path.getsize(self._path(symbol, column)) // DTYPES[column].itemsize)
+            except OSError:
+                return 0
+        return min(lengths)
+
+    def read(self, symbol):
+        """คืน Bars ของ np.memmap แบบอ่านอย่างเดียว (ยาวเท่ากันทุกคอลัมน์)"""
+        symbol = symbol.upper()
+        length = self.length(symbol)
+        if length == 0:
+            return _empty_bars()
+        cached = self._maps.get(symbol)
+        if cached and cached[0] == length:
+            return cached[1]
+        bars = Bars(*(
+            np.memmap(self._path(symbol, column), dtype=DTYPES[column], mode='r', shape=(length,))
+            for column in COLUMNS
+        ))
+        self._maps[symbol] = (length, bars)
+        return bars
+
+    def last_timestamp(self, symbol):
+        length = self.length(symbol)
+        if length == 0:
+            return None
+        with open(self._path(symbol, 'ts'), 'rb') as f:
+            f.seek((length - 1) * DTYPES['ts'].itemsize)
+            return int(np.frombuffer(f.read(DTYPES['ts'].itemsize), dtype=DTYPES['ts'])[0])
+
+    def append(self, symbol, columns):
+        """เพิ่มแท่งจาก dict ของ array (ต้องมีทุกคอลัมน์) คืนจำนวนแท่งที่เพิ่มใหม่"""
+        symbol = symbol.upper()
+        ts = np.asarray(columns['ts'], dtype=DTYPES['ts'])
+        order = np.argsort(ts, kind='stable')
+        data = {column: np.asarray(columns[column], dtype=DTYPES[column])[order] for column in COLUMNS}
+
+        with self._symbol_lock(symbol):
+            os.makedirs(self._dir(symbol), exist_ok=True)
+            length = self.length(symbol)
+            last = self.last_timestamp(symbol)
+            if last is not None:
+                keep = data['ts'] >= last
+                data = {column: values[keep] for column, values in data.items()}
+            if len(data['ts']) == 0:
+                return 0
+
+            # แท่งแรกที่ timestamp ซ้ำกับแท่งสุดท้าย -> เขียนทับแถวสุดท้าย
+            overwrite = last is not None and data['ts'][0] == last
+            for column in COLUMNS:
+                path = self._path(symbol, column)
+                itemsize = DTYPES[column].itemsize
+                mode = 'r+b' if os.path.exists(path) else 'wb'
+                with open(path, mode) as f:
+                    # ตัดส่วนที่เกินความยาวที่สมบูรณ์ (กรณีเขียนค้างจากรอบก่อน)
+                    start = (length - 1 if overwrite else length) * itemsize
+                    f.truncate(length * itemsize)
+                    f.seek(start)
+                    f.write(data[column].tobytes())
+            return len(data['ts']) - (1 if overwrite else 0)
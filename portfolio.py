@@ -0,0 +1,160 @@
+"""พอร์ตหุ้นต่อ chat: เก็บใน SQLite และประเมินมูลค่าทั้งพอร์ตด้วย NumPy
+
+PortfolioStore เก็บจำนวนหุ้นและต้นทุนเฉลี่ยต่อ (chat, symbol) การซื้อเพิ่มเฉลี่ยต้นทุนใหม่
+valuate รับ array ของทุก position แล้วคำนวณมูลค่า กำไร/ขาดทุน น้ำหนัก และการเปลี่ยนแปลงวันนี้
+เป็น array ทั้งก้อน signal_exposure บอกสัดส่วนมูลค่าพอร์ตที่อยู่ในแต่ละสัญญาณ (RSI, MACD, EMA)
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import indicators
+
+# สัญญาณ -> ข้อความในรายงาน (ลำดับเดียวกับที่แสดง)
+EXPOSURE_LABELS = {
+    'ema_uptrend': '📈 ขาขึ้น (ราคา > EMA20 > EMA50)',
+    'ema_downtrend': '📉 ขาลง (ราคา < EMA20 < EMA50)',
+    'macd_bullish': '🟢 MACD > Signal',
+    'rsi_overbought': '❤️ RSI ≥ 70',
+    'rsi_oversold': '💚 RSI ≤ 30',
+}
+
+
+class PortfolioStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS holdings ('
+            ' chat_id INTEGER NOT NULL, symbol TEXT NOT NULL, quantity REAL NOT NULL,'
+            ' average_cost REAL NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (chat_id, symbol))'
+        )
+
+    def _connection(self):
+        # sqlite3 connection ใช้ข้าม thread ไม่ได้ จึงเปิดแยกต่อ thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA busy_timeout=10000')
+            self._local.conn = conn
+        return conn
+
+    def add(self, chat_id, symbol, quantity, price):
+        """ซื้อเพิ่ม: รวมจำนวนและเฉลี่ยต้นทุน คืน (จำนวนรวม, ต้นทุนเฉลี่ย)"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT quantity, average_cost FROM holdings WHERE chat_id = ? AND symbol = ?',
+                               (chat_id, symbol)).fetchone()
+            held, cost = row or (0.0, 0.0)
+            total = held + quantity
+            average = (held * cost + quantity * price) / total
+            conn.execute(
+                'INSERT OR REPLACE INTO holdings (chat_id, symbol, quantity, average_cost, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (chat_id, symbol, total, average, time.time()),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return total, average
+
+    def remove(self, chat_id, symbol):
+        cursor = self._connection().execute('DELETE FROM holdings WHERE chat_id = ? AND symbol = ?',
+                                            (chat_id, symbol))
+        return cursor.rowcount > 0
+
+    def holdings(self, chat_id):
+        """[(symbol, จำนวน, ต้นทุนเฉลี่ย)] เรียงตาม symbol"""
+        return self._connection().execute(
+            'SELECT symbol, quantity, average_cost FROM holdings WHERE chat_id = ? ORDER BY symbol', (chat_id,)
+        ).fetchall()
+
+
+def valuate(quantity, average_cost, price, previous_close):
+    """มูลค่าพอร์ตจาก array ต่อ position (ยาวเท่ากัน) คืน dict ของ array และยอดรวม"""
+    quantity = np.asarray(quantity, dtype=np.float64)
+    cost = quantity * np.asarray(average_cost, dtype=np.float64)
+    value = quantity * np.asarray(price, dtype=np.float64)
+    day_change = value - quantity * np.asarray(previous_close, dtype=np.float64)
+    pnl = value - cost
+    total_value = float(value.sum())
+    total_cost = float(cost.sum())
+    previous_value = total_value - float(day_change.sum())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'value': value,
+            'pnl': pnl,
+            'pnl_pct': np.where(cost > 0, pnl / cost * 100, 0.0),
+            'weight': value / total_value * 100 if total_value else np.zeros_like(value),
+            'day_change': day_change,
+            'day_change_pct': np.where(value - day_change > 0, day_change / (value - day_change) * 100, 0.0),
+            'total_value': total_value,
+            'total_cost': total_cost,
+            'total_pnl': total_value - total_cost,
+            'total_pnl_pct': (total_value - total_cost) / total_cost * 100 if total_cost else 0.0,
+            'total_day_change': total_value - previous_value,
+            'total_day_change_pct': (total_value - previous_value) / previous_value * 100 if previous_value else 0.0,
+        }
+
+
+def latest_signals(closes):
+    """mask ของสัญญาณ ณ แท่งล่าสุด ต่อ position (closes = list ของ array ราคาปิด, อาจว่าง)"""
+    last = np.full((len(closes), 5), np.nan)  # rsi, macd, signal, ema20, ema50
+    price = np.full(len(closes), np.nan)
+    for row, close in enumerate(closes):
+        if len(close) == 0:
+            continue
+        macd_line, macd_signal, _ = indicators.macd(close)
+        last[row] = (indicators.rsi(close, 14)[-1], macd_line[-1], macd_signal[-1],
+                     indicators.ema(close, 20)[-1], indicators.ema(close, 50)[-1])
+        price[row] = close[-1]
+    rsi, macd_line, macd_signal, ema_20, ema_50 = last.T
+    with np.errstate(invalid='ignore'):
+        return {
+            'ema_uptrend': (price > ema_20) & (ema_20 > ema_50),
+            'ema_downtrend': (price < ema_20) & (ema_20 < ema_50),
+            'macd_bullish': macd_line > macd_signal,
+            'rsi_overbought': rsi >= 70,
+            'rsi_oversold': rsi <= 30,
+        }
+
+
+def signal_exposure(weight, masks):
+    """% ของมูลค่าพอร์ตที่อยู่ในแต่ละสัญญาณ (weight เป็น % ต่อ position)"""
+    weight = np.asarray(weight, dtype=np.float64)
+    return {name: float(weight @ mask) for name, mask in masks.items()}
+
+
+def render_portfolio(symbols, quantity, average_cost, price, result, exposure=None, missing=()):
+    """รายงาน Markdown ของพอร์ต (เรียง position ตามน้ำหนัก)"""
+    lines = ["💼 **พอร์ตของคุณ**\n"]
+    pnl_emoji = '🟢' if result['total_pnl'] >= 0 else '🔴'
+    day_emoji = '🟢' if result['total_day_change'] >= 0 else '🔴'
+    lines.append(f"💰 มูลค่ารวม: ${result['total_value']:,.2f}")
+    lines.append(f"{pnl_emoji} กำไร/ขาดทุน: ${result['total_pnl']:+,.2f} ({result['total_pnl_pct']:+.2f}%)")
+    lines.append(f"{day_emoji} วันนี้: ${result['total_day_change']:+,.2f} ({result['total_day_change_pct']:+.2f}%)\n")
+
+    for index in np.argsort(-result['weight']):
+        emoji = '🟢' if result['pnl'][index] >= 0 else '🔴'
+        lines.append(
+            f"{emoji} **{symbols[index]}** {quantity[index]:g} หุ้น @ ${average_cost[index]:,.2f} → ${price[index]:,.2f}\n"
+            f"   มูลค่า ${result['value'][index]:,.2f} ({result['weight'][index]:.1f}%) · "
+            f"P&L {result['pnl_pct'][index]:+.1f}% · วันนี้ {result['day_change_pct'][index]:+.2f}%"
+        )
+
+    if exposure:
+        lines.append("\n📊 **สัดส่วนพอร์ตตามสัญญาณ:**")
+        for name, label in EXPOSURE_LABELS.items():
+            lines.append(f"• {label}: {exposure[name]:.0f}%")
+    if missing:
+        lines.append(f"\n⚠️ ไม่มีราคาปัจจุบัน (ไม่รวมในยอด): {', '.join(missing)}")
+    return '\n'.join(lines)
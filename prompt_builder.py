@@ -0,0 +1,119 @@
+"""ประกอบ prompt ของ AI โดยแยกคำสั่งคงที่ออกจากข้อมูล และคุมจำนวน token ของส่วนข้อมูล
+
+คำสั่งวิเคราะห์ (PART 1-5, รูปแบบตอบ) เหมือนเดิมทุกครั้ง จึงส่งเป็น system instruction
+ที่อยู่หน้าสุดของ request เสมอ ทำให้ Gemini ใช้ implicit prefix cache ได้ (หรือ explicit
+CachedContent ถ้าเปิด) ส่วน Groq ได้ system prompt ฉบับย่อแทน
+ข้อมูลที่เปลี่ยนทุกครั้ง (ข่าว, เทคนิค) ถูกใส่ตามงบ token: ส่วนที่จำเป็นใส่ก่อน
+ส่วนเสริมเลือก variant ที่ยาวที่สุดที่ยังไม่เกินงบ
+"""
+import datetime
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ภาษาไทยถูกตัดเป็น token ถี่กว่าภาษาอังกฤษมาก (ประมาณ 1 token ต่อ 1-2 ตัวอักษร)
+_ASCII_CHARS_PER_TOKEN = 4.0
+_OTHER_CHARS_PER_TOKEN = 1.5
+
+
+def estimate_tokens(text):
+    """ประมาณจำนวน token แบบไม่ต้องเรียก API (เผื่อไว้ด้านมากสำหรับภาษาไทย)"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    other_chars = len(text) - ascii_chars
+    return int(ascii_chars / _ASCII_CHARS_PER_TOKEN + other_chars / _OTHER_CHARS_PER_TOKEN) + 1
+
+
+class PromptTemplate:
+    """คำสั่งคงที่ของงานวิเคราะห์หนึ่งแบบ (instructions เต็มสำหรับ Gemini, short สำหรับ Groq)"""
+
+    def __init__(self, name, instructions, short_instructions=None):
+        self.name = name
+        self.instructions = instructions.strip()
+        self.short_instructions = (short_instructions or instructions).strip()
+        self.key = hashlib.sha1(self.instructions.encode('utf-8')).hexdigest()[:12]
+        self.tokens = estimate_tokens(self.instructions)
+
+
+class PromptBuilder:
+    """ต่อส่วนข้อมูลของ prompt ให้ไม่เกิน budget token"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.tokens = 0
+        self.dropped = 0
+        self._parts = []
+
+    def add(self, text):
+        """ส่วนที่ต้องมีเสมอ (นับ token แม้จะเกินงบ)"""
+        self._parts.append(text)
+        self.tokens += estimate_tokens(text)
+        return self
+
+    def add_optional(self, *variants):
+        """ใส่ variant แรกที่ยังพอดีงบ (เรียงจากยาวไปสั้น) คืน True ถ้าใส่ได้"""
+        for text in variants:
+            cost = estimate_tokens(text)
+            if self.tokens + cost <= self.budget:
+                self._parts.append(text)
+                self.tokens += cost
+                return True
+        self.dropped += 1
+        return False
+
+    def build(self):
+        return ''.join(self._parts)
+
+
+class GeminiContextCache:
+    """สร้าง GenerativeModel ที่มีคำสั่งของ template เป็น prefix ต่อ (model, template)
+
+    explicit=True จะสร้าง CachedContent ฝั่ง Gemini (คิดค่า token ของคำสั่งครั้งเดียวต่อ ttl)
+    ถ้าสร้างไม่ได้ (เช่นคำสั่งสั้นกว่าขั้นต่ำของโมเดล หรือโมเดลไม่รองรับ) จะใช้
+    system_instruction ธรรมดาแทน ซึ่งยังได้ implicit cache บนโมเดล 2.5
+    """
+
+    def __init__(self, explicit=False, ttl_seconds=3600, retry_seconds=600):
+        self.explicit = explicit
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self._models = {}    # (model_name, template.key) -> (GenerativeModel, expires_at)
+        self._failed = {}    # (model_name, template.key) -> เวลาที่สร้าง cache ไม่สำเร็จ
+        self._lock = threading.Lock()
+
+    def _create_cached(self, genai, model_name, template):
+        cached = genai.caching.CachedContent.create(
+            model=model_name,
+            display_name=f"stockbot-{template.name}-{template.key}",
+            system_instruction=template.instructions,
+            ttl=datetime.timedelta(seconds=self.ttl_seconds),
+        )
+        logger.info(f"🧊 Created Gemini context cache for {template.name} on {model_name}")
+        return genai.GenerativeModel.from_cached_content(cached)
+
+    def model(self, genai, model_name, template):
+        key = (model_name, template.key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._models.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+
+            model = None
+            if self.explicit and now - self._failed.get(key, -self.retry_seconds) >= self.retry_seconds:
+                try:
+                    model = self._create_cached(genai, model_name, template)
+                    # หมดอายุก่อน cache ฝั่ง server เล็กน้อย จะได้ไม่ส่ง cache ที่ถูกลบไปแล้ว
+                    expires_at = now + self.ttl_seconds * 0.9
+                except Exception as e:
+                    self._failed[key] = now
+                    logger.warning(f"⚠️ Gemini context cache unavailable for {model_name}: {e}")
+            if model is None:
+                model = genai.GenerativeModel(model_name, system_instruction=template.instructions)
+                expires_at = float('inf') if not self.explicit else now + self.retry_seconds
+            self._models[key] = (model, expires_at)
+            return model
@@ -0,0 +1,149 @@
+"""เลือกแหล่งข้อมูลตาม latency / error ล่าสุด และ failover ภายใน deadline
+
+แต่ละชนิดข้อมูล (quote, technicals, ...) มีหลาย provider ที่ลงทะเบียนไว้ router
+เก็บ EWMA ของ latency และอัตรา error ต่อ provider แล้วเรียงลำดับทุกครั้งที่ขอข้อมูล:
+provider ที่เร็วและ healthy ก่อน ถ้าตัวแรกช้าเกินคาด (hedge) หรือพลาด จะเริ่มตัวถัดไป
+provider แบบ fallback (เช่น snapshot ที่อ่านจาก cache) อยู่ท้ายแถวเสมอ ไม่ว่าจะตอบเร็วแค่ไหน
+ผลลัพธ์แรกที่ผ่าน accept() ชนะ และติดชื่อ provider ไว้เป็น provenance
+thread ของ executor รอคิว upstream ได้ไม่เกินครึ่ง pool ที่เหลือได้ UpstreamBusy แล้ว failover ต่อ
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from concurrency import WAIT_BUDGET
+
+logger = logging.getLogger(__name__)
+
+RoutedResult = namedtuple('RoutedResult', 'value provider elapsed complete')
+
+
+class ProviderStats:
+    """EWMA ของ latency (วินาที) และอัตรา error ของ provider หนึ่งตัว"""
+
+    def __init__(self, expected_latency, alpha=0.2):
+        self.latency = expected_latency
+        self.error_rate = 0.0
+        self.alpha = alpha
+        self.last_failure = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, ok):
+        with self._lock:
+            if ok:
+                self.latency += self.alpha * (elapsed - self.latency)
+            else:
+                self.last_failure = time.monotonic()
+            self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+
+    def healthy(self, cooldown):
+        # provider ที่ error บ่อยจะถูกพักไว้ท้ายแถวจนพ้น cooldown แล้วค่อยลองใหม่
+        return self.error_rate < 0.5 or time.monotonic() - self.last_failure > cooldown
+
+    def score(self):
+        return self.latency * (1.0 + 4.0 * self.error_rate)
+
+
+class ProviderRouter:
+    def __init__(self, max_workers=16, cooldown=60.0, min_hedge_delay=0.5):
+        self._providers = {}  # kind -> [(name, fetch)]
+        self._stats = {}      # (kind, name) -> ProviderStats
+        self._fallback = set()  # (kind, name) ที่ใช้เมื่อ provider สดใช้ไม่ได้เท่านั้น
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provider')
+        self._wait_budget = threading.BoundedSemaphore(max(1, max_workers // 2))
+        self.cooldown = cooldown
+        self.min_hedge_delay = min_hedge_delay
+
+    def register(self, kind, name, fetch, expected_latency=1.0, fallback=False):
+        """fetch(symbol) คืนข้อมูลหรือ None (None/exception นับเป็นความล้มเหลว)
+
+        fallback=True: ข้อมูลอาจเก่า (snapshot) จึงจัดไว้หลัง provider สดทุกตัวเสมอ
+        """
+        self._providers.setdefault(kind, []).append((name, fetch))
+        self._stats[(kind, name)] = ProviderStats(expected_latency)
+        if fallback:
+            self._fallback.add((kind, name))
+
+    def stats(self, kind):
+        return {name: self._stats[(kind, name)] for name, _ in self._providers.get(kind, [])}
+
+    def ranked(self, kind):
+        """provider เรียงตามความน่าใช้ (ข้อมูลสดก่อน fallback, healthy ก่อน แล้วตาม score)"""
+        providers = self._providers.get(kind, [])
+        return sorted(
+            providers,
+            key=lambda item: ((kind, item[0]) in self._fallback,
+                              not self._stats[(kind, item[0])].healthy(self.cooldown),
+                              self._stats[(kind, item[0])].score()),
+        )
+
+    def _call(self, kind, name, fetch, symbol):
+        stats = self._stats[(kind, name)]
+        start = time.perf_counter()
+        # รันใน context ที่ copy มาแล้ว (ดู launch) จึงตั้ง budget ได้โดยไม่กระทบผู้เรียก
+        WAIT_BUDGET.set(self._wait_budget)
+        try:
+            value = fetch(symbol)
+        except Exception as e:
+            logger.warning(f"⚠️ {kind} provider {name} failed for {symbol}: {e}")
+            value = None
+        elapsed = time.perf_counter() - start
+        stats.record(elapsed, value is not None)
+        return value, elapsed
+
+    def fetch(self, kind, symbol, deadline=8.0, accept=None):
+        """คืน RoutedResult ของผลแรกที่ accept(value) เป็นจริง
+
+        ถ้าไม่มีผลที่ผ่าน accept ภายใน deadline จะคืนผลที่ไม่ครบตัวแรกที่ได้ (complete=False)
+        หรือ None ถ้าไม่มี provider ไหนให้ข้อมูลเลย
+        """
+        queue = list(self.ranked(kind))
+        start = time.perf_counter()
+        end = start + deadline
+        pending = {}
+        partial = None
+
+        def launch():
+            name, fetch = queue.pop(0)
+            # ส่ง contextvars (trace span, QUEUE_PROGRESS) ของผู้เรียกไปยัง thread ของ executor ด้วย
+            future = self._executor.submit(contextvars.copy_context().run, self._call, kind, name, fetch, symbol)
+            pending[future] = name
+
+        while queue or pending:
+            if not pending:
+                launch()
+            # hedge: ถ้าตัวที่รันอยู่ช้ากว่าที่คาดไว้มาก ให้เริ่มตัวถัดไปคู่กัน
+            running = self._stats[(kind, next(reversed(pending.values())))]
+            hedge_delay = max(self.min_hedge_delay, 2.0 * running.latency)
+            timeout = min(hedge_delay, end - time.perf_counter()) if queue else end - time.perf_counter()
+            if timeout <= 0:
+                break
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if queue and time.perf_counter() < end:
+                    launch()
+                    metrics.PROVIDER_FAILOVERS.inc(kind=kind, reason='slow')
+                continue
+            for future in done:
+                name = pending.pop(future)
+                value, elapsed = future.result()
+                if value is None:
+                    metrics.PROVIDER_FAILOVERS.inc(kind=kind, reason='error')
+                    continue
+                if accept is None or accept(value):
+                    metrics.PROVIDER_SELECTED.inc(kind=kind, provider=name)
+                    return RoutedResult(value, name, time.perf_counter() - start, True)
+                if partial is None:
+                    partial = RoutedResult(value, name, time.perf_counter() - start, False)
+                metrics.PROVIDER_FAILOVERS.inc(kind=kind, reason='incomplete')
+
+        if pending:
+            logger.warning(f"⚠️ {kind} for {symbol}: deadline {deadline:.1f}s reached "
+                           f"({', '.join(pending.values())} still running)")
+        if partial is not None:
+            metrics.PROVIDER_SELECTED.inc(kind=kind, provider=partial.provider)
+        return partial
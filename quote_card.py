@@ -0,0 +1,92 @@
+"""การ์ดราคาและสัญญาณแบบย่อสำหรับ inline query (@bot AAPL)
+
+build_card ย่อ quote + ตัวชี้วัดเหลือ dict เล็กๆ ที่เก็บใน cache backend ได้ทั้งก้อน
+ตอนตอบ inline query จึงแค่อ่านการ์ดแล้ว render เป็นข้อความ ไม่ต้องดึงหรือคำนวณอะไรอีก
+"""
+import time
+
+TREND_LABELS = {
+    'strong_up': '📈 ขาขึ้นแข็งแรง',
+    'up': '📈 ขาขึ้น',
+    'sideways': '↔️ ไซด์เวย์',
+    'down': '📉 ขาลง',
+    'strong_down': '📉 ขาลงแรง',
+}
+MACD_LABELS = {'bullish': '🟢 Bullish', 'bearish': '🔴 Bearish'}
+
+
+def macd_state(macd, signal):
+    if macd is None or signal is None:
+        return None
+    return 'bullish' if macd > signal else 'bearish'
+
+
+def ema_trend(price, ema_20, ema_50, ema_200=None):
+    """แนวโน้มจากลำดับราคาเทียบ EMA (None ถ้าไม่มี EMA 20/50)"""
+    if ema_20 is None or ema_50 is None:
+        return None
+    if price > ema_20 > ema_50:
+        return 'strong_up' if ema_200 is not None and ema_50 > ema_200 else 'up'
+    if price < ema_20 < ema_50:
+        return 'strong_down' if ema_200 is not None and ema_50 < ema_200 else 'down'
+    return 'sideways'
+
+
+def rsi_label(rsi):
+    if rsi >= 70:
+        return 'Overbought'
+    if rsi <= 30:
+        return 'Oversold'
+    return 'ปกติ'
+
+
+def build_card(symbol, quote, technicals=None):
+    """การ์ดจาก quote (รูปแบบ /quote ของ Twelve Data) และ technicals (อาจเป็น None)"""
+    technicals = technicals or {}
+    price = float(quote['close'])
+    previous = float(quote.get('previous_close') or price)
+    return {
+        'symbol': symbol.upper(),
+        'price': price,
+        'change': price - previous,
+        'change_pct': (price - previous) / previous * 100 if previous else 0.0,
+        'rsi': technicals.get('rsi'),
+        'macd': macd_state(technicals.get('macd'), technicals.get('macd_signal')),
+        'trend': ema_trend(price, technicals.get('ema_20'), technicals.get('ema_50'), technicals.get('ema_200')),
+        'quote_source': quote.get('source'),
+        'technical_source': technicals.get('source'),
+        'updated_at': time.time(),
+    }
+
+
+def render_title(card):
+    emoji = '🟢' if card['change'] >= 0 else '🔴'
+    return f"{emoji} {card['symbol']} ${card['price']:,.2f} ({card['change_pct']:+.2f}%)"
+
+
+def render_description(card):
+    """บรรทัดสัญญาณย่อในรายการผลลัพธ์ inline"""
+    parts = []
+    if card['rsi'] is not None:
+        parts.append(f"RSI {card['rsi']:.0f}")
+    if card['macd']:
+        parts.append(f"MACD {MACD_LABELS[card['macd']]}")
+    if card['trend']:
+        parts.append(TREND_LABELS[card['trend']])
+    return ' · '.join(parts) or 'ไม่มีข้อมูลตัวชี้วัด'
+
+
+def render_text(card):
+    """ข้อความที่ส่งเข้าแชทเมื่อเลือกการ์ด (ข้อความธรรมดา ไม่ใช้ Markdown)"""
+    lines = [
+        f"💹 {card['symbol']} ${card['price']:,.2f}",
+        f"{'🟢' if card['change'] >= 0 else '🔴'} {card['change']:+,.2f} ({card['change_pct']:+.2f}%)",
+    ]
+    if card['rsi'] is not None:
+        lines.append(f"📊 RSI (14): {card['rsi']:.1f} ({rsi_label(card['rsi'])})")
+    if card['macd']:
+        lines.append(f"📈 MACD: {MACD_LABELS[card['macd']]}")
+    if card['trend']:
+        lines.append(f"📐 EMA 20/50/200: {TREND_LABELS[card['trend']]}")
+    lines.append(f"🕒 {time.strftime('%Y-%m-%d %H:%M UTC', time.gmtime(card['updated_at']))}")
+    return '\n'.join(lines)
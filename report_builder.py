@@ -0,0 +1,123 @@
+"""สร้างข้อความรายงานสำหรับ Telegram พร้อม MessageEntity ในรอบเดียว
+
+ข้อความที่สร้างจาก ReportBuilder ส่งด้วย entities= แทน parse_mode
+จึงไม่ต้อง escape และไม่มีทางเกิด "can't parse entities" จากข้อความของ AI
+"""
+import re
+
+from telegram import MessageEntity
+
+TELEGRAM_MAX_LENGTH = 4096
+
+_MDV2_SPECIAL = '\\_*[]()~`>#+-=|{}.!'
+_MDV2_TABLE = str.maketrans({char: f'\\{char}' for char in _MDV2_SPECIAL})
+
+# ** ตัวหนา ** ที่ AI ชอบใส่มาแม้จะสั่งห้าม
+_BOLD_PATTERN = re.compile(r'\*\*(.+?)\*\*', re.DOTALL)
+
+
+def escape_markdown_v2(text: str) -> str:
+    """Escape อักขระพิเศษของ MarkdownV2 ในรอบเดียวด้วย str.translate"""
+    return text.translate(_MDV2_TABLE)
+
+
+def utf16_len(text: str) -> int:
+    """ความยาวแบบ UTF-16 code units (หน่วยที่ Telegram ใช้กับ offset ของ entity)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class ReportBuilder:
+    """ประกอบรายงานเป็นชิ้นๆ แล้ว join ครั้งเดียวตอน build
+
+    entity เก็บเป็น offset แบบ str index ระหว่างสร้าง และแปลงเป็น UTF-16
+    ตอน build/chunks เท่านั้น
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._length = 0
+        self._entities = []  # (type, start, end, url)
+
+    def __len__(self):
+        return self._length
+
+    def _append(self, text, entity_type=None, url=None):
+        if not text:
+            return self
+        start = self._length
+        self._parts.append(text)
+        self._length += len(text)
+        if entity_type:
+            self._entities.append((entity_type, start, self._length, url))
+        return self
+
+    def text(self, text):
+        return self._append(text)
+
+    def line(self, text=''):
+        return self._append(f"{text}\n")
+
+    def bold(self, text):
+        return self._append(text, MessageEntity.BOLD)
+
+    def italic(self, text):
+        return self._append(text, MessageEntity.ITALIC)
+
+    def code(self, text):
+        return self._append(text, MessageEntity.CODE)
+
+    def link(self, text, url):
+        if not url:
+            return self._append(text)
+        return self._append(text, MessageEntity.TEXT_LINK, url)
+
+    def rich(self, text):
+        """เพิ่มข้อความจาก AI โดยแปลง **ตัวหนา** เป็น entity ส่วนอื่นเป็นข้อความล้วน"""
+        position = 0
+        for match in _BOLD_PATTERN.finditer(text):
+            self._append(text[position:match.start()])
+            self._append(match.group(1), MessageEntity.BOLD)
+            position = match.end()
+        return self._append(text[position:])
+
+    def build(self):
+        """คืนค่า (text, entities) สำหรับส่งข้อความเดียว"""
+        text = ''.join(self._parts)
+        return text, self._entities_for(text, 0, len(text))
+
+    def chunks(self, limit=TELEGRAM_MAX_LENGTH):
+        """แบ่งรายงานเป็นหลายข้อความ (ตัดที่ขึ้นบรรทัดใหม่) พร้อม entity ของแต่ละส่วน"""
+        text = ''.join(self._parts)
+        result = []
+        start = 0
+        while start < len(text):
+            end = min(start + limit, len(text))
+            # emoji นอก BMP นับเป็น 2 หน่วยใน UTF-16 จึงต้องหดช่วงจนไม่เกิน limit
+            overflow = utf16_len(text[start:end]) - limit
+            while overflow > 0:
+                end -= overflow
+                overflow = utf16_len(text[start:end]) - limit
+            if end < len(text):
+                newline = text.rfind('\n', start, end)
+                if newline > start + limit // 2:
+                    end = newline + 1
+            chunk = text[start:end]
+            if chunk.strip():
+                result.append((chunk, self._entities_for(text, start, end)))
+            start = end
+        return result
+
+    def _entities_for(self, text, chunk_start, chunk_end):
+        entities = []
+        for entity_type, start, end, url in self._entities:
+            start = max(start, chunk_start)
+            end = min(end, chunk_end)
+            if start >= end:
+                continue
+            entities.append(MessageEntity(
+                type=entity_type,
+                offset=utf16_len(text[chunk_start:start]),
+                length=utf16_len(text[start:end]),
+                url=url,
+            ))
+        return entities
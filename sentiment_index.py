@@ -0,0 +1,192 @@
+"""ดัชนี sentiment รายหัวข้อข่าว (ให้คะแนนครั้งเดียวต่อข่าว แล้วใช้ซ้ำ)
+
+ข่าวใหม่จาก NewsStore ถูกส่งเข้าคิว แล้ว worker thread เบื้องหลังรวมข่าวของหลาย symbol
+ที่เข้าคิวใกล้กันเป็นชุดเดียว (คำขอ AI เดียว) และให้คะแนนเฉพาะเมื่อ budget() ยอม
+ข่าวที่ได้มาจากงานแบบ bulk (ทั้งหมวด, /news) ได้คะแนนจาก bulk_score (lexicon) ทันทีแบบ provisional
+ผลเก็บใน cache backend ตาม id ข่าว (แชร์ระหว่าง worker process และอยู่ใน snapshot)
+/ai จึงรวมคะแนนที่คำนวณไว้แล้วได้ทันที ข่าวที่ยังไม่มีคะแนน AI ตอนถูกขอจะถูกให้คะแนนในคำขอนั้น
+"""
+import contextvars
+import logging
+import queue
+import threading
+import time
+
+from cache_backend import make_key
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = 'sentiment'
+# True ระหว่างงานแบบ bulk: ข่าวใหม่ได้คะแนนจาก bulk_score แทนการเข้าคิว AI
+BULK = contextvars.ContextVar('sentiment_bulk', default=False)
+
+
+class SentimentIndex:
+    def __init__(self, backend, score_batch, ttl=8 * 86400, provisional_ttl=600, batch_size=20, wait_seconds=20.0,
+                 linger=2.0, budget=None, bulk_score=None):
+        """score_batch([(symbol, item), ...]) คืน list ผลแบบ {'sentiment', 'score', 'gist', 'scorer'} ตามลำดับ
+
+        (None ในตำแหน่งใด = ให้คะแนนข่าวนั้นไม่ได้) ผลที่มี 'provisional' (เช่นคะแนนสำรองตอน AI ใช้ไม่ได้)
+        เก็บแค่ provisional_ttl และถูกให้คะแนนใหม่เมื่อมีคนขอ
+        budget() คืน False = ชุดเบื้องหลังนี้เกินงบ (ไม่ให้คะแนน รอให้ถูกขอแทน)
+        bulk_score(items) ให้คะแนนข่าวจากงานแบบ bulk โดยไม่ใช้ AI (None = ข้ามข่าวเหล่านั้น)
+        """
+        self.backend = backend
+        self.score_batch = score_batch
+        self.ttl = ttl
+        self.provisional_ttl = provisional_ttl
+        self.batch_size = batch_size
+        self.wait_seconds = wait_seconds
+        self.linger = linger
+        self.budget = budget
+        self.bulk_score = bulk_score
+        self._queue = queue.Queue()
+        self._inflight = set()  # id ของข่าวที่กำลังให้คะแนนอยู่
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    @staticmethod
+    def _key(news_id):
+        return make_key(str(news_id))
+
+    def lookup(self, news_id):
+        return self.backend.lookup(NAMESPACE, self._key(news_id))
+
+    def lookup_many(self, news_ids):
+        """{id: ผล หรือ None} ของหลายข่าว (เรียกจาก thread เพราะอ่าน cache backend)"""
+        return {news_id: self.lookup(news_id) for news_id in news_ids}
+
+    def _store(self, symbol, item, score):
+        entry = {'id': item['id'], 'symbol': symbol, 'datetime': item.get('datetime', 0), **score}
+        ttl = self.provisional_ttl if score.get('provisional') else self.ttl
+        self.backend.set(NAMESPACE, self._key(item['id']), entry, ttl)
+        return entry
+
+    def _score(self, entries):
+        """ให้คะแนน entries = [(symbol, item)] (ที่ถูกจองใน _inflight แล้ว) ในคำขอเดียวแล้วเก็บผล"""
+        results = {}
+        symbols = ', '.join(dict.fromkeys(symbol for symbol, _ in entries))
+        try:
+            start = time.perf_counter()
+            scores = self.score_batch(entries)
+            for (symbol, item), score in zip(entries, scores or []):
+                if score:
+                    results[item['id']] = self._store(symbol, item, score)
+            logger.info(f"🏷️ Scored {len(results)}/{len(entries)} headlines ({symbols}) "
+                        f"in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.warning(f"⚠️ Headline scoring failed for {symbols}: {e}")
+        finally:
+            with self._cond:
+                self._inflight.difference_update(item['id'] for _, item in entries)
+                self._cond.notify_all()
+        return results
+
+    def _claim(self, entries):
+        """จองข่าว ([(symbol, item)]) ที่ยังไม่มีใครกำลังให้คะแนน"""
+        claimed = []
+        with self._cond:
+            for symbol, item in entries:
+                if item['id'] not in self._inflight:
+                    self._inflight.add(item['id'])
+                    claimed.append((symbol, item))
+        return claimed
+
+    def scores_for(self, symbol, items):
+        """คืน {id: entry} ของทุกข่าวใน items (ให้คะแนนทันทีสำหรับข่าวที่ยังไม่มี)"""
+        symbol = symbol.upper()
+        items = [item for item in items if item.get('id')]
+        found = {}
+        for item in items:
+            entry = self.lookup(item['id'])
+            if entry and not entry.get('provisional'):
+                found[item['id']] = entry
+        missing = self._claim([(symbol, item) for item in items if item['id'] not in found])
+        if missing:
+            found.update(self._score(missing))
+        # ข่าวที่ worker กำลังให้คะแนนอยู่: รอผลแทนการเรียกซ้ำ
+        deadline = time.monotonic() + self.wait_seconds
+        with self._cond:
+            while any(item['id'] in self._inflight for item in items) and time.monotonic() < deadline:
+                self._cond.wait(timeout=deadline - time.monotonic())
+        for item in items:
+            if item['id'] not in found:
+                entry = self.lookup(item['id'])
+                if entry:
+                    found[item['id']] = entry
+        return found
+
+    def submit(self, symbol, items):
+        """ส่งข่าวใหม่เข้าคิวให้ worker ให้คะแนนเบื้องหลัง (ระหว่าง BULK ให้คะแนนด้วย bulk_score ทันที)"""
+        items = [item for item in items if item.get('id')]
+        if not items or self._stopped:
+            return
+        if BULK.get():
+            self._score_bulk(symbol.upper(), items)
+            return
+        self._ensure_worker()
+        self._queue.put((symbol.upper(), items))
+
+    def _score_bulk(self, symbol, items):
+        if self.bulk_score is None:
+            return
+        try:
+            for item, score in zip(items, self.bulk_score(items)):
+                self._store(symbol, item, dict(score, provisional=True))
+        except Exception as e:
+            logger.warning(f"⚠️ Bulk headline scoring failed for {symbol}: {e}")
+
+    def _ensure_worker(self):
+        with self._cond:
+            if self._stopped:
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sentiment-index', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """หยุด worker (ข่าวที่ยังค้างคิวถูกทิ้ง) และรอชุดที่กำลังให้คะแนนอยู่ไม่เกิน timeout วินาที"""
+        with self._cond:
+            self._stopped = True
+            thread = self._thread
+        self._queue.put(None)
+        if thread is not None:
+            thread.join(timeout)
+
+    def _collect(self, pending):
+        """ย้ายข่าวจากคิวเข้า pending จนครบ batch_size หรือไม่มีข่าวเข้ามาเพิ่มใน linger วินาที
+
+        คืน True เมื่อถูกสั่งหยุด
+        """
+        deadline = time.monotonic() + self.linger
+        while len(pending) < self.batch_size:
+            try:
+                if pending:
+                    entry = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                else:
+                    entry = self._queue.get()
+                    deadline = time.monotonic() + self.linger
+            except queue.Empty:
+                return False
+            if entry is None:
+                return True
+            symbol, items = entry
+            pending.extend((symbol, item) for item in items)
+        return False
+
+    def _run(self):
+        pending = []
+        while not self._stopped and not self._collect(pending):
+            seen = set()
+            pending = [(symbol, item) for symbol, item in pending
+                       if item['id'] not in seen and not seen.add(item['id']) and not self.lookup(item['id'])]
+            batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+            if not batch:
+                continue
+            if self.budget is not None and not self.budget():
+                logger.info(f"🏷️ Background scoring budget spent - {len(batch)} headlines left for on-demand scoring")
+                continue
+            claimed = self._claim(batch)
+            if claimed:
+                self._score(claimed)
@@ -1,12 +1,49 @@
 import os
+import re
+import time
+import calendar
+import importlib
 import logging
+import multiprocessing
+import threading
 import requests
 import asyncio 
+import functools
 from functools import lru_cache
-from datetime import datetime, timedelta 
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
 from telegram import Update
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, InlineQueryHandler
+from telegram.request import HTTPXRequest
+
+import numpy as np
+
+import ai_report
+import backtest
+import cache_snapshot
+import chart_render
+import cassette
+import fingerprint
+import indicators
+import lexicon_sentiment
+import metrics
+import portfolio
+import quote_card
+import tracing
+import webhook_workers
+from cache_backend import create_backend, make_key
+from concurrency import QUEUE_PROGRESS, UpstreamBusy, UpstreamLimits, in_context
+from fair_scheduler import FairScheduler, UsageLimiter
+from news_store import NewsStore
+from ohlcv_store import OHLCVStore
+from prompt_builder import GeminiContextCache, PromptBuilder, PromptTemplate
+from sentiment_index import BULK, SentimentIndex
+from provider_router import ProviderRouter
+from yf_provider import YFinanceProvider, load_download
+from report_builder import ReportBuilder, escape_markdown_v2
+from warmup import Warmup
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -14,26 +51,297 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+PROCESS_START = time.perf_counter()
+
 # --- Config ---
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "8336478185:AAF_OO9dQj4vjCictaD-aWoWWUGdi6vv_lY")
 TWELVE_DATA_KEY = os.environ.get("TWELVE_DATA_KEY", "")
 FINNHUB_KEY = os.environ.get("FINNHUB_KEY", "")
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+USE_WEBHOOK = os.environ.get("USE_WEBHOOK", "") == "1"  # บังคับ webhook แม้ไม่ได้อยู่บน Render (เช่น load test)
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")  
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")  # เพิ่มบรรทัดนี้
 # เพิ่มหลัง GROQ_API_KEY
 SUPABASE_URL = os.environ.get("SUPABASE_URL", "")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY", "")
+METRICS_PORT = os.environ.get("METRICS_PORT", "9090")  # ว่าง = ปิด /metrics
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))  # สัดส่วน update ที่เขียน trace
+WARMUP = os.environ.get("WARMUP", "1") != "0"  # 0 = ไม่ import / เปิด connection ล่วงหน้า (restore snapshot ยังทำเสมอ)
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))  # จำนวน worker process ที่รับ webhook (>1 ใช้ SO_REUSEPORT)
+CACHE_URL = os.environ.get("CACHE_URL", "sqlite:///stockbot_cache.sqlite3")  # cache ที่แชร์ระหว่าง worker
+
+# อายุ cache (วินาที)
+CACHE_TTL_SECONDS = 300  # 5 minutes
+MARKET_CACHE_TTL = {"quote": 60, "recommendation": 3600, "price-target": 3600, "company-news": 60}  # endpoint อื่นใช้ CACHE_TTL_SECONDS
+TRANSLATE_CACHE_TTL = 7 * 24 * 3600
+SUPABASE_CACHE_TTL = 600
+NEWS_REFRESH_SECONDS = int(os.environ.get("NEWS_REFRESH_SECONDS", "120"))  # ดึงข่าวใหม่ของแต่ละ symbol ไม่บ่อยกว่านี้
+AI_FINGERPRINT_MAX_AGE = int(os.environ.get("AI_FINGERPRINT_MAX_AGE", str(12 * 3600)))  # อายุสูงสุดของผล AI ที่ fingerprint ยังตรง
+CACHE_SNAPSHOT_PATH = os.environ.get("CACHE_SNAPSHOT_PATH", "cache_snapshot.bin")  # ว่าง = ไม่เก็บ snapshot
+SNAPSHOT_NAMESPACES = ("market", "translate", "ai", "supabase", "sentiment", "chart")
+OHLCV_DIR = os.environ.get("OHLCV_DIR", "ohlcv")  # ราคาย้อนหลังรายวันต่อ symbol (memory-mapped)
+INDICATOR_SOURCE = os.environ.get("INDICATOR_SOURCE", "local")  # local = คำนวณจาก OHLCV_DIR, twelvedata = เรียก API
+HISTORY_REFRESH_SECONDS = 900  # ดึงแท่งใหม่ของแต่ละ symbol ไม่บ่อยกว่านี้
+HISTORY_BARS = 5000  # จำนวนแท่งตอนดึงครั้งแรก (~20 ปี)
+HISTORY_PROVIDER = os.environ.get("HISTORY_PROVIDER", "yfinance")  # แหล่ง backfill ราคาย้อนหลัง: yfinance | twelvedata
+YFINANCE_DOWNLOAD = os.environ.get("YFINANCE_DOWNLOAD", "")  # module:function แทน yfinance.download (เช่น stand-in ตอน benchmark)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "1500"))  # งบ token ของส่วนข้อมูล (ข่าว/เทคนิค) ใน prompt AI
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "0") == "1"  # 1 = สร้าง CachedContent ฝั่ง Gemini ให้คำสั่งคงที่
+GEMINI_CONTEXT_CACHE_TTL = 3600
+CATEGORY_PROMPT_TOKEN_BUDGET = int(os.environ.get("CATEGORY_PROMPT_TOKEN_BUDGET", "4000"))  # งบ token ของข้อมูลทั้งหมวดใน prompt เดียว
+AI_MAX_OUTPUT_TOKENS = int(os.environ.get("AI_MAX_OUTPUT_TOKENS", "2048"))  # เพดานคำตอบ JSON ของ AI (เดิม prose ใช้ถึง 8000)
+AI_THINKING_TOKENS = int(os.environ.get("AI_THINKING_TOKENS", "8192"))  # เผื่อ thinking token ของ Gemini 2.5 (นับรวมใน max_output_tokens)
+AI_FAST_MODE = os.environ.get("AI_FAST_MODE", "0") == "1"  # 1 = /ai ใช้เฉพาะคะแนนรายข่าว ไม่ขอบทสรุปจาก AI (เหมือน /ai SYMBOL fast)
+SENTIMENT_TTL = 8 * 24 * 3600  # เก็บคะแนนรายข่าวนานกว่าช่วงข่าว 7 วันของ NewsStore
+SENTIMENT_FALLBACK_TTL = 600  # คะแนนจาก lexicon ตอน AI ใช้ไม่ได้ เก็บสั้นๆ แล้วให้ AI ให้คะแนนใหม่
+SENTIMENT_BACKGROUND_LIMIT = int(os.environ.get("SENTIMENT_BACKGROUND_LIMIT", "20"))  # ข่าวใหม่ล่าสุดต่อรอบที่ให้คะแนนเบื้องหลัง (0 = ปิด)
+SENTIMENT_BACKGROUND_RATE = int(os.environ.get("SENTIMENT_BACKGROUND_RATE", "2"))  # คำขอ AI เบื้องหลังต่อนาที (ทุก symbol รวมกัน)
+SENTIMENT_BACKGROUND_QUOTA = int(os.environ.get("SENTIMENT_BACKGROUND_QUOTA", "200"))  # คำขอ AI เบื้องหลังต่อวัน (0 = ไม่จำกัด)
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "64"))  # update ที่ประมวลผลพร้อมกัน (1 = ทีละ update แบบเดิม)
+EXPENSIVE_SLOTS = int(os.environ.get("EXPENSIVE_SLOTS", "4"))  # งานหนัก (/ai, /aiplus, /compare, ทั้งหมวด) ที่รันพร้อมกัน
+EXPENSIVE_SLOTS_PER_CHAT = int(os.environ.get("EXPENSIVE_SLOTS_PER_CHAT", "2"))  # slot ที่ chat เดียวใช้พร้อมกันได้
+COMMAND_RATE_LIMITS = os.environ.get("COMMAND_RATE_LIMITS", "ai=6,aiplus=4,compare=4,category=2,backtest=4")  # ครั้งต่อนาทีต่อ chat (0 = ไม่จำกัด)
+COMMAND_DAILY_QUOTAS = os.environ.get("COMMAND_DAILY_QUOTAS", "ai=100,aiplus=50,compare=50,category=20,backtest=50")  # ครั้งต่อวันต่อ chat (0 = ไม่จำกัด)
+EXPENSIVE_COST = {"ai": 1, "aiplus": 2, "compare": 3, "category": 4, "backtest": 2}  # น้ำหนักต่องานในคิว (ประมาณจำนวนคำขอ upstream)
+UPSTREAM_CONCURRENCY = os.environ.get("UPSTREAM_CONCURRENCY", "gemini=4:16,groq=4:16,translate=8:64,twelvedata=8:32")  # upstream=in-flight:คิวรอ
+UPSTREAM_QUEUE_TIMEOUT = 30  # รอคิว upstream นานสุด (วินาที) ก่อนถือว่า busy
+QUEUE_NOTICE_INTERVAL = 2  # แก้ข้อความแจ้งลำดับคิวไม่ถี่กว่านี้ (วินาที)
+QUOTE_CARD_TTL = 60  # อายุการ์ด inline (เท่าอายุ quote) ถูกขอหลังครึ่งอายุจะ refresh เบื้องหลัง
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "30"))  # วินาทีที่ Telegram เก็บคำตอบ inline ไว้เอง
+INLINE_DEADLINE_SECONDS = float(os.environ.get("INLINE_DEADLINE_SECONDS", "0.8"))  # รอดึง symbol ที่ยังไม่มีการ์ดนานสุด
+INLINE_MAX_SYMBOLS = 5  # จำนวน symbol ต่อ inline query
+INLINE_TRACKED_USERS = 1024  # จำ inline query ล่าสุดของผู้ใช้กี่คน (ใช้ทิ้งงานของ symbol ที่พิมพ์เลยไปแล้ว)
+CARD_BACKLOG_LIMIT = int(os.environ.get("CARD_BACKLOG_LIMIT", "32"))  # งานดึงการ์ดที่ค้างได้สูงสุด เกินนี้ข้ามการดึงใหม่
+CHART_DIR = os.environ.get("CHART_DIR", "charts")  # PNG ของกราฟต่อ (symbol, วันที่ของแท่งล่าสุด)
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", "2"))  # process ที่ render กราฟ
+CHART_BARS = 180  # จำนวนแท่งที่แสดงในกราฟ (~9 เดือน)
+CHART_FILE_ID_TTL = 30 * 86400  # file_id ของ Telegram ใช้ส่งรูปเดิมซ้ำได้ (แท่งใหม่ = key ใหม่)
+BACKTEST_MAX_SYMBOLS = 20  # symbol ต่อคำสั่ง /backtest (รวมผลทุกตัว)
+PORTFOLIO_DB = os.environ.get("PORTFOLIO_DB", "portfolio.sqlite3")  # พอร์ตของผู้ใช้ (ข้อมูลถาวร ไม่ใช่ cache)
+PORTFOLIO_MAX_POSITIONS = 50  # จำนวนหุ้นต่อพอร์ต
+
+# Base URL ของ upstream (เปลี่ยนได้เพื่อชี้ไป stub server ตอน benchmark)
+TWELVE_DATA_BASE_URL = os.environ.get("TWELVE_DATA_BASE_URL", "https://api.twelvedata.com")
+FINNHUB_BASE_URL = os.environ.get("FINNHUB_BASE_URL", "https://finnhub.io/api/v1")
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT", "")
+GOOGLE_TRANSLATE_URL = os.environ.get("GOOGLE_TRANSLATE_URL", "")
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL", "")
+# Groq SDK อ่าน GROQ_BASE_URL จาก environment เอง
+
+# --- Instrumentation ---
+
+def track_command(command):
+    """Decorator สำหรับ handler: นับ in-flight และจับเวลาทั้งคำสั่ง"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            chat = update.effective_chat
+            with tracing.trace('update', sample_rate=TRACE_SAMPLE_RATE, command=command,
+                               update_id=update.update_id, chat_id=chat.id if chat else None), \
+                    metrics.INFLIGHT.track_inprogress(command=command), \
+                    metrics.COMMAND_LATENCY.time(command=command):
+                return await handler(update, context)
+        return wrapper
+    return decorator
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest ที่จับเวลาทุก Bot API call (sendMessage, editMessageText, ...)"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        try:
+            with tracing.span(f'telegram.{endpoint}') as span, \
+                    metrics.UPSTREAM_LATENCY.time(provider='telegram', endpoint=endpoint):
+                code, payload = await super().do_request(url, method, *args, **kwargs)
+                if span:
+                    span.set(status=code)
+        except Exception:
+            metrics.UPSTREAM_ERRORS.inc(provider='telegram')
+            raise
+        if code == 429:
+            metrics.UPSTREAM_RATE_LIMITED.inc(provider='telegram')
+        if code >= 400:
+            metrics.UPSTREAM_ERRORS.inc(provider='telegram')
+        return code, payload
+
+
+# --- Fair scheduling ---
+
+def _parse_limits(spec):
+    """"ai=6,aiplus=4" -> {'ai': 6, 'aiplus': 4}"""
+    limits = {}
+    for part in spec.split(','):
+        name, _, value = part.partition('=')
+        if name.strip() and value.strip():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+SCHEDULER = FairScheduler(slots=EXPENSIVE_SLOTS, max_per_chat=EXPENSIVE_SLOTS_PER_CHAT)
+
+
+async def run_expensive(command, message, work):
+    """ตรวจ rate/quota ของ chat แล้วรัน await work() ผ่านคิวยุติธรรมของ SCHEDULER
+
+    message = ข้อความ "กำลังวิเคราะห์..." ที่จะแก้เป็นข้อความแจ้งเตือนถ้าถูกจำกัด
+    """
+    denied = LIMITER.check(message.chat_id, command)
+    if denied:
+        reason, value = denied
+        metrics.COMMANDS_REJECTED.inc(command=command, reason=reason)
+        logger.info(f"🚦 {command} refused for chat {message.chat_id}: {reason}")
+        if reason == 'rate':
+            await message.edit_text(f"⏳ ใช้คำสั่งนี้ถี่เกินไป กรุณาลองใหม่ในอีก {int(value) + 1} วินาที")
+        else:
+            await message.edit_text(f"🚫 ใช้คำสั่งนี้ครบ {value} ครั้งของวันนี้แล้ว กรุณาลองใหม่พรุ่งนี้")
+        return None
+    
+    queued = time.perf_counter()
+    async def start():
+        metrics.SCHEDULER_WAIT.observe(time.perf_counter() - queued, command=command)
+        token = QUEUE_PROGRESS.set(_queue_notifier(message))
+        try:
+            return await work()
+        finally:
+            QUEUE_PROGRESS.reset(token)
+    return await SCHEDULER.run(message.chat_id, start, cost=EXPENSIVE_COST.get(command, 1))
+
+
+async def _edit_quietly(message, text):
+    try:
+        await message.edit_text(text)
+    except Exception as e:
+        logger.debug(f"Cannot update queue notice: {e}")
+
+
+def _queue_notifier(message):
+    """callback ของ QUEUE_PROGRESS: แก้ข้อความ placeholder เป็นลำดับคิวและเวลารอ (ถูกเรียกจาก worker thread)"""
+    loop = asyncio.get_running_loop()
+    last_notice = [0.0]
+    
+    def notify(upstream, position, eta):
+        now = time.monotonic()
+        if now - last_notice[0] < QUEUE_NOTICE_INTERVAL:
+            return
+        last_notice[0] = now
+        text = (f"⏳ กำลังรอคิว {upstream}: ลำดับที่ {position} (ประมาณ {max(1, round(eta))} วินาที)\n"
+                f"งานจะเริ่มต่อเองเมื่อถึงคิว ไม่ต้องส่งคำสั่งซ้ำ")
+        asyncio.run_coroutine_threadsafe(_edit_quietly(message, text), loop)
+    return notify
+
 
 # --- API Functions ---
 
-def get_quote(symbol):
-    """ดึงราคาปัจจุบัน"""
+def _is_rate_limit_error(error):
+    """ตรวจว่า exception มาจาก rate limit / quota ของ upstream หรือไม่"""
+    error_msg = str(error).lower()
+    return "429" in error_msg or "quota" in error_msg or "rate limit" in error_msg or "resource_exhausted" in error_msg
+
+@lru_cache(maxsize=None)  # configure ครั้งเดียวต่อ process (genai.configure สร้าง client ใหม่ทุกครั้ง)
+def _configure_gemini(genai):
+    """ตั้งค่า Gemini client (GEMINI_API_ENDPOINT ใช้ชี้ไป endpoint อื่น เช่น stub ตอน benchmark)"""
+    if GEMINI_API_ENDPOINT:
+        genai.configure(
+            api_key=GEMINI_API_KEY,
+            transport='rest',
+            client_options={'api_endpoint': GEMINI_API_ENDPOINT}
+        )
+    else:
+        genai.configure(api_key=GEMINI_API_KEY)
+
+# Session เดียวทั้ง process เพื่อใช้ keep-alive connection กับ Twelve Data / Finnhub ซ้ำ
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount('https://', requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32))
+HTTP_SESSION.mount('http://', requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+# จำกัดคำขอที่ค้างพร้อมกันต่อ upstream (เกินแล้วรอคิว / เต็มคิวแล้วได้ UpstreamBusy)
+UPSTREAMS = UpstreamLimits(UpstreamLimits.parse(UPSTREAM_CONCURRENCY), max_wait=UPSTREAM_QUEUE_TIMEOUT)
+
+@lru_cache(maxsize=1)
+def get_supabase_client():
+    """Supabase client ที่สร้างครั้งเดียวแล้วใช้ซ้ำ"""
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@lru_cache(maxsize=1)
+def get_groq_client():
+    """Groq client ที่สร้างครั้งเดียวแล้วใช้ซ้ำ"""
+    from groq import Groq
+    return Groq(api_key=GROQ_API_KEY)
+
+CACHE = create_backend(CACHE_URL)
+LIMITER = UsageLimiter(CACHE, _parse_limits(COMMAND_RATE_LIMITS), _parse_limits(COMMAND_DAILY_QUOTAS))
+
+def cached(namespace, ttl, version=None, key_func=None):
+    """Decorator: เก็บผลของฟังก์ชัน (ที่ไม่ใช่ None) ใน CACHE ตาม argument
+
+    version เปลี่ยนเมื่อรูปแบบค่าที่คืนเปลี่ยน เพื่อไม่ให้อ่านค่ารูปแบบเก่าจาก cache/snapshot
+    key_func(*args, **kwargs) ใช้แทน argument ทั้งหมดในการสร้าง key (เช่น fingerprint ของ input)
+    """
+    def decorator(func):
+        name = f"{func.__name__}@{version}" if version else func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parts = (key_func(*args, **kwargs),) if key_func else (args, kwargs)
+            key = make_key(name, *parts)
+            return CACHE.get_or_compute(namespace, key, ttl, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+def _is_api_error(data):
+    return isinstance(data, dict) and data.get('status') == 'error'
+
+def _http_get(provider, endpoint, url, params, timeout=10):
+    """GET แล้วคืน JSON ผ่าน cache (namespace market) ไม่เก็บผลที่เป็น error"""
+    public_params = {k: v for k, v in params.items() if k not in ('apikey', 'token')}
+    key = make_key(provider, endpoint, public_params)
+    ttl = MARKET_CACHE_TTL.get(endpoint, CACHE_TTL_SECONDS)
+    return CACHE.get_or_compute(
+        'market', key, ttl,
+        lambda: _http_get_upstream(provider, endpoint, url, params, timeout),
+        should_cache=lambda data: not _is_api_error(data),
+    )
+
+def _http_get_upstream(provider, endpoint, url, params, timeout):
+    """GET แล้วคืน JSON พร้อมเก็บเมตริก latency / error / 429 ของ upstream"""
+    try:
+        def fetch():
+            response = HTTP_SESSION.get(url, params=params, timeout=timeout)
+            return response.status_code, response.json()
+        
+        with UPSTREAMS.slot(provider), \
+                tracing.span(f'{provider}.{endpoint}', symbol=params.get('symbol')) as span, \
+                metrics.UPSTREAM_LATENCY.time(provider=provider, endpoint=endpoint):
+            status_code, data = cassette.call(provider, {'endpoint': endpoint, 'params': params},
+                                              fetch, encode=list, decode=tuple)
+            if span:
+                span.set(status=status_code)
+    except UpstreamBusy:
+        raise
+    except Exception:
+        metrics.UPSTREAM_ERRORS.inc(provider=provider)
+        raise
+    
+    # Twelve Data ตอบ HTTP 200 แต่ใส่ code 429 ใน body เมื่อเครดิตหมด
+    api_error = _is_api_error(data)
+    rate_limited = status_code == 429 or (api_error and data.get('code') == 429)
+    if rate_limited:
+        metrics.UPSTREAM_RATE_LIMITED.inc(provider=provider)
+    if status_code >= 400 or api_error:
+        metrics.UPSTREAM_ERRORS.inc(provider=provider)
+        if not api_error and isinstance(data, dict):
+            # HTTP error ที่ไม่ได้ใส่ status ใน body ก็ไม่ควรถูก cache
+            data.setdefault('status', 'error')
+    return data
+
+
+def _twelvedata_quote(symbol):
+    """ดึงราคาปัจจุบันจาก Twelve Data"""
     try:
-        url = "https://api.twelvedata.com/quote"
+        url = f"{TWELVE_DATA_BASE_URL}/quote"
         params = {"symbol": symbol, "apikey": TWELVE_DATA_KEY}
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        data = _http_get("twelvedata", "quote", url, params)
         
         if data.get('status') == 'error':
             logger.error(f"Quote error: {data.get('message')}")
@@ -43,18 +351,115 @@ def get_quote(symbol):
         logger.error(f"Error fetching quote: {e}")
         return None
 
+OHLCV = OHLCVStore(OHLCV_DIR)
+_history_refreshed = {}  # symbol -> time.monotonic() ที่ดึงแท่งใหม่ครั้งล่าสุด
+
+def fetch_time_series(symbol, start_date=None, outputsize=HISTORY_BARS):
+    """ดึงราคารายวันจาก Twelve Data คืน dict ของ array (เรียงเก่าไปใหม่) หรือ None"""
+    try:
+        url = f"{TWELVE_DATA_BASE_URL}/time_series"
+        params = {
+            "symbol": symbol,
+            "interval": "1day",
+            "outputsize": outputsize,
+            "apikey": TWELVE_DATA_KEY
+        }
+        if start_date:
+            params["start_date"] = start_date
+        data = _http_get("twelvedata", "time_series", url, params)
+        
+        if data.get('status') != 'ok' or not data.get('values'):
+            logger.warning(f"⚠️ No time series for {symbol}: {data.get('message')}")
+            return None
+        values = data['values'][::-1]
+        return {
+            'ts': [calendar.timegm(time.strptime(v['datetime'][:10], '%Y-%m-%d')) for v in values],
+            'open': [float(v['open']) for v in values],
+            'high': [float(v['high']) for v in values],
+            'low': [float(v['low']) for v in values],
+            'close': [float(v['close']) for v in values],
+            'volume': [float(v.get('volume') or 0) for v in values],
+        }
+    except Exception as e:
+        logger.error(f"Error fetching time series: {e}")
+        return None
+
+YF = YFinanceProvider(download=load_download(YFINANCE_DOWNLOAD) if YFINANCE_DOWNLOAD else None)
+
+def backfill_history(symbols):
+    """เติมราคาย้อนหลังของ symbol ที่ยังไม่มีใน store ด้วย yfinance ครั้งเดียวทั้งชุด
+
+    คืนชุด symbol ที่เติมสำเร็จ (ที่เหลือให้ ensure_history ดึงจาก Twelve Data)
+    """
+    missing = sorted({s.upper() for s in symbols if OHLCV.last_timestamp(s) is None})
+    if not missing or HISTORY_PROVIDER != 'yfinance':
+        return set()
+    try:
+        start = time.perf_counter()
+        histories = YF.history(missing)
+    except ImportError:
+        logger.error("❌ yfinance not installed. Install with: pip install yfinance")
+        return set()
+    except Exception as e:
+        logger.warning(f"⚠️ yfinance backfill failed: {e}")
+        return set()
+    for symbol, columns in histories.items():
+        OHLCV.append(symbol, columns)
+        _history_refreshed[symbol] = time.monotonic()
+    logger.info(f"📈 Backfilled {len(histories)}/{len(missing)} symbols from yfinance in {time.perf_counter() - start:.2f}s")
+    return set(histories)
+
+def ensure_history(symbol):
+    """คืนราคาย้อนหลังจาก OHLCV store โดยดึงเฉพาะแท่งใหม่เมื่อถึงรอบ refresh"""
+    symbol = symbol.upper()
+    refreshed = _history_refreshed.get(symbol)
+    if refreshed is None or time.monotonic() - refreshed > HISTORY_REFRESH_SECONDS:
+        if refreshed is None and backfill_history([symbol]):
+            return OHLCV.read(symbol)
+        last = OHLCV.last_timestamp(symbol)
+        if last is None:
+            columns = fetch_time_series(symbol)
+        else:
+            start_date = time.strftime('%Y-%m-%d', time.gmtime(last))
+            days = int(time.time() - last) // 86400
+            columns = fetch_time_series(symbol, start_date=start_date, outputsize=days + 2)
+        if columns:
+            added = OHLCV.append(symbol, columns)
+            logger.info(f"📈 {symbol} history: +{added} bars ({OHLCV.length(symbol)} total)")
+            _history_refreshed[symbol] = time.monotonic()
+    return OHLCV.read(symbol)
+
+def _local_indicator(symbol, compute):
+    """คำนวณ indicator จาก OHLCV store (None = ใช้ Twelve Data แทน)"""
+    if INDICATOR_SOURCE != 'local':
+        return None
+    try:
+        bars = ensure_history(symbol)
+        if len(bars.close) == 0:
+            return None
+        return compute(bars.close)
+    except Exception as e:
+        logger.warning(f"⚠️ Local indicator failed for {symbol}: {e}")
+        return None
+
 def get_rsi(symbol):
     """ดึง RSI (14)"""
+    value = _local_indicator(symbol, lambda close: indicators.last(indicators.rsi(close, 14)))
+    if value is not None:
+        return value
+    return _twelvedata_rsi(symbol)
+
+def _twelvedata_rsi(symbol):
+    """ดึง RSI (14) จาก Twelve Data"""
     try:
-        url = "https://api.twelvedata.com/rsi"
+        url = f"{TWELVE_DATA_BASE_URL}/rsi"
         params = {
             "symbol": symbol,
             "interval": "1day",
             "time_period": 14,
             "apikey": TWELVE_DATA_KEY
         }
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        data = _http_get("twelvedata", "rsi", url, params)
         
         if data.get('status') == 'ok' and data.get('values'):
             return float(data['values'][0]['rsi'])
@@ -64,15 +469,21 @@ def get_rsi(symbol):
 
 def get_macd(symbol):
     """ดึง MACD"""
+    local = _local_indicator(symbol, lambda close: [indicators.last(line) for line in indicators.macd(close)[:2]])
+    if local and None not in local:
+        return local[0], local[1]
+    return _twelvedata_macd(symbol)
+
+def _twelvedata_macd(symbol):
+    """ดึง MACD จาก Twelve Data"""
     try:
-        url = "https://api.twelvedata.com/macd"
+        url = f"{TWELVE_DATA_BASE_URL}/macd"
         params = {
             "symbol": symbol,
             "interval": "1day",
             "apikey": TWELVE_DATA_KEY
         }
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        data = _http_get("twelvedata", "macd", url, params)
         
         if data.get('status') == 'ok' and data.get('values'):
             latest = data['values'][0]
@@ -83,16 +494,22 @@ def get_macd(symbol):
 
 def get_ema(symbol, period):
     """ดึง EMA"""
+    value = _local_indicator(symbol, lambda close: indicators.last(indicators.ema(close, period)))
+    if value is not None:
+        return value
+    return _twelvedata_ema(symbol, period)
+
+def _twelvedata_ema(symbol, period):
+    """ดึง EMA จาก Twelve Data"""
     try:
-        url = "https://api.twelvedata.com/ema"
+        url = f"{TWELVE_DATA_BASE_URL}/ema"
         params = {
             "symbol": symbol,
             "interval": "1day",
             "time_period": period,
             "apikey": TWELVE_DATA_KEY
         }
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        data = _http_get("twelvedata", "ema", url, params)
         
         if data.get('status') == 'ok' and data.get('values'):
             return float(data['values'][0]['ema'])
@@ -102,16 +519,22 @@ def get_ema(symbol, period):
 
 def get_bbands(symbol):
     """ดึง Bollinger Bands"""
+    local = _local_indicator(symbol, lambda close: [indicators.last(band) for band in indicators.bbands(close, 20)[::2]])
+    if local and None not in local:
+        return local[0], local[1]
+    return _twelvedata_bbands(symbol)
+
+def _twelvedata_bbands(symbol):
+    """ดึง Bollinger Bands จาก Twelve Data"""
     try:
-        url = "https://api.twelvedata.com/bbands"
+        url = f"{TWELVE_DATA_BASE_URL}/bbands"
         params = {
             "symbol": symbol,
             "interval": "1day",
             "time_period": 20,
             "apikey": TWELVE_DATA_KEY
         }
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        data = _http_get("twelvedata", "bbands", url, params)
         
         if data.get('status') == 'ok' and data.get('values'):
             latest = data['values'][0]
@@ -126,10 +549,9 @@ def get_analyst_recommendations(symbol):
         if not FINNHUB_KEY or FINNHUB_KEY == "":
             return None
             
-        url = f"https://finnhub.io/api/v1/stock/recommendation"
+        url = f"{FINNHUB_BASE_URL}/stock/recommendation"
         params = {"symbol": symbol, "token": FINNHUB_KEY}
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        data = _http_get("finnhub", "recommendation", url, params)
         return data[0] if data and len(data) > 0 else None
     except Exception as e:
         logger.error(f"Error fetching recommendations: {e}")
@@ -141,10 +563,9 @@ def get_price_target(symbol):
         if not FINNHUB_KEY or FINNHUB_KEY == "":
             return None
             
-        url = f"https://finnhub.io/api/v1/stock/price-target"
+        url = f"{FINNHUB_BASE_URL}/stock/price-target"
         params = {"symbol": symbol, "token": FINNHUB_KEY}
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
+        data = _http_get("finnhub", "price-target", url, params)
         
         if data and 'targetMean' in data:
             return {
@@ -158,34 +579,27 @@ def get_price_target(symbol):
         logger.error(f"Error fetching price target: {e}")
         return None
 
+def _fetch_company_news(symbol, from_ts, to_ts):
+    """ดึงข่าวบริษัทจาก Finnhub ช่วงวันที่ของ from_ts ถึง to_ts (unix, UTC)"""
+    url = f"{FINNHUB_BASE_URL}/company-news"
+    params = {
+        "symbol": symbol,
+        "from": time.strftime('%Y-%m-%d', time.gmtime(from_ts)),
+        "to": time.strftime('%Y-%m-%d', time.gmtime(to_ts)),
+        "token": FINNHUB_KEY
+    }
+    data = _http_get("finnhub", "company-news", url, params)
+    return data if isinstance(data, list) else None
+
+NEWS = NewsStore(_fetch_company_news, refresh_seconds=NEWS_REFRESH_SECONDS, window_days=7)
+
 def get_company_news(symbol, days=7):
-    """ดึงข่าวบริษัท (จาก Finnhub)"""
+    """ดึงข่าวบริษัทล่าสุด 5 ข่าว (จาก NEWS ซึ่งดึง Finnhub เฉพาะช่วงที่ใหม่กว่า cursor)"""
     try:
         if not FINNHUB_KEY or FINNHUB_KEY == "":
             return None
         
-        from datetime import datetime, timedelta
-        
-        # คำนวณวันที่ย้อนหลัง
-        to_date = datetime.now()
-        from_date = to_date - timedelta(days=days)
-        
-        url = f"https://finnhub.io/api/v1/company-news"
-        params = {
-            "symbol": symbol,
-            "from": from_date.strftime('%Y-%m-%d'),
-            "to": to_date.strftime('%Y-%m-%d'),
-            "token": FINNHUB_KEY
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        data = response.json()
-        
-        # กรองและเรียงตามวันที่ล่าสุด
-        if data and isinstance(data, list):
-            # เอาแค่ 5 ข่าวล่าสุด
-            return data[:5]
-        return None
+        return NEWS.top(symbol, limit=5, days=days) or None
         
     except Exception as e:
         logger.error(f"Error fetching company news: {e}")
@@ -195,24 +609,31 @@ def get_company_news(symbol, days=7):
 def get_stock_data_from_supabase(symbol):
     """ดึงข้อมูล snapshot ล่าสุดจาก Supabase"""
     try:
-        from supabase import create_client
-        
         if not SUPABASE_URL or not SUPABASE_KEY:
             logger.warning("⚠️ No Supabase credentials found")
             return None
         
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        supabase = get_supabase_client()
         
         # ดึงข้อมูลล่าสุดของ symbol นี้
-        response = supabase.table('stock_snapshots') \
-            .select('*') \
-            .eq('symbol', symbol.upper()) \
-            .order('recorded_at', desc=True) \
-            .limit(1) \
-            .execute()
-        
-        if response.data and len(response.data) > 0:
-            data = response.data[0]
+        with tracing.span('supabase.stock_snapshots', symbol=symbol), \
+                metrics.UPSTREAM_LATENCY.time(provider='supabase', endpoint='stock_snapshots'):
+            rows = CACHE.get_or_compute(
+                'supabase', make_key('stock_snapshots', symbol.upper()), SUPABASE_CACHE_TTL,
+                lambda: cassette.call(
+                    'supabase', {'table': 'stock_snapshots', 'symbol': symbol.upper()},
+                    lambda: supabase.table('stock_snapshots')
+                        .select('*')
+                        .eq('symbol', symbol.upper())
+                        .order('recorded_at', desc=True)
+                        .limit(1)
+                        .execute()
+                        .data
+                )
+            )
+        
+        if rows and len(rows) > 0:
+            data = rows[0]
             logger.info(f"✅ Found Supabase data for {symbol} from {data.get('recorded_at')}")
             return data
         else:
@@ -223,11 +644,738 @@ def get_stock_data_from_supabase(symbol):
         logger.error("❌ supabase-py not installed. Install with: pip install supabase")
         return None
     except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(provider='supabase')
         logger.error(f"❌ Supabase query error: {e}")
         return None
 
-def analyze_with_groq(prompt, context_name="analysis"):
-    """วิเคราะห์ด้วย Groq API (Fallback)"""
+def get_finnhub_quote(symbol):
+    """ดึงราคาปัจจุบันจาก Finnhub แล้วคืนในรูปแบบเดียวกับ Twelve Data /quote"""
+    try:
+        url = f"{FINNHUB_BASE_URL}/quote"
+        params = {"symbol": symbol, "token": FINNHUB_KEY}
+        data = _http_get("finnhub", "quote", url, params)
+        
+        # Finnhub ตอบ c = 0 เมื่อไม่รู้จัก symbol
+        if not isinstance(data, dict) or not data.get('c'):
+            return None
+        return {
+            'symbol': symbol.upper(),
+            'close': str(data['c']),
+            'previous_close': str(data.get('pc') or data['c']),
+            'open': str(data.get('o') or data['c']),
+            'high': str(data.get('h') or data['c']),
+            'low': str(data.get('l') or data['c']),
+        }
+    except Exception as e:
+        logger.error(f"Error fetching Finnhub quote: {e}")
+        return None
+
+
+# --- Provider routing ---
+
+# provider -> ข้อความแสดงแหล่งที่มาในรายงาน
+DATA_SOURCE_LABELS = {
+    'twelvedata': 'Twelve Data',
+    'finnhub': 'Finnhub',
+    'yfinance': 'Yahoo Finance',
+    'local': 'OHLCV (คำนวณเอง)',
+    'supabase': 'Supabase (Snapshot)',
+}
+TECHNICAL_FIELDS = ('rsi', 'macd', 'macd_signal', 'ema_20', 'ema_50', 'ema_200', 'bb_lower', 'bb_upper')
+# ตัวชี้วัดหลักที่ต้องมีจึงถือว่าข้อมูลเทคนิคครบ (เหมือนเงื่อนไข fallback ไป Supabase เดิม)
+REQUIRED_TECHNICALS = ('rsi', 'macd', 'ema_20', 'bb_lower')
+DATA_DEADLINE_SECONDS = float(os.environ.get("DATA_DEADLINE_SECONDS", "8"))
+
+def _supabase_quote(symbol):
+    """ราคาจาก snapshot ล่าสุดใน Supabase (ถ้า snapshot มีคอลัมน์ราคา)"""
+    row = get_stock_data_from_supabase(symbol)
+    price = row and (row.get('price') or row.get('close'))
+    if not price:
+        return None
+    return {
+        'symbol': symbol.upper(),
+        'close': str(price),
+        'previous_close': str(row.get('previous_close') or price),
+        'recorded_at': row.get('recorded_at'),
+    }
+
+def _local_technicals(symbol):
+    """ตัวชี้วัดทั้งหมดจาก OHLCV store (ดึงราคาย้อนหลังครั้งเดียว)"""
+    bars = ensure_history(symbol)
+    if len(bars.close) == 0:
+        return None
+    close = bars.close
+    macd_line, macd_signal, _ = indicators.macd(close)
+    bb_lower, _, bb_upper = indicators.bbands(close, 20)
+    return {
+        'rsi': indicators.last(indicators.rsi(close, 14)),
+        'macd': indicators.last(macd_line),
+        'macd_signal': indicators.last(macd_signal),
+        'ema_20': indicators.last(indicators.ema(close, 20)),
+        'ema_50': indicators.last(indicators.ema(close, 50)),
+        'ema_200': indicators.last(indicators.ema(close, 200)),
+        'bb_lower': indicators.last(bb_lower),
+        'bb_upper': indicators.last(bb_upper),
+    }
+
+def _twelvedata_technicals(symbol):
+    """ตัวชี้วัดจาก endpoint ของ Twelve Data (ยิงพร้อมกันทั้งหมด)"""
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        rsi = pool.submit(in_context(_twelvedata_rsi), symbol)
+        macd = pool.submit(in_context(_twelvedata_macd), symbol)
+        emas = {period: pool.submit(in_context(_twelvedata_ema), symbol, period) for period in (20, 50, 200)}
+        bbands = pool.submit(in_context(_twelvedata_bbands), symbol)
+        macd_value, macd_signal = macd.result()
+        bb_lower, bb_upper = bbands.result()
+        return {
+            'rsi': rsi.result(),
+            'macd': macd_value,
+            'macd_signal': macd_signal,
+            'ema_20': emas[20].result(),
+            'ema_50': emas[50].result(),
+            'ema_200': emas[200].result(),
+            'bb_lower': bb_lower,
+            'bb_upper': bb_upper,
+        }
+
+def _supabase_technicals(symbol):
+    """ตัวชี้วัดจาก snapshot ล่าสุดใน Supabase"""
+    row = get_stock_data_from_supabase(symbol)
+    if not row:
+        return None
+    data = {field: float(row[field]) if row.get(field) is not None else None for field in TECHNICAL_FIELDS}
+    data['recorded_at'] = row.get('recorded_at')
+    return data
+
+def _has_required_technicals(data):
+    return all(data.get(field) is not None for field in REQUIRED_TECHNICALS)
+
+ROUTER = ProviderRouter()
+ROUTER.register('quote', 'twelvedata', _twelvedata_quote, expected_latency=0.4)
+ROUTER.register('quote', 'finnhub', get_finnhub_quote, expected_latency=0.4)
+ROUTER.register('quote', 'yfinance', YF.get_quote, expected_latency=1.0)
+ROUTER.register('quote', 'supabase', _supabase_quote, expected_latency=1.5, fallback=True)
+if INDICATOR_SOURCE == 'local':
+    ROUTER.register('technicals', 'local', _local_technicals, expected_latency=0.5)
+ROUTER.register('technicals', 'twelvedata', _twelvedata_technicals, expected_latency=1.5)
+ROUTER.register('technicals', 'supabase', _supabase_technicals, expected_latency=2.0, fallback=True)
+
+def get_quote(symbol):
+    """ดึงราคาปัจจุบันจากแหล่งที่เร็วที่สุดที่ใช้ได้ (มี key 'source' บอกแหล่งที่มา)"""
+    result = ROUTER.fetch('quote', symbol, deadline=DATA_DEADLINE_SECONDS,
+                          accept=lambda quote: 'close' in quote)
+    if result is None or not result.complete:
+        return None
+    return {**result.value, 'source': result.provider}
+
+def get_quotes_batch(symbols):
+    """ราคาปัจจุบันของหลาย symbol: จาก cache ก่อน ที่เหลือใช้ yfinance ครั้งเดียวทั้งชุด ตัวที่ขาดค่อยผ่าน router ทีละตัว"""
+    symbols = [s.upper() for s in symbols]
+    quotes = {}
+    for symbol in symbols:
+        try:
+            quote = CACHE.lookup('market', make_key('batch-quote', symbol))
+        except Exception as e:
+            logger.warning(f"⚠️ Cache get failed (market): {e}")
+            quote = None
+        if quote:
+            quotes[symbol] = quote
+    uncached = [symbol for symbol in symbols if symbol not in quotes]
+    if not uncached:
+        return quotes
+    try:
+        fetched = YF.get_quotes(uncached)
+        for symbol, quote in fetched.items():
+            CACHE.set('market', make_key('batch-quote', symbol), quote, MARKET_CACHE_TTL['quote'])
+        quotes.update(fetched)
+    except ImportError:
+        logger.warning("⚠️ yfinance not installed, fetching quotes one by one")
+    except Exception as e:
+        logger.warning(f"⚠️ yfinance batch quote failed: {e}")
+    missing = [symbol for symbol in symbols if symbol not in quotes]
+    if missing:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for symbol, quote in zip(missing, pool.map(in_context(get_quote), missing)):
+                if quote:
+                    quotes[symbol] = quote
+    return quotes
+
+def get_technicals(symbol):
+    """ตัวชี้วัดเทคนิคทั้งหมดพร้อมแหล่งที่มา (None ถ้าไม่มีแหล่งไหนตอบ)"""
+    result = ROUTER.fetch('technicals', symbol, deadline=DATA_DEADLINE_SECONDS, accept=_has_required_technicals)
+    if result is None:
+        return None
+    logger.info(f"📊 Technicals for {symbol} from {result.provider} in {result.elapsed:.2f}s"
+                f"{'' if result.complete else ' (incomplete)'}")
+    return {**result.value, 'source': result.provider}
+
+def collect_technical_data(symbol):
+    """รวมราคา ตัวชี้วัด และมุมมองนักวิเคราะห์ของหุ้นสำหรับการวิเคราะห์ AI (None ถ้าไม่มีราคา)"""
+    quote = get_quote(symbol)
+    if not quote or 'close' not in quote:
+        return None
+    
+    current = float(quote['close'])
+    prev_close = float(quote.get('previous_close', current))
+    change = current - prev_close
+    change_pct = (change / prev_close) * 100
+    
+    technicals = get_technicals(symbol) or {}
+    technical_data = {
+        'current': current,
+        'change_pct': change_pct,
+        **{field: technicals.get(field) for field in TECHNICAL_FIELDS},
+        'bb_position': None,
+        'analyst_buy_pct': None,
+        'upside_pct': None,
+        'data_source': DATA_SOURCE_LABELS.get(technicals.get('source'), 'API'),
+        'quote_source': DATA_SOURCE_LABELS.get(quote.get('source'), 'API'),
+        'recorded_at': technicals.get('recorded_at'),
+    }
+    
+    bb_lower, bb_upper = technical_data['bb_lower'], technical_data['bb_upper']
+    if bb_lower and bb_upper and bb_upper != bb_lower:
+        technical_data['bb_position'] = ((current - bb_lower) / (bb_upper - bb_lower)) * 100
+    
+    # Analyst recommendations
+    recommendations = get_analyst_recommendations(symbol)
+    if recommendations:
+        buy = recommendations.get('buy', 0)
+        hold = recommendations.get('hold', 0)
+        sell = recommendations.get('sell', 0)
+        total = buy + hold + sell
+        if total > 0:
+            technical_data['analyst_buy_pct'] = (buy / total) * 100
+    
+    # Price target
+    price_target = get_price_target(symbol)
+    if price_target and price_target['target_mean']:
+        target_mean = price_target['target_mean']
+        technical_data['upside_pct'] = ((target_mean - current) / current) * 100
+    
+    return technical_data
+
+
+# --- Inline quote cards ---
+# การ์ดเก็บใน CACHE (แชร์ระหว่าง worker) inline query อ่านการ์ดอย่างเดียว งานดึงข้อมูลอยู่ใน executor นี้
+CARD_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='card')
+_cards_lock = threading.Lock()
+_cards_refreshing = {}  # symbol -> (future, {user_id ที่รออยู่}) ของงานที่รอคิวหรือรันอยู่ (symbol ละงานเดียว)
+_inline_latest = OrderedDict()  # user_id -> symbols ของ inline query ล่าสุด
+
+def _build_quote_card(symbol):
+    """ดึง quote และ technicals พร้อมกันแล้วย่อเป็นการ์ด (None ถ้าไม่มีราคา)"""
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            technicals = pool.submit(get_technicals, symbol)
+            quote = get_quote(symbol)
+            if not quote or 'close' not in quote:
+                return None
+            return quote_card.build_card(symbol, quote, technicals.result())
+    except Exception as e:
+        logger.warning(f"⚠️ Cannot build quote card for {symbol}: {e}")
+        return None
+
+def _remember_inline_query(user_id, symbols):
+    with _cards_lock:
+        _inline_latest[user_id] = symbols
+        _inline_latest.move_to_end(user_id)
+        while len(_inline_latest) > INLINE_TRACKED_USERS:
+            _inline_latest.popitem(last=False)
+
+def _card_wanted(symbol, requesters):
+    """ยังมีผู้ใช้ที่ query ล่าสุดมี symbol นี้อยู่ไหม (refresh เบื้องหลังไม่มีผู้รอ จึงทำเสมอ)"""
+    with _cards_lock:
+        return not requesters or any(symbol in _inline_latest.get(user_id, ()) for user_id in requesters)
+
+def _fetch_quote_card(symbol, requesters):
+    try:
+        # พิมพ์ทีละตัว (A, AA, AAP, AAPL) ทำให้มีงานของ prefix ค้างคิว ถึงคิวแล้วไม่มีใครรอก็ทิ้งไป
+        if not _card_wanted(symbol, requesters):
+            return None
+        card = _build_quote_card(symbol)
+        if card:
+            try:
+                CACHE.set('card', make_key(symbol), card, QUOTE_CARD_TTL)
+            except Exception as e:
+                logger.warning(f"⚠️ Cache set failed (card): {e}")
+        return card
+    finally:
+        with _cards_lock:
+            _cards_refreshing.pop(symbol, None)
+
+def submit_quote_card(symbol, user_id=None):
+    """ส่งงานดึงการ์ดเข้า CARD_EXECUTOR คืน Future (ใช้งานเดิมถ้า symbol นี้กำลังดึงอยู่)
+
+    คืน None ถ้างานค้างถึง CARD_BACKLOG_LIMIT แล้ว user_id=None คือ refresh เบื้องหลัง
+    """
+    with _cards_lock:
+        entry = _cards_refreshing.get(symbol)
+        if entry is not None:
+            if user_id is not None:
+                entry[1].add(user_id)
+            return entry[0]
+        if len(_cards_refreshing) >= CARD_BACKLOG_LIMIT:
+            return None
+        requesters = set() if user_id is None else {user_id}
+        future = CARD_EXECUTOR.submit(_fetch_quote_card, symbol, requesters)
+        _cards_refreshing[symbol] = (future, requesters)
+        return future
+
+def cached_quote_cards(symbols):
+    """การ์ดที่มีอยู่แล้วเท่านั้น (ไม่ดึงข้อมูล) การ์ดที่เลยครึ่งอายุถูกส่งไป refresh เบื้องหลัง"""
+    cards = {}
+    for symbol in symbols:
+        try:
+            cards[symbol] = CACHE.lookup('card', make_key(symbol))
+        except Exception as e:
+            logger.warning(f"⚠️ Cache get failed (card): {e}")
+            cards[symbol] = None
+        metrics.record_cache('card', hit=cards[symbol] is not None)
+        if cards[symbol] and time.time() - cards[symbol]['updated_at'] > QUOTE_CARD_TTL / 2:
+            submit_quote_card(symbol)
+    return cards
+
+
+# --- Charts ---
+
+@lru_cache(maxsize=None)  # สร้าง pool ตอนขอกราฟครั้งแรก (process ที่ไม่เคยขอกราฟไม่ต้อง import matplotlib)
+def _chart_pool():
+    # spawn: fork จาก process ที่มีหลาย thread (executor, sqlite, event loop) อาจติด lock ค้างใน child
+    return ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+_chart_renders = {}  # (symbol, วันที่แท่งล่าสุด) -> future ของการ render ที่กำลังทำ
+
+def _chart_file_id(key):
+    """file_id ของกราฟที่เคยส่งแล้ว (None ถ้าไม่มีหรือ cache ใช้ไม่ได้)"""
+    try:
+        return CACHE.lookup('chart', key)
+    except Exception as e:
+        logger.warning(f"⚠️ Cache get failed (chart): {e}")
+        return None
+
+def _store_chart_file_id(key, file_id):
+    """เก็บ file_id ของกราฟ (file_id=None = ลบอันที่ Telegram ไม่รับแล้ว)"""
+    try:
+        if file_id:
+            CACHE.set('chart', key, file_id, CHART_FILE_ID_TTL)
+        else:
+            CACHE.delete('chart', key)
+    except Exception as e:
+        logger.warning(f"⚠️ Cache set failed (chart): {e}")
+
+def _bar_date(bars):
+    return time.strftime('%Y-%m-%d', time.gmtime(int(bars.ts[-1])))
+
+def _chart_path(symbol, bar_date):
+    return os.path.join(CHART_DIR, f"{symbol}_{bar_date}.png")
+
+def _read_chart(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _save_chart(symbol, path, png):
+    """เขียน PNG แบบ atomic แล้วลบกราฟวันก่อนๆ ของ symbol เดียวกัน"""
+    os.makedirs(CHART_DIR, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(png)
+    os.replace(temp_path, path)
+    prefix = f"{symbol}_"
+    for name in os.listdir(CHART_DIR):
+        old_path = os.path.join(CHART_DIR, name)
+        if name.startswith(prefix) and name.endswith('.png') and old_path != path:
+            os.remove(old_path)
+
+async def render_chart_png(symbol, bars):
+    """PNG ของกราฟ: จากดิสก์ถ้าเคย render แท่งนี้แล้ว ไม่งั้น render ใน process pool (คำขอซ้ำรอผลเดียวกัน)"""
+    bar_date = _bar_date(bars)
+    path = _chart_path(symbol, bar_date)
+    png = await asyncio.to_thread(_read_chart, path)
+    if png:
+        return png
+    
+    key = (symbol, bar_date)
+    future = _chart_renders.get(key)
+    if future is not None:
+        return await asyncio.shield(future)
+    
+    future = asyncio.get_running_loop().run_in_executor(
+        _chart_pool(), chart_render.render_chart, symbol, np.array(bars.ts), np.array(bars.close), CHART_BARS
+    )
+    _chart_renders[key] = future
+    try:
+        with metrics.UPSTREAM_LATENCY.time(provider='chart', endpoint='render'):
+            png = await asyncio.shield(future)
+    finally:
+        _chart_renders.pop(key, None)
+    await asyncio.to_thread(_save_chart, symbol, path, png)
+    return png
+
+
+# --- Backtest ---
+
+def run_backtest(symbols):
+    """backtest กฎสัญญาณของรายงานบนราคาย้อนหลังใน OHLCV store คืน (ผล, ช่วงวันที่) หรือ None ถ้าไม่มีข้อมูล"""
+    # symbol ที่ยังไม่มีราคาย้อนหลัง: backfill ครั้งเดียวทั้งชุด ensure_history จึงเหลือแค่เติมแท่งใหม่
+    new_symbols = [symbol for symbol in symbols if OHLCV.length(symbol) == 0]
+    if new_symbols:
+        try:
+            backfill_history(new_symbols)
+        except Exception as e:
+            logger.warning(f"⚠️ Backtest history backfill failed: {e}")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        histories = dict(zip(symbols, pool.map(ensure_history, symbols)))
+    histories = {symbol: bars for symbol, bars in histories.items() if len(bars.close) >= backtest.MIN_BARS}
+    if not histories:
+        return None
+    start = time.perf_counter()
+    result = backtest.backtest_many({symbol: bars.close for symbol, bars in histories.items()})
+    logger.info(f"🧪 Backtested {len(histories)} symbols ({result['bars']} bars) in {time.perf_counter() - start:.3f}s")
+    first = min(int(bars.ts[0]) for bars in histories.values())
+    last = max(int(bars.ts[-1]) for bars in histories.values())
+    period = f"{time.strftime('%Y-%m-%d', time.gmtime(first))} ถึง {time.strftime('%Y-%m-%d', time.gmtime(last))}"
+    return result, period
+
+
+# --- Portfolio ---
+PORTFOLIOS = portfolio.PortfolioStore(PORTFOLIO_DB)
+
+def _closes_with_quote(symbol, price):
+    """ราคาปิดที่มีอยู่แล้วใน OHLCV store (ไม่ refresh ราย symbol) โดยแท่งวันนี้ใช้ราคาปัจจุบัน"""
+    bars = OHLCV.read(symbol)
+    if len(bars.close) == 0:
+        return np.empty(0)
+    if int(bars.ts[-1]) // 86400 == int(time.time()) // 86400:
+        close = np.array(bars.close)
+        close[-1] = price
+        return close
+    return np.append(bars.close, price)
+
+def value_portfolio(chat_id):
+    """รายงานพอร์ต (None ถ้าพอร์ตว่าง): quote แบบ batch ชุดเดียว + ตัวชี้วัดจากราคาย้อนหลังที่เก็บไว้"""
+    holdings = PORTFOLIOS.holdings(chat_id)
+    if not holdings:
+        return None
+    quotes = get_quotes_batch([symbol for symbol, _, _ in holdings])
+    priced = [holding for holding in holdings if holding[0] in quotes]
+    missing = [symbol for symbol, _, _ in holdings if symbol not in quotes]
+    if not priced:
+        return f"❌ ดึงราคาปัจจุบันไม่ได้: {', '.join(missing)}\nกรุณาลองใหม่อีกครั้ง"
+    
+    symbols = [symbol for symbol, _, _ in priced]
+    quantity = np.array([held for _, held, _ in priced])
+    average_cost = np.array([cost for _, _, cost in priced])
+    price = np.array([float(quotes[symbol]['close']) for symbol in symbols])
+    previous_close = np.array([float(quotes[symbol].get('previous_close') or quotes[symbol]['close'])
+                               for symbol in symbols])
+    result = portfolio.valuate(quantity, average_cost, price, previous_close)
+    
+    # symbol ที่ยังไม่มีราคาย้อนหลัง: backfill ครั้งเดียวทั้งชุด
+    new_symbols = [symbol for symbol in symbols if OHLCV.length(symbol) == 0]
+    if new_symbols:
+        try:
+            backfill_history(new_symbols)
+        except Exception as e:
+            logger.warning(f"⚠️ Portfolio history backfill failed: {e}")
+    masks = portfolio.latest_signals([_closes_with_quote(symbol, p) for symbol, p in zip(symbols, price)])
+    exposure = portfolio.signal_exposure(result['weight'], masks)
+    return portfolio.render_portfolio(symbols, quantity, average_cost, price, result, exposure, missing)
+
+
+# --- AI prompts ---
+# คำสั่งคงที่ส่งเป็น system instruction (prefix เดิมทุกครั้ง -> ได้ prompt cache ฝั่ง provider)
+# ส่วน prompt ของผู้ใช้มีแค่ข้อมูลที่เปลี่ยน ซึ่งถูกคุมด้วย PROMPT_TOKEN_BUDGET
+COMBINED_ANALYSIS_PROMPT = PromptTemplate('combined', """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งข้อมูลเทคนิคและข่าวล่าสุดของหุ้นหนึ่งตัวมา
+วิเคราะห์แบบรวมแล้วตอบเป็น JSON ตาม schema เท่านั้น
+ข้อความทุกช่องเป็นภาษาไทยที่เข้าใจง่าย กระชับ ตรงประเด็น ไม่ใช้ markdown
+
+ข่าว:
+- news: ทุกข่าวตามลำดับที่ได้รับ (i = เลขข่าว)
+  sentiment = positive (ข่าวดี) / neutral (ข่าวกลาง) / negative (ข่าวไม่ดี)
+  impact = ผลกระทบต่อราคาหุ้น 1 ประโยค
+- key_points: ประเด็นสำคัญ ปัจจัยบวกและปัจจัยลบที่โดดเด่น (ไม่เกิน 3 ข้อ)
+- news_score: -10 ถึง +10
+  -10 ถึง -7 = ข่าวร้ายมาก, -6 ถึง -4 = ข่าวไม่ดี, -3 ถึง -1 = ค่อนข้างลบ, 0 = เป็นกลาง,
+  +1 ถึง +3 = ค่อนข้างบวก, +4 ถึง +6 = ข่าวดี, +7 ถึง +10 = ข่าวดีมาก
+
+เทคนิค:
+- technical.signal: bullish / bearish / neutral (สัญญาณรวม)
+- technical.rsi, technical.macd, technical.ema, technical.bollinger: ตีความตัวชี้วัดละ 1 วลี
+  (Oversold/Overbought/Neutral, Bullish/Bearish Crossover, Uptrend/Downtrend/Sideways, ตำแหน่งราคาในแบนด์)
+- technical.score: -10 ถึง +10
+- support / resistance: แนวรับ / แนวต้านที่สำคัญเป็นราคา (เรียงจากใกล้ราคาปัจจุบัน ไม่เกิน 2 ระดับ)
+
+Valuation:
+- valuation.analyst_view: ความเห็นนักวิเคราะห์ Buy/Hold/Sell และราคาถูกหรือแพงเมื่อเทียบกับเป้าหมาย
+- valuation.margin_of_safety: high / medium / low / none
+
+สรุปและคำแนะนำ:
+- conflicts: สัญญาณที่ขัดแย้งกัน เช่น ข่าวดีแต่เทคนิคขาลง, ข่าวไม่ดีแต่เทคนิคขาขึ้น,
+  นักวิเคราะห์แนะนำซื้อแต่เทคนิคขาลง (ถ้าไม่มีให้เป็น [])
+- risk: low (ข่าวดี + เทคนิคดี + Valuation ดี) / medium (สัญญาณปนกัน) / high (ไม่ดีหรือขัดแย้งกันมาก)
+- timeframe: short (1-7 วัน) / mid (1-4 สัปดาห์) / long (1-6 เดือน+)
+- action: buy (ทุกสัญญาณดี) / wait (สัญญาณไม่ชัดหรือขัดแย้งกัน) / sell (สัญญาณไม่ดี)
+- entry: ราคาที่แนะนำให้เข้า หรือระดับที่ควรรอปรับฐาน พร้อมเหตุผลสั้นๆ
+- stop_loss: ต่ำกว่าแนวรับ 2-5%
+- take_profit: เป้าหมายระยะสั้น (TP1), ระยะกลาง (TP2) และระยะยาวถ้ามี เป็นราคา
+- overall_score: -10 ถึง +10 ถ่วงน้ำหนัก News 30% + Technical 40% + Valuation 20% + Analyst 10%
+- summary: สรุปแก่นของการวิเคราะห์ทั้งหมด 2-3 ประโยค
+""", """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งข้อมูลเทคนิคและข่าวล่าสุดของหุ้นหนึ่งตัวมา วิเคราะห์แบบรวมแล้วตอบเป็น JSON เท่านั้น ข้อความเป็นภาษาไทยสั้นๆ
+news: sentiment ของทุกข่าว (i = เลขข่าว) + impact 1 ประโยค; scores อยู่ในช่วง -10 ถึง +10
+support/resistance/entry/stop_loss/take_profit เป็นราคา (stop_loss ต่ำกว่าแนวรับ 2-5%)
+overall_score ถ่วงน้ำหนัก News 30% Technical 40% Valuation 20% Analyst 10%; conflicts = สัญญาณที่ขัดแย้งกัน
+รูปแบบ JSON: """ + ai_report.schema_outline(ai_report.COMBINED_SCHEMA))
+
+NEWS_ANALYSIS_PROMPT = PromptTemplate('news', """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งข่าวล่าสุดของหุ้นหนึ่งตัวมา พร้อม sentiment และใจความของแต่ละข่าวที่ประเมินไว้แล้ว
+เขียนบทสรุปแล้วตอบเป็น JSON ตาม schema เท่านั้น
+ข้อความเป็นภาษาไทยที่เข้าใจง่าย กระชับ ตรงประเด็น ไม่ใช้ markdown
+
+- summary: สรุปประเด็นสำคัญของข่าวทั้งหมดในรอบสัปดาห์นี้และผลต่อราคาหุ้นโดยรวม (2-3 ประโยค)
+  ไม่ต้องไล่ทีละข่าว และไม่ต้องประเมิน sentiment ใหม่
+""", """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งข่าวล่าสุดของหุ้นหนึ่งตัวพร้อม sentiment ที่ประเมินแล้วมา ตอบเป็น JSON เท่านั้น
+summary = สรุปภาพรวมของข่าวและผลต่อราคาหุ้นเป็นภาษาไทย 2-3 ประโยค
+รูปแบบ JSON: """ + ai_report.schema_outline(ai_report.NEWS_SCHEMA))
+
+HEADLINE_SENTIMENT_PROMPT = PromptTemplate('headline', """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งหัวข้อข่าวมาเป็นรายการมีเลขกำกับ แต่ละข่าวมีชื่อหุ้นในวงเล็บเหลี่ยม
+ประเมินทุกข่าวแยกกันตามหุ้นที่กำกับไว้แล้วตอบเป็น JSON ตาม schema เท่านั้น
+
+- headlines: ทุกข่าวตามลำดับที่ได้รับ (i = เลขข่าว)
+  sentiment = positive (ข่าวดีต่อราคาหุ้น) / neutral (กลางๆ หรือไม่เกี่ยวกับบริษัทโดยตรง) / negative (ข่าวไม่ดี)
+  score = น้ำหนักของข่าวต่อราคาหุ้น -10 ถึง +10 (0 = ไม่มีผล)
+  gist = ใจความสำคัญและผลกระทบต่อหุ้นเป็นภาษาไทย 1 ประโยคสั้นๆ ไม่ใช้ markdown
+""", """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งหัวข้อข่าวพร้อมชื่อหุ้นในวงเล็บเหลี่ยมมา ตอบเป็น JSON เท่านั้น
+ทุกข่าว (i = เลขข่าว): sentiment, score -10 ถึง +10, gist = ใจความและผลกระทบเป็นภาษาไทย 1 ประโยค
+รูปแบบ JSON: """ + ai_report.schema_outline(ai_report.HEADLINE_SCHEMA))
+
+CATEGORY_ANALYSIS_PROMPT = PromptTemplate('category', """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งข้อมูลเทคนิคแบบย่อและหัวข้อข่าวล่าสุดของหุ้นหลายตัวในหมวดเดียวกันมา
+ประเมินหุ้นทุกตัวแล้วตอบเป็น JSON ตาม schema เท่านั้น
+ข้อความทุกช่องเป็นภาษาไทยที่เข้าใจง่าย กระชับ ไม่ใช้ markdown
+
+- stocks: หุ้นทุกตัวที่ได้รับ ตัวละ 1 รายการ
+  symbol = ชื่อหุ้นตามที่ได้รับ
+  score = ความน่าสนใจรวม -10 ถึง +10 ถ่วงน้ำหนัก Technical 60% + News 40%
+  signal = bullish / bearish / neutral จาก RSI, MACD, EMA และตำแหน่งใน Bollinger Bands
+  news = positive / neutral / negative จากหัวข้อข่าว (ไม่มีข่าว = neutral)
+  action = buy (สัญญาณดีทั้งสองด้าน) / wait (ไม่ชัดหรือขัดแย้งกัน) / sell (สัญญาณไม่ดี)
+  reason = เหตุผลหลัก 1 ประโยค
+- summary: ภาพรวมของหมวดและตัวที่เด่นที่สุด 2-3 ประโยค
+""", """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งข้อมูลเทคนิคแบบย่อและหัวข้อข่าวของหุ้นหลายตัวมา ตอบเป็น JSON เท่านั้น ข้อความเป็นภาษาไทยสั้นๆ
+ประเมินหุ้นทุกตัว: score -10 ถึง +10 (Technical 60% News 40%), reason 1 ประโยค, summary ภาพรวมหมวด 2-3 ประโยค
+รูปแบบ JSON: """ + ai_report.schema_outline(ai_report.BATCH_SCHEMA))
+
+COMPARE_ANALYSIS_PROMPT = PromptTemplate('compare', """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งข้อมูลเทคนิค Valuation และข่าวล่าสุดของหุ้น 2 ตัวมา
+เปรียบเทียบแล้วตอบเป็น JSON ตาม schema เท่านั้น
+ข้อความทุกช่องเป็นภาษาไทยที่เข้าใจง่าย กระชับ ตรงประเด็น ไม่ใช้ markdown
+ถ้าข้อมูลบางอย่างเป็น N/A ให้วิเคราะห์จากข้อมูลที่มี
+
+- stocks: หุ้นทั้ง 2 ตัว ตัวละ 1 รายการ (symbol = ชื่อหุ้นตามที่ได้รับ)
+  technical = ตีความ RSI, MACD, EMA Trend และตำแหน่งใน Bollinger Bands 1-2 ประโยค
+  valuation = Upside Potential, มุมมองนักวิเคราะห์ Buy/Hold/Sell และ Margin of Safety 1-2 ประโยค
+  news = ประเด็นข่าวหลักและ sentiment 1-2 ประโยค
+  technical_score / valuation_score / news_score / overall_score = -10 ถึง +10
+  weakness = จุดอ่อนหลักที่ควรระวัง 1 ประโยค
+- winners: ชื่อหุ้นที่ดีกว่าในแต่ละด้าน (technical / valuation / news)
+- timeframes: short (1-4 สัปดาห์, เน้นเทคนิค) / mid (1-3 เดือน, เน้นเทรนด์และ Valuation) /
+  long (6 เดือน - 1 ปี+, เน้น Fundamentals และแนวโน้มอุตสาหกรรม) ช่วงละ 1 รายการ
+  pick = หุ้นที่แนะนำ, reason = เหตุผล 1-2 ประโยค
+  entry / stop_loss / target = ราคาของหุ้นที่แนะนำ (null ถ้าควรรอปรับฐาน)
+  confidence = high / medium / low, risk = low / medium / high
+- pick: ถ้าเลือกได้ตัวเดียวควรซื้อตัวไหน (ต้องตอบชัดเจน)
+- reason: เหตุผลหลัก 2-3 ประโยค
+- strategy: กลยุทธ์ทางเลือก เช่น ถือทั้ง 2 ตัว, รอจังหวะ หรือ DCA 1-2 ประโยค
+""", """\
+คุณเป็นนักวิเคราะห์หุ้น ผู้ใช้จะส่งข้อมูลเทคนิค Valuation และข่าวของหุ้น 2 ตัวมา เปรียบเทียบแล้วตอบเป็น JSON เท่านั้น ข้อความเป็นภาษาไทยสั้นๆ
+คะแนนทุกช่อง -10 ถึง +10; timeframes = short/mid/long ช่วงละ 1 รายการ entry/stop_loss/target เป็นราคา
+pick = ตัวที่ควรซื้อถ้าเลือกได้ตัวเดียว (ต้องตอบชัดเจน)
+รูปแบบ JSON: """ + ai_report.schema_outline(ai_report.COMPARE_SCHEMA))
+
+GEMINI_MODELS = GeminiContextCache(explicit=GEMINI_CONTEXT_CACHE, ttl_seconds=GEMINI_CONTEXT_CACHE_TTL)
+
+
+# โมเดลที่ "คิด" ก่อนตอบ (gemini-2.5 และ alias -latest ที่ชี้ไป 2.5) thinking token กินเพดานเดียวกับคำตอบ
+# google-generativeai ตั้ง thinking budget ไม่ได้ จึงขยายเพดานให้พอทั้ง thinking และ JSON
+_THINKING_MODEL_MARKERS = ('gemini-2.5', '-latest')
+
+def _json_generation_config(schema, model_name=''):
+    """ให้ Gemini ตอบเป็น JSON ตาม schema และจำกัดความยาวคำตอบ"""
+    limit = AI_MAX_OUTPUT_TOKENS
+    if any(marker in model_name for marker in _THINKING_MODEL_MARKERS):
+        limit += AI_THINKING_TOKENS
+    return {
+        'response_mime_type': 'application/json',
+        'response_schema': schema,
+        'max_output_tokens': limit,
+    }
+
+
+def _generate_structured(template, schema, prompt, context_name):
+    """ขอผล JSON ตาม schema จาก Gemini (ไล่โมเดล) แล้ว Groq คืน (dict, ชื่อ provider) หรือ (None, None)"""
+    if GEMINI_API_KEY:
+        try:
+            import google.generativeai as genai
+            from google.api_core.exceptions import ResourceExhausted
+            _configure_gemini(genai)
+            
+            for model_name in ('models/gemini-2.5-flash', 'models/gemini-flash-latest', 'models/gemini-2.0-flash',
+                               'models/gemini-2.5-pro', 'models/gemini-pro-latest'):
+                try:
+                    model = GEMINI_MODELS.model(genai, model_name, template)
+                    logger.info(f"🚀 Calling Gemini {model_name} for {context_name}...")
+                    with UPSTREAMS.slot('gemini'), tracing.span('gemini', model=model_name), \
+                            metrics.LLM_LATENCY.time(provider='gemini', model=model_name):
+                        response = cassette.call(
+                            'gemini', {'model': model_name, 'system': template.key, 'prompt': prompt},
+                            lambda: model.generate_content(
+                                prompt, generation_config=_json_generation_config(schema, model_name)),
+                            encode=lambda r: r.text, decode=cassette.TextResponse
+                        )
+                    data = ai_report.parse_json_reply(response.text) if response else None
+                    if data is not None:
+                        return data, 'Gemini AI'
+                    logger.warning(f"⚠️ Gemini model {model_name} returned no usable JSON")
+                except UpstreamBusy as e:
+                    logger.warning(f"⚠️ {e} - skipping Gemini")
+                    break
+                except ResourceExhausted:
+                    metrics.UPSTREAM_ERRORS.inc(provider='gemini')
+                    metrics.UPSTREAM_RATE_LIMITED.inc(provider='gemini')
+                    logger.warning(f"⚠️ Gemini quota exceeded on {model_name}")
+                    break
+                except Exception as e:
+                    metrics.UPSTREAM_ERRORS.inc(provider='gemini')
+                    if _is_rate_limit_error(e):
+                        metrics.UPSTREAM_RATE_LIMITED.inc(provider='gemini')
+                        logger.warning(f"⚠️ Gemini rate limit exceeded on {model_name}: {e}")
+                        break
+                    logger.warning(f"⚠️ Gemini model {model_name} failed: {e}")
+        except ImportError as e:
+            logger.error(f"❌ Cannot import google.generativeai: {e}")
+    
+    if GROQ_API_KEY:
+        reply = analyze_with_groq(prompt, context_name, system=template.short_instructions, json_mode=True)
+        data = ai_report.parse_json_reply(reply)
+        if data is not None:
+            return data, 'Groq AI'
+    return None, None
+
+
+def _add_news_items(builder, news_list):
+    """ใส่ข่าวทีละข่าวตามงบ token: รายละเอียดเต็ม 300 ตัวอักษร -> 120 ตัวอักษร -> เฉพาะหัวข้อ"""
+    for i, news in enumerate(news_list, 1):
+        headline = news.get('headline_th', news.get('headline', ''))
+        summary = news.get('summary_th', news.get('summary', ''))
+        title = f"ข่าวที่ {i}: {headline}\n"
+        variants = [f"{title}รายละเอียด: {summary[:limit]}\n\n" for limit in (300, 120) if summary]
+        builder.add_optional(*variants, f"{title}\n")
+
+
+def _log_prompt_budget(template, builder):
+    metrics.LLM_PROMPT_TOKENS.inc(builder.tokens, template=template.name, part='data')
+    metrics.LLM_PROMPT_TOKENS.inc(template.tokens, template=template.name, part='instructions')
+    logger.info(f"🧮 {template.name} prompt: ~{builder.tokens} data tokens "
+                f"(budget {builder.budget}, {builder.dropped} items dropped) "
+                f"+ ~{template.tokens} instruction tokens")
+
+
+# --- Headline sentiment index ---
+def score_headlines(entries):
+    """ให้คะแนน sentiment + ใจความภาษาไทยของหลายหัวข้อข่าว (หลาย symbol ได้) ในคำขอ AI เดียว
+
+    entries = [(symbol, news)] คืน list ตามลำดับ entries ข่าวที่ AI ให้คะแนนไม่ได้ใช้คะแนนจาก lexicon_sentiment แทน
+    """
+    local = lexicon_sentiment.score_news([news for _, news in entries])
+    if not GEMINI_API_KEY and not GROQ_API_KEY:
+        return local
+    symbols = ', '.join(dict.fromkeys(symbol for symbol, _ in entries))
+    builder = PromptBuilder(PROMPT_TOKEN_BUDGET)
+    builder.add("หัวข้อข่าว:\n")
+    for i, (symbol, news) in enumerate(entries, 1):
+        title = f"{i}. [{symbol}] {news.get('headline', '')}"
+        summary = news.get('summary', '')
+        variants = [f"{title} — {summary[:200]}\n"] if summary else []
+        builder.add_optional(*variants, f"{title}\n")
+    _log_prompt_budget(HEADLINE_SENTIMENT_PROMPT, builder)
+    data, provider = _generate_structured(HEADLINE_SENTIMENT_PROMPT, ai_report.HEADLINE_SCHEMA,
+                                          builder.build(), f"headline sentiment for {symbols}")
+    scores = ai_report.normalize_headline_scores(data, len(entries)) if data else [None] * len(entries)
+    if None in scores:
+        logger.warning(f"⚠️ AI scored {len(scores) - scores.count(None)}/{len(scores)} headlines ({symbols}) "
+                       f"- using lexicon scores for the rest")
+    return [dict(score, scorer=provider) if score else dict(fallback, provisional=True)
+            for score, fallback in zip(scores, local)]
+
+
+# งบคำขอ AI ของการให้คะแนนเบื้องหลัง (รวมทุก worker process เพราะนับใน CACHE) แยกจาก quota ของผู้ใช้
+BACKGROUND_LIMITER = UsageLimiter(CACHE, {'sentiment': SENTIMENT_BACKGROUND_RATE},
+                                  {'sentiment': SENTIMENT_BACKGROUND_QUOTA})
+
+def _background_scoring_allowed():
+    denied = BACKGROUND_LIMITER.check('background', 'sentiment')
+    if denied:
+        metrics.COMMANDS_REJECTED.inc(command='sentiment', reason=denied[0])
+    return denied is None
+
+SENTIMENT = SentimentIndex(CACHE, score_headlines, ttl=SENTIMENT_TTL, provisional_ttl=SENTIMENT_FALLBACK_TTL,
+                           budget=_background_scoring_allowed, bulk_score=lexicon_sentiment.score_news)
+
+def _bulk(func):
+    """ห่อ func ให้ข่าวใหม่ที่ดึงระหว่างนั้นได้คะแนนจาก lexicon แทนการเข้าคิว AI (งานทั้งหมวด, /news)"""
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        token = BULK.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            BULK.reset(token)
+    return run
+
+
+def _submit_new_headlines(symbol, news_items):
+    """ส่งข่าวใหม่ล่าสุดจาก NEWS ให้ SENTIMENT ให้คะแนนเบื้องหลัง"""
+    if SENTIMENT_BACKGROUND_LIMIT > 0:
+        SENTIMENT.submit(symbol, news_items[:SENTIMENT_BACKGROUND_LIMIT])
+
+NEWS.on_new = _submit_new_headlines
+
+
+def _groq_complete(client, model_name, prompt, system=None, json_mode=False):
+    """เรียก Groq chat completion แล้วคืนข้อความคำตอบ (None ถ้าไม่มี choice)"""
+    messages = [{"role": "system", "content": system}] if system else []
+    options = {"response_format": {"type": "json_object"}} if json_mode else {}
+    chat_completion = client.chat.completions.create(
+        messages=messages + [
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ],
+        model=model_name,
+        temperature=0.7,
+        max_tokens=AI_MAX_OUTPUT_TOKENS,
+        **options,
+    )
+    if chat_completion.choices and len(chat_completion.choices) > 0:
+        return chat_completion.choices[0].message.content
+    return None
+
+def analyze_with_groq(prompt, context_name="analysis", system=None, json_mode=False):
+    """วิเคราะห์ด้วย Groq API (Fallback) system = คำสั่งคงที่ที่ส่งเป็น system message
+
+    json_mode=True บังคับให้ตอบเป็น JSON object (system ต้องบอกรูปแบบ JSON)
+    """
     try:
         if not GROQ_API_KEY or GROQ_API_KEY == "":
             logger.warning("⚠️ No Groq API key found")
@@ -236,14 +1384,12 @@ def analyze_with_groq(prompt, context_name="analysis"):
         logger.info(f"🔄 Switching to Groq API for {context_name}...")
         
         try:
-            from groq import Groq
+            client = get_groq_client()
         except ImportError as e:
             logger.error(f"❌ Cannot import groq: {e}")
             logger.info("💡 Install with: pip install groq")
             return None
         
-        client = Groq(api_key=GROQ_API_KEY)
-        
         # ลองใช้โมเดลตามลำดับ
         model_names = [
             "llama-3.3-70b-versatile",
@@ -256,24 +1402,29 @@ def analyze_with_groq(prompt, context_name="analysis"):
             try:
                 logger.info(f"✅ Trying Groq model: {model_name}")
                 
-                chat_completion = client.chat.completions.create(
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt,
-                        }
-                    ],
-                    model=model_name,
-                    temperature=0.7,
-                    max_tokens=8000,
-                )
+                with UPSTREAMS.slot('groq'), tracing.span('groq', model=model_name, context=context_name), \
+                        metrics.LLM_LATENCY.time(provider='groq', model=model_name):
+                    request = {'model': model_name, 'prompt': prompt}
+                    if system:
+                        request['system'] = system
+                    if json_mode:
+                        request['json'] = True
+                    result = cassette.call(
+                        'groq', request,
+                        lambda: _groq_complete(client, model_name, prompt, system, json_mode)
+                    )
                 
-                if chat_completion.choices and len(chat_completion.choices) > 0:
-                    result = chat_completion.choices[0].message.content
+                if result is not None:
                     logger.info(f"✅ Groq API responded with {len(result)} characters")
                     return result.strip()
                     
+            except UpstreamBusy as e:
+                logger.warning(f"⚠️ {e} - skipping Groq")
+                break
             except Exception as e:
+                metrics.UPSTREAM_ERRORS.inc(provider='groq')
+                if _is_rate_limit_error(e):
+                    metrics.UPSTREAM_RATE_LIMITED.inc(provider='groq')
                 logger.warning(f"⚠️ Groq model {model_name} failed: {e}")
                 continue
         
@@ -286,8 +1437,17 @@ def analyze_with_groq(prompt, context_name="analysis"):
         logger.error(traceback.format_exc())
         return None
 
+def _combined_fingerprint(news_list, symbol, technical_data):
+    key = fingerprint.analysis_fingerprint(symbol, news_list[:5], technical_data)
+    logger.info(f"🧷 Combined analysis fingerprint for {symbol}: {key}")
+    return key
+
+@cached('ai', AI_FINGERPRINT_MAX_AGE, version='json', key_func=_combined_fingerprint)
 def analyze_combined_with_gemini(news_list, symbol, technical_data):
-    """วิเคราะห์แบบรวม: ข่าว + เทคนิค ด้วย Gemini AI (มี Groq fallback)"""
+    """วิเคราะห์แบบรวม: ข่าว + เทคนิค ด้วย Gemini AI (มี Groq fallback)
+
+    คืน dict ตาม ai_report.COMBINED_SCHEMA (+ 'provider') ใช้ ai_report.render_combined_analysis แสดงผล
+    """
     try:
         # ตรวจสอบ API Keys
         has_gemini = GEMINI_API_KEY and GEMINI_API_KEY != ""
@@ -299,20 +1459,8 @@ def analyze_combined_with_gemini(news_list, symbol, technical_data):
         
         logger.info(f"🔍 Starting Combined AI analysis for {symbol}...")
         
-        # เตรียม prompt (ย้ายมาด้านบนเพื่อใช้ร่วมกัน)
-        news_text = f"ข่าวล่าสุดของหุ้น {symbol} (5 ข่าวล่าสุด):\n\n"
-        for i, news in enumerate(news_list[:5], 1):
-            headline = news.get('headline_th', news.get('headline', ''))
-            summary = news.get('summary_th', news.get('summary', ''))
-            
-            news_text += f"ข่าวที่ {i}: {headline}\n"
-            if summary:
-                short_summary = summary[:300] if len(summary) > 300 else summary
-                news_text += f"รายละเอียด: {short_summary}\n"
-            news_text += "\n"
-        
         # เตรียมข้อมูลเทคนิค
-        tech_text = f"\nข้อมูลเทคนิคของหุ้น {symbol}:\n\n"
+        tech_text = f"ข้อมูลเทคนิคของหุ้น {symbol}:\n\n"
         tech_text += f"ราคาปัจจุบัน: ${technical_data.get('current', 0):.2f}\n"
         tech_text += f"เปลี่ยนแปลง: {technical_data.get('change_pct', 0):+.2f}%\n\n"
         
@@ -362,196 +1510,25 @@ def analyze_combined_with_gemini(news_list, symbol, technical_data):
             tech_text += f"\nValuation:\n"
             tech_text += f"  Upside Potential: {technical_data['upside_pct']:+.1f}%\n"
         
-        # Prompt เต็ม (ใช้เดิม)
-        prompt = f"""{news_text}
-
-{tech_text}
-
-จากข้อมูลข่าวและข้อมูลเทคนิคข้างต้น ช่วยวิเคราะห์แบบรวมดังนี้:
-
-═══════════════════════════════════
-PART 1: วิเคราะห์จากข่าว 
-═══════════════════════════════════
-1. สรุปข่าวและจัดหมวดหมู่:
-   - 🟢 ข่าวดี (Positive): ระบุจำนวนและเปอร์เซ็นต์
-   - 🟡 ข่าวกลาง (Neutral): ระบุจำนวนและเปอร์เซ็นต์
-   - 🔴 ข่าวไม่ดี (Negative): ระบุจำนวนและเปอร์เซ็นต์
-
-2. สรุปประเด็นสำคัญ:
-   - ข่าวหลักที่มีผลกระทบต่อราคาหุ้น
-   - ปัจจัยบวกและปัจจัยลบที่โดดเด่น
-
-3. คะแนน News Sentiment: -10 ถึง +10
-   - -10 ถึง -7 = ข่าวร้ายมาก
-   - -6 ถึง -4 = ข่าวไม่ดี
-   - -3 ถึง -1 = ค่อนข้างลบ
-   - 0 = เป็นกลาง
-   - +1 ถึง +3 = ค่อนข้างบวก
-   - +4 ถึง +6 = ข่าวดี
-   - +7 ถึง +10 = ข่าวดีมาก
-
-═══════════════════════════════════
-PART 2: วิเคราะห์จากเทคนิค (Technical)
-═══════════════════════════════════
-1. สรุปสัญญาณเทคนิครวม:
-   - 🟢 Bullish (แนวโน้มขึ้น)
-   - 🔴 Bearish (แนวโน้มลง)
-   - 🟡 Neutral/Sideways (เทรนด์ไม่ชัด)
-
-2. วิเคราะห์ตัวชี้วัดสำคัญ:
-   - RSI: Oversold/Overbought/Neutral
-   - MACD: Bullish/Bearish Crossover
-   - EMA: Uptrend/Downtrend/Sideways
-   - Bollinger Bands: ตำแหน่งราคาในแบนด์
-
-3. แนวรับ/แนวต้านที่สำคัญ:
-   - แนวรับ (Support): ระบุราคาและระยะห่างจากราคาปัจจุบัน
-   - แนวต้าน (Resistance): ระบุราคาและระยะห่างจากราคาปัจจุบัน
-
-4. ตำแหน่งราคาปัจจุบัน:
-   - ราคาอยู่ใกล้แนวรับหรือแนวต้าน
-   - มีแนวโน้มไปทางไหน
-
-5. คะแนน Technical Score: -10 ถึง +10
-
-═══════════════════════════════════
-PART 3: Valuation & Analyst View
-═══════════════════════════════════
-1. ราคาเป้าหมายจากนักวิเคราะห์ (ถ้ามี):
-   - Upside/Downside Potential: ระบุเป็น %
-   - ความเห็นนักวิเคราะห์: Buy/Hold/Sell (เป็น %)
-
-2. Margin of Safety:
-   - ราคาปัจจุบันถูกหรือแพงเมื่อเทียบกับเป้าหมาย
-   - ระดับความปลอดภัย: สูง/กลาง/ต่ำ/ไม่มี
-═══════════════════════════════════
-PART 4: สรุปรวมและคำแนะนำ
-═══════════════════════════════════
-1. เปรียบเทียบสัญญาณ:
-   ✓ ข่าว vs เทคนิค สอดคล้องกันหรือไม่?
-   ✓ นักวิเคราะห์ vs สัญญาณเทคนิค สอดคล้องหรือไม่?
-   
-   ⚠️ ถ้าขัดแย้งกัน:
-   - ข่าวดีแต่เทคนิคขาลง → เตือนชัดเจน
-   - ข่าวไม่ดีแต่เทคนิคขาขึ้น → เตือนชัดเจน
-   - นักวิเคราะห์แนะนำซื้อแต่เทคนิคขาลง → เตือนชัดเจน
-
-2. ระดับความเสี่ยง:
-   - 🟢 ต่ำ: ข่าวดี + เทคนิคดี + Valuation ดี
-   - 🟡 กลาง: มีสัญญาณปนกัน
-   - 🔴 สูง: ข่าวไม่ดี + เทคนิคไม่ดี หรือขัดแย้งกันมาก
-
-3. คำแนะนำการเทรด:
-   
-   📊 Timeframe: ระบุว่าเหมาะสำหรับ
-   - Short-term (1-7 วัน)
-   - Mid-term (1-4 สัปดาห์)
-   - Long-term (1-6 เดือน+)
-   
-   🎯 Action:
-   - 🟢 ซื้อ (BUY): ถ้าทุกสัญญาณดี
-   - 🟡 รอดู (WAIT): ถ้าสัญญาณไม่ชัด หรือขัดแย้งกัน
-   - 🔴 ขาย/หลีกเลี่ยง (SELL/AVOID): ถ้าสัญญาณไม่ดี
-   
-   💰 จุดเข้าที่เหมาะสม:
-   - ราคาที่แนะนำให้เข้า (ระบุเหตุผล)
-   - หรือรอปรับฐานที่ระดับไหน
-   
-   🛡️ Stop Loss:
-   - ระบุราคาที่ควรตั้ง SL (ต่ำกว่าแนวรับ 2-5%)
-   - ระบุว่าห่างจากราคาเข้ากี่ %
-   
-   🎯 Take Profit:
-   - เป้าหมายระยะสั้น (TP1): ราคา + %
-   - เป้าหมายระยะกลาง (TP2): ราคา + %
-   - เป้าหมายระยะยาว (ถ้ามี): ราคา + %
-   
-4. คะแนนความเชื่อมั่นรวม (Overall Score): -10 ถึง +10
-   - รวมน้ำหนัก: News (30%) + Technical (40%) + Valuation (20%) + Analyst (10%)
-   - -10 ถึง -5 = ไม่ควรลงทุน
-   - -4 ถึง -1 = ระมัดระวังสูง
-   - 0 ถึง +3 = ระมัดระวังปานกลาง/รอดู
-   - +4 ถึง +6 = น่าสนใจ
-   - +7 ถึง +10 = แนะนำให้พิจารณา
-
-5. สรุป:
-   - สรุปแก่นของการวิเคราะห์ทั้งหมด
-
-**รูปแบบตอบ:**
-- ใช้ภาษาไทยที่เข้าใจง่าย
-- กระชับ ตรงประเด็น
-- เน้นข้อมูลที่นักลงทุนต้องการรู้จริงๆ
-- ห้ามใช้ markdown ** หรือ __ เด็ดขาด
-- ใช้ separator ───── หรือ ═════ แบ่งส่วน
-- ใช้เพียง emoji และข้อความธรรมดา
-
-เริ่มวิเคราะห์:
-
-"""
-        
-        # ลอง Gemini ก่อน
-        if has_gemini:
-            try:
-                import google.generativeai as genai
-                from google.api_core.exceptions import ResourceExhausted  # เพิ่มบรรทัดนี้
-                genai.configure(api_key=GEMINI_API_KEY)
-                
-                model_names = [
-                    'models/gemini-2.5-flash',
-                    'models/gemini-flash-latest',
-                    'models/gemini-2.0-flash',
-                    'models/gemini-2.5-pro',
-                    'models/gemini-pro-latest',
-                ]
-                
-                for model_name in model_names:
-                    try:
-                        model = genai.GenerativeModel(model_name)
-                        logger.info(f"✅ Using Gemini model: {model_name}")
-                        
-                        logger.info("🚀 Calling Gemini API for combined analysis...")
-                        response = model.generate_content(prompt)
-                        
-                        if response and hasattr(response, 'text') and response.text:
-                            logger.info(f"📊 Combined analysis result length: {len(response.text)} characters")
-                            return response.text.strip() + "\n═══════\n🤖 วิเคราะห์โดย: Gemini AI"
-                            
-                    except ResourceExhausted as e:  # เพิ่ม except นี้
-                        logger.warning(f"⚠️ Gemini quota exceeded on {model_name}")
-                        logger.info("🔄 Switching to Groq API due to rate limit...")
-                        break  # ออกจาก loop ทันที
-                            
-                    except Exception as e:
-                        error_msg = str(e).lower()
-                        
-                        # ตรวจสอบ Rate Limit Error
-                        if "429" in error_msg or "quota" in error_msg or "rate limit" in error_msg or "resource_exhausted" in error_msg:
-                            logger.warning(f"⚠️ Gemini rate limit exceeded: {e}")
-                            logger.info("🔄 Switching to Groq API...")
-                            break  # ออกจาก loop และไปใช้ Groq
-                        else:
-                            logger.warning(f"⚠️ Gemini model {model_name} failed: {e}")
-                            continue
-                
-            except ImportError as e:
-                logger.error(f"❌ Cannot import google.generativeai: {e}")
-            except Exception as e:
-                error_msg = str(e).lower()
-                if "429" in error_msg or "quota" in error_msg or "rate limit" in error_msg:
-                    logger.warning(f"⚠️ Gemini rate limit exceeded: {e}")
-                    logger.info("🔄 Switching to Groq API...")
-                else:
-                    logger.error(f"❌ Gemini error: {e}")
-        
-        # ถ้า Gemini ล้มเหลว ให้ใช้ Groq
-        if has_groq:
-            logger.info("🔄 Falling back to Groq API...")
-            result = analyze_with_groq(prompt, f"combined analysis for {symbol}")
-            if result:
-                return result + "\n═══════\n🤖 วิเคราะห์โดย: Groq AI"
-        
-        logger.error("❌ All AI APIs failed")
-        return None
+        # ส่วนข้อมูลของ prompt (คำสั่งวิเคราะห์อยู่ใน COMBINED_ANALYSIS_PROMPT)
+        # ข้อมูลเทคนิคต้องมีเสมอ จึงใส่ก่อน แล้วข่าวใช้งบที่เหลือ
+        builder = PromptBuilder(PROMPT_TOKEN_BUDGET)
+        builder.add(tech_text)
+        builder.add(f"\nข่าวล่าสุดของหุ้น {symbol} (5 ข่าวล่าสุด):\n\n")
+        news_count = min(len(news_list), 5)
+        _add_news_items(builder, news_list[:news_count])
+        prompt = builder.build() + "เริ่มวิเคราะห์:"
+        _log_prompt_budget(COMBINED_ANALYSIS_PROMPT, builder)
+        
+        # Gemini (ไล่โมเดล) แล้ว Groq ผ่านเส้นทางเดียวกับคำขอ JSON อื่นๆ
+        analysis, provider = _generate_structured(COMBINED_ANALYSIS_PROMPT, ai_report.COMBINED_SCHEMA, prompt,
+                                                  f"combined analysis for {symbol}")
+        if analysis is None:
+            logger.error("❌ All AI APIs failed")
+            return None
+        analysis = ai_report.normalize_combined_analysis(analysis, news_count)
+        analysis['provider'] = provider
+        return analysis
         
     except Exception as e:
         logger.error(f"❌ Combined analysis error: {e}")
@@ -562,8 +1539,12 @@ PART 4: สรุปรวมและคำแนะนำ
 
 
 
+@cached('ai', CACHE_TTL_SECONDS, version='json')
 def analyze_comparison_with_gemini(stock1_data, stock2_data, symbol1, symbol2):
-    """วิเคราะห์เปรียบเทียบ 2 หุ้นด้วย Gemini AI (มี Groq fallback)"""
+    """วิเคราะห์เปรียบเทียบ 2 หุ้นด้วย Gemini AI (มี Groq fallback)
+
+    คืน dict ตาม ai_report.COMPARE_SCHEMA (+ 'provider') ใช้ ai_report.render_comparison แสดงผล
+    """
     try:
         # ตรวจสอบ API Keys
         has_gemini = GEMINI_API_KEY and GEMINI_API_KEY != ""
@@ -653,251 +1634,30 @@ def analyze_comparison_with_gemini(stock1_data, stock2_data, symbol1, symbol2):
 {s2.get('news_summary', 'ไม่มีข่าว')}
 """
         
-        prompt = f"""{stock1_info}
-
-{stock2_info}
-
-จากข้อมูลทั้ง 2 หุ้น ให้วิเคราะห์เปรียบเทียบดังนี้:
-
-═══════════════════════════════════
-PART 1: เปรียบเทียบตัวชี้วัดเทคนิค
-═══════════════════════════════════
-📊 Technical Score Comparison:
-
-🔴 {symbol1}:
-- RSI: [วิเคราะห์ว่า Oversold/Neutral/Overbought]
-- MACD: [วิเคราะห์ว่า Bullish/Bearish]
-- EMA Trend: [วิเคราะห์ Uptrend/Downtrend/Sideways]
-- BB Position: [วิเคราะห์ตำแหน่งในแบนด์]
-- คะแนนเทคนิครวม: X/10
-
-🔵 {symbol2}:
-- RSI: [วิเคราะห์ว่า Oversold/Neutral/Overbought]
-- MACD: [วิเคราะห์ว่า Bullish/Bearish]
-- EMA Trend: [วิเคราะห์ Uptrend/Downtrend/Sideways]
-- BB Position: [วิเคราะห์ตำแหน่งในแบนด์]
-- คะแนนเทคนิครวม: X/10
-
-🏆 Winner (Technical): [ระบุตัวที่ดีกว่าและเหตุผล]
-
-─────────────────────────────────
-
-═══════════════════════════════════
-PART 2: เปรียบเทียบ Valuation
-═══════════════════════════════════
-💎 Value & Growth Potential:
-
-🔴 {symbol1}:
-- Upside Potential: [ระบุ %]
-- นักวิเคราะห์มองว่า: [Buy/Hold/Sell]
-- Margin of Safety: [สูง/กลาง/ต่ำ/ไม่มี]
-
-🔵 {symbol2}:
-- Upside Potential: [ระบุ %]
-- นักวิเคราะห์มองว่า: [Buy/Hold/Sell]
-- Margin of Safety: [สูง/กลาง/ต่ำ/ไม่มี]
-
-🏆 Winner (Valuation): [ระบุตัวที่ดีกว่าและเหตุผล]
-
-─────────────────────────────────
-
-═══════════════════════════════════
-PART 3: เปรียบเทียบข่าวและ Sentiment
-═══════════════════════════════════
-📰 News Sentiment:
-
-🔴 {symbol1}:
-- สัดส่วนข่าว: 🟢 X% | 🟡 X% | 🔴 X%
-- News Sentiment Score: X/10
-- ประเด็นสำคัญ: [สรุปข่าวหลัก 1-2 ประโยค]
-
-🔵 {symbol2}:
-- สัดส่วนข่าว: 🟢 X% | 🟡 X% | 🔴 X%
-- News Sentiment Score: X/10
-- ประเด็นสำคัญ: [สรุปข่าวหลัก 1-2 ประโยค]
-
-🏆 Winner (News): [ระบุตัวที่ดีกว่าและเหตุผล]
-
-─────────────────────────────────
-
-═══════════════════════════════════
-PART 4: การวิเคราะห์แบบแยกตาม Timeframe
-═══════════════════════════════════
+        # ส่วนข้อมูลของ prompt (คำสั่งวิเคราะห์อยู่ใน COMPARE_ANALYSIS_PROMPT)
+        builder = PromptBuilder(PROMPT_TOKEN_BUDGET)
+        builder.add(stock1_info)
+        builder.add(stock2_info)
+        prompt = builder.build() + "\nเริ่มวิเคราะห์:"
+        _log_prompt_budget(COMPARE_ANALYSIS_PROMPT, builder)
+        
+        analysis, provider = _generate_structured(COMPARE_ANALYSIS_PROMPT, ai_report.COMPARE_SCHEMA, prompt,
+                                                  f"comparison {symbol1} vs {symbol2}")
+        if analysis is None:
+            logger.error("❌ All AI APIs failed for comparison")
+            return None
+        analysis = ai_report.normalize_comparison(analysis, [symbol1, symbol2])
+        analysis['provider'] = provider
+        return analysis
+        
+    except Exception as e:
+        logger.error(f"❌ Comparison Gemini analysis error: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
+ 
 
-📅 ระยะสั้น (1-4 สัปดาห์):
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🎯 แนะนำ: [SYMBOL]
-เหตุผล:
-- [เหตุผลที่ 1 - เน้นเทคนิค]
-- [เหตุผลที่ 2]
-- [เหตุผลที่ 3]
-
-💰 จุดเข้าที่แนะนำ: $XXX
-🛡️ Stop Loss: $XXX (X% จากจุดเข้า)
-🎯 Target: $XXX (X% Profit)
-
-ระดับความมั่นใจ: [สูง/กลาง/ต่ำ]
-ความเสี่ยง: 🟢/🟡/🔴
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-📅 ระยะกลาง (1-3 เดือน):
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🎯 แนะนำ: [SYMBOL]
-เหตุผล:
-- [เหตุผลที่ 1 - เน้นเทรนด์และ Valuation]
-- [เหตุผลที่ 2]
-- [เหตุผลที่ 3]
-
-💰 จุดเข้าที่แนะนำ: $XXX
-🛡️ Stop Loss: $XXX (X% จากจุดเข้า)
-🎯 Target: $XXX (X% Profit)
-
-ระดับความมั่นใจ: [สูง/กลาง/ต่ำ]
-ความเสี่ยง: 🟢/🟡/🔴
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-📅 ระยะยาว (6 เดือน - 1 ปี+):
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🎯 แนะนำ: [SYMBOL]
-เหตุผล:
-- [เหตุผลที่ 1 - เน้น Fundamentals และแนวโน้มอุตสาหกรรม]
-- [เหตุผลที่ 2]
-- [เหตุผลที่ 3]
-
-💰 จุดเข้าที่แนะนำ: $XXX หรือรอปรับฐาน
-🛡️ Stop Loss: $XXX (X% จากจุดเข้า)
-🎯 Target: $XXX (X% Profit)
-
-ระดับความมั่นใจ: [สูง/กลาง/ต่ำ]
-ความเสี่ยง: 🟢/🟡/🔴
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-═══════════════════════════════════
-PART 5: คะแนนรวมและคำแนะนำสุดท้าย
-═══════════════════════════════════
-
-📊 คะแนนรวมทุกด้าน:
-
-🔴 {symbol1}: X/10
-   • Technical: X/10
-   • Valuation: X/10
-   • News Sentiment: X/10
-
-🔵 {symbol2}: X/10
-   • Technical: X/10
-   • Valuation: X/10
-   • News Sentiment: X/10
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-🏆 **คำตอบขั้นสุดท้าย:**
-
-ถ้าเลือกได้อันเดียว ควรซื้อ: **[SYMBOL]**
-
-เหตุผล: [สรุปเหตุผลหลักๆ 2-3 ประโยค]
-
-⚠️ **ข้อควรระวัง:**
-- {symbol1}: [จุดอ่อนหลัก]
-- {symbol2}: [จุดอ่อนหลัก]
-
-💡 **กลยุทธ์ทางเลือก:**
-[เสนอกลยุทธ์เช่น ถือทั้ง 2 ตัว, รอจังหวะ, หรือ DCA]
-
-═══════════════════════════════════
-
-**รูปแบบตอบ:**
-- ใช้ภาษาไทยที่เข้าใจง่าย
-- กระชับ ตรงประเด็น
-- ห้ามใช้ markdown ** หรือ __ เด็ดขาด
-- ใช้ separator ───── หรือ ═════ แบ่งส่วน
-- ใช้เพียง emoji และข้อความธรรมดา
-- ต้องมีคำตอบที่ชัดเจนว่าควรซื้อตัวไหน
-- ถ้าข้อมูลบางอย่างเป็น N/A ให้วิเคราะห์จากข้อมูลที่มี
-
-เริ่มวิเคราะห์:
-"""
-        
-        # ลอง Gemini ก่อน
-        if has_gemini:
-            try:
-                import google.generativeai as genai
-                from google.api_core.exceptions import ResourceExhausted
-                genai.configure(api_key=GEMINI_API_KEY)
-                
-                model_names = [
-                    'models/gemini-2.5-flash',
-                    'models/gemini-flash-latest',
-                    'models/gemini-2.0-flash',
-                    'models/gemini-2.5-pro',
-                    'models/gemini-pro-latest',
-                ]
-                
-                for model_name in model_names:
-                    try:
-                        model = genai.GenerativeModel(model_name)
-                        logger.info(f"✅ Using Gemini model: {model_name}")
-                        
-                        logger.info("🚀 Calling Gemini API for comparison analysis...")
-                        response = model.generate_content(prompt)
-                        
-                        logger.info("✅ Gemini API responded")
-                        
-                        if response and hasattr(response, 'text') and response.text:
-                            logger.info(f"📊 Comparison analysis result length: {len(response.text)} characters")
-                            return response.text.strip() + "\n═══════\n🤖 วิเคราะห์โดย: Gemini AI"
-                        else:
-                            logger.warning("⚠️ Gemini returned empty response")
-                            continue
-                            
-                    except ResourceExhausted as e:  # เพิ่ม except นี้
-                        logger.warning(f"⚠️ Gemini quota exceeded on {model_name}")
-                        logger.info("🔄 Switching to Groq API due to rate limit...")
-                        break
-                            
-                    except Exception as e:
-                        error_msg = str(e).lower()
-                        
-                        # ตรวจสอบ Rate Limit Error
-                        if "429" in error_msg or "quota" in error_msg or "rate limit" in error_msg or "resource_exhausted" in error_msg:
-                            logger.warning(f"⚠️ Gemini rate limit exceeded on {model_name}: {e}")
-                            logger.info("🔄 Switching to Groq API...")
-                            break  # ออกจาก loop และไปใช้ Groq
-                        else:
-                            logger.warning(f"⚠️ Gemini model {model_name} failed: {e}")
-                            continue
-                
-            except ImportError as e:
-                logger.error(f"❌ Cannot import google.generativeai: {e}")
-            except Exception as e:
-                error_msg = str(e).lower()
-                if "429" in error_msg or "quota" in error_msg or "rate limit" in error_msg or "resource_exhausted" in error_msg:
-                    logger.warning(f"⚠️ Gemini rate limit exceeded: {e}")
-                    logger.info("🔄 Switching to Groq API...")
-                else:
-                    logger.error(f"❌ Gemini comparison error: {e}")
-        
-        # ถ้า Gemini ล้มเหลว ให้ใช้ Groq
-        if has_groq:
-            logger.info("🔄 Falling back to Groq API for comparison...")
-            result = analyze_with_groq(prompt, f"comparison {symbol1} vs {symbol2}")
-            if result:
-                return result + "\n═══════\n🤖 วิเคราะห์โดย: Groq AI"
-
-        
-        logger.error("❌ All AI APIs failed for comparison")
-        return None
-        
-    except Exception as e:
-        logger.error(f"❌ Comparison Gemini analysis error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return None
- 
-
-async def get_stock_data_for_comparison(symbol):
+def get_stock_data_for_comparison(symbol):
     """ดึงข้อมูลหุ้นสำหรับการเปรียบเทียบ"""
     try:
         # ดึงข้อมูลเทคนิค
@@ -980,135 +1740,167 @@ async def get_stock_data_for_comparison(symbol):
         return None
 
 
-def analyze_news_with_gemini(news_list, symbol):
-    """วิเคราะห์ข่าวด้วย Gemini AI (มี Groq fallback)"""
+def _news_fingerprint(news_list, symbol, scores=None):
+    # รวมคะแนนรายข่าวด้วย: บทสรุปที่เขียนจากคะแนน lexicon ชั่วคราวต้องถูกเขียนใหม่เมื่อ AI ให้คะแนนแล้ว
+    entries = [(scores or {}).get(news.get('id')) or {} for news in news_list[:5]]
+    graded = [[entry.get('score'), entry.get('scorer'), bool(entry.get('provisional'))] for entry in entries]
+    key = make_key(fingerprint.analysis_fingerprint(symbol, news_list[:5]), graded)[:16]
+    logger.info(f"🧷 News analysis fingerprint for {symbol}: {key}")
+    return key
+
+@cached('ai', AI_FINGERPRINT_MAX_AGE, version='summary', key_func=_news_fingerprint)
+def analyze_news_with_gemini(news_list, symbol, scores=None):
+    """เขียนบทสรุปข่าวด้วย Gemini AI (มี Groq fallback)
+
+    sentiment รายข่าวมาจาก SENTIMENT (scores = {news id: คะแนน}) AI จึงเขียนเฉพาะ summary
+    คืน {'summary', 'provider'} หรือ None
+    """
     try:
-        # ตรวจสอบ API Keys
-        has_gemini = GEMINI_API_KEY and GEMINI_API_KEY != ""
-        has_groq = GROQ_API_KEY and GROQ_API_KEY != ""
-        
-        if not has_gemini and not has_groq:
-            logger.warning("⚠️ No AI API key found (Gemini or Groq) - skipping news analysis")
+        if not GEMINI_API_KEY and not GROQ_API_KEY:
+            logger.warning("⚠️ No AI API key found (Gemini or Groq) - skipping news summary")
             return None
         
-        logger.info(f"🔍 Starting AI news analysis for {symbol}...")
+        logger.info(f"🔍 Starting AI news summary for {symbol}...")
         
-        # เตรียมข้อมูลข่าว
-        news_text = f"ข่าวล่าสุดของหุ้น {symbol}:\n\n"
+        # ข่าวพร้อม sentiment/ใจความที่ประเมินไว้แล้ว (คำสั่งอยู่ใน NEWS_ANALYSIS_PROMPT)
+        scores = scores or {}
+        builder = PromptBuilder(PROMPT_TOKEN_BUDGET)
+        builder.add(f"ข่าวล่าสุดของหุ้น {symbol}:\n\n")
         for i, news in enumerate(news_list[:5], 1):
             headline = news.get('headline_th', news.get('headline', ''))
-            summary = news.get('summary_th', news.get('summary', ''))
-            
-            news_text += f"ข่าวที่ {i}: {headline}\n"
-            if summary:
-                short_summary = summary[:300] if len(summary) > 300 else summary
-                news_text += f"รายละเอียด: {short_summary}\n"
-            news_text += "\n"
-        
-        logger.info(f"📝 Prepared {len(news_list)} news items for analysis")
-        
-        prompt = f"""{news_text}
-จากข่าวเหล่านี้ ช่วยวิเคราะห์และสรุปดังนี้:
-
-1. **สรุปภาพรวม**: สรุปประเด็นสำคัญของข่าวทั้งหมดในรอบสัปดาห์นี้ (2-3 ประโยค)
-
-2. **ผลกระทบต่อหุ้น**: วิเคราะห์ว่าข่าวเหล่านี้มีผลกระทบต่อราคาหุ้นอย่างไร
-   - ใช้ 🟢 สำหรับข่าวดี (Positive)
-   - ใช้ 🔴 สำหรับข่าวไม่ดี (Negative)  
-   - ใช้ 🟡 สำหรับข่าวกลางๆ (Neutral)
-
-3. **คะแนนความเชื่อมั่น**: ให้คะแนน sentiment จาก -10 ถึง +10
-   - -10 ถึง -5 = ข่าวร้ายมาก
-   - -4 ถึง -1 = ข่าวไม่ดี
-   - 0 = กลางๆ
-   - +1 ถึง +4 = ข่าวดี
-   - +5 ถึง +10 = ข่าวดีมาก
-
-ตอบเป็นภาษาไทยที่เข้าใจง่าย กระชับ ตรงประเด็น"""
-        
-        # ลอง Gemini ก่อน
-        if has_gemini:
-            try:
-                import google.generativeai as genai
-                from google.api_core.exceptions import ResourceExhausted
-                genai.configure(api_key=GEMINI_API_KEY)
-                
-                # ใช้โมเดลที่ใช้งานได้จริง
-                model_names = [
-                    'models/gemini-2.5-flash',          # แนะนำ - เร็วและดี
-                    'models/gemini-flash-latest',       # ทางเลือกที่ 2
-                    'models/gemini-2.0-flash',          # ทางเลือกที่ 3
-                    'models/gemini-2.5-pro',            # ดีที่สุดแต่ช้ากว่า
-                    'models/gemini-pro-latest',         # fallback
-                ]
-                
-                for model_name in model_names:
-                    try:
-                        model = genai.GenerativeModel(model_name)
-                        logger.info(f"✅ Using Gemini model: {model_name}")
-                        
-                        logger.info("🚀 Calling Gemini API for news analysis...")
-                        
-                        # Generate content
-                        response = model.generate_content(prompt)
-                        
-                        logger.info("✅ Gemini API responded")
-                        
-                        if response and hasattr(response, 'text') and response.text:
-                            logger.info(f"📊 Analysis result length: {len(response.text)} characters")
-                            return response.text.strip() + "\n═══════\n🤖 วิเคราะห์โดย: Gemini AI"
-                        else:
-                            logger.warning("⚠️ Gemini returned empty response")
-                            continue
-                            
-                    except ResourceExhausted as e:  # เพิ่ม except นี้
-                        logger.warning(f"⚠️ Gemini quota exceeded on {model_name}")
-                        logger.info("🔄 Switching to Groq API due to rate limit...")
-                        break
-                            
-                    except Exception as e:
-                        error_msg = str(e).lower()
-                        
-                        # ตรวจสอบ Rate Limit Error
-                        if "429" in error_msg or "quota" in error_msg or "rate limit" in error_msg or "resource_exhausted" in error_msg:
-                            logger.warning(f"⚠️ Gemini rate limit exceeded on {model_name}: {e}")
-                            logger.info("🔄 Switching to Groq API...")
-                            break  # ออกจาก loop และไปใช้ Groq
-                        else:
-                            logger.warning(f"⚠️ Cannot use {model_name}: {e}")
-                            continue
-                
-            except ImportError as e:
-                logger.error(f"❌ Cannot import google.generativeai: {e}")
-            except Exception as e:
-                error_msg = str(e).lower()
-                if "429" in error_msg or "quota" in error_msg or "rate limit" in error_msg or "resource_exhausted" in error_msg:
-                    logger.warning(f"⚠️ Gemini rate limit exceeded: {e}")
-                    logger.info("🔄 Switching to Groq API...")
-                else:
-                    logger.error(f"❌ Gemini news analysis error: {e}")
+            entry = scores.get(news.get('id'))
+            if entry:
+                builder.add(f"ข่าวที่ {i} [{entry['sentiment']} {entry['score']:+d}]: {headline}\n"
+                            f"ใจความ: {entry.get('gist', '')}\n\n")
+            else:
+                summary = news.get('summary_th', news.get('summary', ''))
+                variants = [f"ข่าวที่ {i}: {headline}\nรายละเอียด: {summary[:300]}\n\n"] if summary else []
+                builder.add_optional(*variants, f"ข่าวที่ {i}: {headline}\n\n")
         
-        # ถ้า Gemini ล้มเหลว ให้ใช้ Groq
-        if has_groq:
-            logger.info("🔄 Falling back to Groq API for news analysis...")
-            result = analyze_with_groq(prompt, f"news analysis for {symbol}")
-            if result:
-                return result + "\n═══════\n🤖 วิเคราะห์โดย: Groq AI"
+        prompt = builder.build()
+        _log_prompt_budget(NEWS_ANALYSIS_PROMPT, builder)
         
-        logger.error("❌ All AI APIs failed for news analysis")
-        return None
+        data, provider = _generate_structured(NEWS_ANALYSIS_PROMPT, ai_report.NEWS_SCHEMA, prompt,
+                                              f"news summary for {symbol}")
+        if data is None:
+            logger.error("❌ All AI APIs failed for news summary")
+            return None
+        return {'summary': str(data.get('summary') or '').strip(), 'provider': provider}
         
     except Exception as e:
-        logger.error(f"❌ News analysis error: {e}")
+        logger.error(f"❌ News summary error: {e}")
         import traceback
         logger.error(traceback.format_exc())
         return None 
         
+def _technical_digest(symbol, quote, technicals):
+    """สรุปราคาและตัวชี้วัดของหุ้นหนึ่งตัวเป็นบรรทัดเดียว (ใช้ใน prompt ทั้งหมวด)"""
+    price = float(quote['close'])
+    previous = float(quote.get('previous_close') or price)
+    change = (price - previous) / previous * 100 if previous else 0.0
+    parts = [f"{symbol} ${price:.2f} ({change:+.2f}%)"]
+    if technicals.get('rsi') is not None:
+        parts.append(f"RSI {technicals['rsi']:.0f}")
+    if technicals.get('macd') is not None and technicals.get('macd_signal') is not None:
+        parts.append("MACD > signal" if technicals['macd'] > technicals['macd_signal'] else "MACD < signal")
+    ema_20, ema_50, ema_200 = technicals.get('ema_20'), technicals.get('ema_50'), technicals.get('ema_200')
+    if ema_20 and ema_50:
+        parts.append(f"ราคา/EMA20 {price / ema_20 - 1:+.1%}, EMA20/EMA50 {ema_20 / ema_50 - 1:+.1%}")
+    if ema_200:
+        parts.append(f"ราคา/EMA200 {price / ema_200 - 1:+.1%}")
+    bb_lower, bb_upper = technicals.get('bb_lower'), technicals.get('bb_upper')
+    if bb_lower and bb_upper and bb_upper != bb_lower:
+        parts.append(f"BB {(price - bb_lower) / (bb_upper - bb_lower) * 100:.0f}%")
+    return " | ".join(parts) + "\n"
+
+def collect_category_data(symbols):
+    """ราคา ตัวชี้วัด และข่าวของทุก symbol ในหมวด (ดึงพร้อมกัน) คืน (quotes, technicals, news)"""
+    backfill_history(symbols)  # yfinance ครั้งเดียวทั้งหมวด แล้วคำนวณตัวชี้วัดในเครื่อง
+    quotes = get_quotes_batch(symbols)
+    available = [symbol for symbol in symbols if symbol in quotes]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        technicals = dict(zip(available, pool.map(in_context(get_technicals), available)))
+        news = dict(zip(available, pool.map(in_context(get_company_news), available)))
+    return quotes, {s: t or {} for s, t in technicals.items()}, {s: n or [] for s, n in news.items()}
+
+def build_category_prompt(quotes, technicals, news):
+    """prompt ข้อมูลทั้งหมวด: บรรทัดเทคนิคของทุกตัวก่อน แล้วหัวข้อข่าวตามงบที่เหลือ"""
+    builder = PromptBuilder(CATEGORY_PROMPT_TOKEN_BUDGET)
+    builder.add("ข้อมูลเทคนิค:\n")
+    for symbol, quote in quotes.items():
+        builder.add(_technical_digest(symbol, quote, technicals.get(symbol, {})))
+    builder.add("\nหัวข้อข่าวล่าสุด:\n")
+    for symbol in quotes:
+        headlines = [item.get('headline', '')[:MAX_HEADLINE_LENGTH] for item in news.get(symbol, [])[:2]]
+        headlines = [headline for headline in headlines if headline]
+        if headlines:
+            builder.add_optional(f"{symbol}: {' / '.join(headlines)}\n", f"{symbol}: {headlines[0]}\n")
+    return builder
+
+def _category_fingerprint(category_name, quotes, technicals, news):
+    """key ของผลทั้งหมวด: ชุดข่าวที่อยู่ใน prompt + สภาวะทางเทคนิคแบบหยาบของทุกตัว (ไม่ใช่ราคาสด)"""
+    symbols = {
+        symbol: fingerprint.analysis_fingerprint(
+            symbol, news.get(symbol, [])[:2], {'current': float(quote['close']), **technicals.get(symbol, {})}
+        )
+        for symbol, quote in quotes.items()
+    }
+    key = make_key(category_name, symbols)
+    logger.info(f"🧷 Category analysis fingerprint for {category_name}: {key[:16]}")
+    return key
+
+@cached('ai', AI_FINGERPRINT_MAX_AGE, version='json', key_func=_category_fingerprint)
+def analyze_category_with_gemini(category_name, quotes, technicals, news):
+    """จัดอันดับหุ้นทั้งหมวดด้วย AI ในคำขอเดียว (มี Groq fallback)
+
+    cache ตาม fingerprint ของข่าวและสภาวะทางเทคนิค ราคาที่ขยับเล็กน้อยจึงยังใช้ผลเดิมได้
+    คืน dict ตาม ai_report.BATCH_SCHEMA (+ 'provider') ใช้ ai_report.render_batch_analysis แสดงผล
+    """
+    try:
+        if not GEMINI_API_KEY and not GROQ_API_KEY:
+            logger.warning("⚠️ No AI API key found (Gemini or Groq) - skipping category analysis")
+            return None
+        
+        symbols = list(quotes)
+        builder = build_category_prompt(quotes, technicals, news)
+        _log_prompt_budget(CATEGORY_ANALYSIS_PROMPT, builder)
+        prompt = builder.build()
+        logger.info(f"🔍 Starting batch AI analysis for {category_name} ({len(symbols)} symbols)...")
+        data, provider = _generate_structured(
+            CATEGORY_ANALYSIS_PROMPT, ai_report.BATCH_SCHEMA, prompt, f"category analysis {category_name}"
+        )
+        if data is None:
+            logger.error("❌ All AI APIs failed for category analysis")
+            return None
+        analysis = ai_report.normalize_batch_analysis(data, symbols)
+        analysis['provider'] = provider
+        return analysis
+    
+    except Exception as e:
+        logger.error(f"❌ Category analysis error: {e}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return None
+
 def translate_news_batch(news_list):
     """แปลข่าวทั้งหมดในคราวเดียวด้วย Deep Translator"""
     try:
         from deep_translator import GoogleTranslator
         
+        translator = GoogleTranslator(source='en', target='th')
+        if GOOGLE_TRANSLATE_URL:
+            translator._base_url = GOOGLE_TRANSLATE_URL
+        
+        def fetch(text):
+            with UPSTREAMS.slot('translate'):
+                return cassette.call('translate', {'target': 'th', 'text': text},
+                                     lambda: translator.translate(text))
+        
+        def translate(text):
+            return CACHE.get_or_compute(
+                'translate', make_key('th', text), TRANSLATE_CACHE_TTL, lambda: fetch(text)
+            )
+        
         for news in news_list:
             headline = news.get('headline', '')
             summary = news.get('summary', '')
@@ -1116,9 +1908,11 @@ def translate_news_batch(news_list):
             # แปลหัวข้อ
             if headline:
                 try:
-                    translator = GoogleTranslator(source='en', target='th')
-                    news['headline_th'] = translator.translate(headline)
+                    with tracing.span('translate.headline'), \
+                            metrics.UPSTREAM_LATENCY.time(provider='translate', endpoint='headline'):
+                        news['headline_th'] = translate(headline)
                 except Exception as e:
+                    metrics.UPSTREAM_ERRORS.inc(provider='translate')
                     logger.warning(f"Failed to translate headline: {e}")
                     news['headline_th'] = headline
             else:
@@ -1127,13 +1921,15 @@ def translate_news_batch(news_list):
             # แปลสรุป (Deep Translator จำกัดที่ 5000 ตัวอักษร)
             if summary:
                 try:
-                    translator = GoogleTranslator(source='en', target='th')
-                    if len(summary) > 4500:
-                        # ตัดให้สั้นลงถ้ายาวเกินไป
-                        news['summary_th'] = translator.translate(summary[:4500]) + "..."
-                    else:
-                        news['summary_th'] = translator.translate(summary)
+                    with tracing.span('translate.summary'), \
+                            metrics.UPSTREAM_LATENCY.time(provider='translate', endpoint='summary'):
+                        if len(summary) > 4500:
+                            # ตัดให้สั้นลงถ้ายาวเกินไป
+                            news['summary_th'] = translate(summary[:4500]) + "..."
+                        else:
+                            news['summary_th'] = translate(summary)
                 except Exception as e:
+                    metrics.UPSTREAM_ERRORS.inc(provider='translate')
                     logger.warning(f"Failed to translate summary: {e}")
                     news['summary_th'] = summary
             else:
@@ -1156,11 +1952,26 @@ def translate_news_batch(news_list):
         
 def escape_markdown(text):
     """Escape markdown special characters"""
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    return text
+    return escape_markdown_v2(text)
+
+
+async def send_report(message, builder):
+    """ส่งรายงานจาก ReportBuilder ด้วย entities (ไม่ต้อง retry เมื่อ parse ไม่ผ่าน)
+
+    ส่วนแรกแก้ไขข้อความเดิม ส่วนที่เกินความยาวส่งเป็นข้อความใหม่ในแชทเดียวกัน
+    """
+    chunks = builder.chunks()
+    first_text, first_entities = chunks[0]
+    await message.edit_text(first_text, entities=first_entities, disable_web_page_preview=True)
+    for text, entities in chunks[1:]:
+        await message.get_bot().send_message(
+            chat_id=message.chat_id,
+            text=text,
+            entities=entities,
+            disable_web_page_preview=True
+        )
     
+@track_command("news")
 async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """แสดงข่าวหุ้น - ต้องระบุ symbol"""
     
@@ -1209,7 +2020,7 @@ async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # ดึงข้อมูลข่าว
-    news_data = get_company_news(symbol)
+    news_data = await asyncio.to_thread(_bulk(get_company_news), symbol)
     
     if not news_data or len(news_data) == 0:
         await processing.edit_text(
@@ -1223,11 +2034,12 @@ async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # แปลข่าวเป็นภาษาไทย
-    news_data = translate_news_batch(news_data)
+    news_data = await asyncio.to_thread(translate_news_batch, news_data)
     
     # สร้างรายงานข่าว (ไม่มี AI)
-    report = f"📰 **ข่าว {symbol.upper()}**\n"
-    report += f"🗓️ 7 วันที่ผ่านมา ({len(news_data)} ข่าว)\n\n"
+    report = ReportBuilder()
+    report.bold(f"📰 ข่าว {symbol.upper()}").line()
+    report.line(f"🗓️ 7 วันที่ผ่านมา ({len(news_data)} ข่าว)").line()
     
     # แสดงข่าวแต่ละข่าว
     for i, news in enumerate(news_data, 1):
@@ -1259,31 +2071,24 @@ async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             date_str = 'N/A'
         
-        headline_escaped = escape_markdown(headline) if headline else 'ไม่มีหัวข้อ'
-        report += f"**{i}. {headline_escaped}**\n"
-        report += f"🗓️ {date_str} | 📡 {source}\n"
+        report.bold(f"{i}. {headline or 'ไม่มีหัวข้อ'}").line()
+        report.line(f"🗓️ {date_str} | 📡 {source}")
         
         if summary:
-            report += f"{summary}\n"
+            report.line(summary)
         
         if url:
-            report += f"🔗 [อ่านเพิ่มเติม]({url})\n"
+            report.text("🔗 ").link("อ่านเพิ่มเติม", url).line()
         
-        report += f"\n"
+        report.line()
     
-    report += f"🤖 ต้องการให้ AI วิเคราะห์? ใช้ /ai {symbol}\n"
-    report += f"⏰ อัพเดท: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}"
+    report.line(f"🤖 ต้องการให้ AI วิเคราะห์? ใช้ /ai {symbol}")
+    report.text(f"⏰ อัพเดท: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
     
     try:
-        await processing.edit_text(report, parse_mode='Markdown', disable_web_page_preview=True)
+        await send_report(processing, report)
     except Exception as e:
-        # ถ้า message ยาวเกินไป ให้แบ่งส่ง
-        if "too long" in str(e).lower():
-            # แบ่งส่ง 2 ส่วน (โค้ดเดิม...)
-            # ... (คงโค้ดเดิมไว้)
-            pass
-        else:
-            logger.error(f"Error sending news: {e}")
+        logger.error(f"Error sending news: {e}")
 
 
 
@@ -1294,77 +2099,41 @@ NEWS_DAYS_RANGE = 7
 MAX_NEWS_TO_ANALYZE = 5
 MIN_SYMBOL_LENGTH = 1
 MAX_SYMBOL_LENGTH = 6
-CACHE_TTL_SECONDS = 300  # 5 minutes
-
-# Simple in-memory cache
-_analysis_cache = {}
-
 def _get_cache_key(symbol: str) -> str:
     """Generate cache key for analysis"""
     return f"ai_analysis_{symbol}_{datetime.now().strftime('%Y%m%d%H%M')}"
 
 def _get_cached_analysis(symbol: str):
     """Get cached analysis if exists and not expired"""
-    cache_key = _get_cache_key(symbol)
-    if cache_key in _analysis_cache:
-        cached_data, timestamp = _analysis_cache[cache_key]
-        if datetime.now() - timestamp < timedelta(seconds=CACHE_TTL_SECONDS):
-            return cached_data
-    return None
+    cached_data = CACHE.lookup('ai', _get_cache_key(symbol))
+    metrics.record_cache('ai', hit=cached_data is not None)
+    return cached_data
 
 def _cache_analysis(symbol: str, data):
-    """Cache analysis result"""
-    cache_key = _get_cache_key(symbol)
-    _analysis_cache[cache_key] = (data, datetime.now())
-    
-    # Clean old cache entries
-    current_time = datetime.now()
-    keys_to_delete = [
-        k for k, (_, ts) in _analysis_cache.items()
-        if current_time - ts > timedelta(seconds=CACHE_TTL_SECONDS * 2)
-    ]
-    for k in keys_to_delete:
-        del _analysis_cache[k]
+    """Cache analysis result (backend ลบรายการที่หมดอายุเอง)"""
+    CACHE.set('ai', _get_cache_key(symbol), data, CACHE_TTL_SECONDS)
 
 
 
 
-def escape_markdown_v2(text: str) -> str:
-    """Escape special characters for Telegram MarkdownV2"""
-    # Characters that need to be escaped in MarkdownV2
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    
-    return text
+# ** และ __ เก็บไว้เป็น markdown ตั้งใจ ส่วนอักขระพิเศษอื่นๆ escape (ยกเว้น [ ] ( ) สำหรับลิงก์)
+_CLEAN_MARKDOWN_PATTERN = re.compile(r'\*\*|__|[_*~`>#+=|{}.!]')
+
+
+def _clean_markdown_replacement(match):
+    token = match.group(0)
+    if token == '**':
+        return '**'
+    if token == '__':
+        return '_'
+    return f'\\{token}'
+
 
 def clean_markdown_text(text: str) -> str:
-    """Clean text to prevent Markdown parsing errors"""
-    # Remove or escape problematic characters
-    # Keep only basic markdown: **bold** and _italic_
-    
-    # First, protect intentional markdown
-    text = text.replace('**', '<!BOLD!>')
-    text = text.replace('__', '<!ITALIC!>')
-    
-    # Escape remaining underscores and asterisks
-    text = text.replace('_', '\\_')
-    text = text.replace('*', '\\*')
-    
-    # Restore intentional markdown
-    text = text.replace('<!BOLD!>', '**')
-    text = text.replace('<!ITALIC!>', '_')
-    
-    # Escape other special characters that might cause issues
-    special_chars = ['[', ']', '(', ')', '~', '`', '>', '#', '+', '=', '|', '{', '}', '.', '!']
-    for char in special_chars:
-        # Don't escape if it's part of a link or intentional markdown
-        if char not in ['(', ')', '[', ']']:  # Keep these for links
-            text = text.replace(char, f'\\{char}')
-    
-    return text
+    """Clean text to prevent Markdown parsing errors (single regex pass)"""
+    return _CLEAN_MARKDOWN_PATTERN.sub(_clean_markdown_replacement, text)
 
+@track_command("ai")
 async def ai_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """วิเคราะห์ข่าวหุ้นด้วย AI - ต้องระบุ symbol"""
     
@@ -1374,11 +2143,12 @@ async def ai_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 **วิธีใช้:**
 /ai SYMBOL
+/ai SYMBOL fast - เฉพาะคะแนนรายข่าว (เร็ว ไม่รอบทสรุปจาก AI)
 
 **ตัวอย่าง:**
 /ai AAPL - วิเคราะห์ข่าว Apple
 /ai TSLA - วิเคราะห์ข่าว Tesla
-/ai MSFT - วิเคราะห์ข่าว Microsoft
+/ai MSFT fast - คะแนนข่าว Microsoft แบบเร็ว
 
 💡 AI จะวิเคราะห์ข่าว 5 ข่าวล่าสุดและให้:
    • คะแนนความเชื่อมั่น (-10 ถึง +10)
@@ -1390,6 +2160,7 @@ async def ai_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     symbol = context.args[0].strip().upper()
+    fast = AI_FAST_MODE or any(arg.lower() == 'fast' for arg in context.args[1:])
     
     # Validate symbol
     if len(symbol) < 1 or len(symbol) > 6 or not symbol.isalpha():
@@ -1424,8 +2195,13 @@ async def ai_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return
     
+    await run_expensive('ai', processing, lambda: perform_ai_analysis(processing, symbol, fast))
+
+
+async def perform_ai_analysis(processing, symbol, fast=False):
+    """ดึงข่าว รวมคะแนนรายข่าว และเขียนรายงาน /ai ลง processing (รันในคิวของ SCHEDULER)"""
     # ดึงข้อมูลข่าว
-    news_data = get_company_news(symbol)
+    news_data = await asyncio.to_thread(get_company_news, symbol)
     
     if not news_data or len(news_data) == 0:
         await processing.edit_text(
@@ -1439,12 +2215,41 @@ async def ai_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     # แปลข่าวเป็นภาษาไทย
-    news_data = translate_news_batch(news_data)
-    
-    # วิเคราะห์ด้วย Gemini AI
-    ai_analysis = analyze_news_with_gemini(news_data, symbol)
+    news_data = await asyncio.to_thread(translate_news_batch, news_data)
+    
+    # ผลเบื้องต้นระหว่างรอ AI: คะแนนที่มีในดัชนีแล้ว + lexicon สำหรับข่าวที่ยังไม่มี (ใช้เวลาไม่กี่ ms)
+    known = await asyncio.to_thread(SENTIMENT.lookup_many, [news['id'] for news in news_data if news.get('id')])
+    if not fast or None in known.values():
+        local = lexicon_sentiment.score_news(news_data)
+        preview_scores = {news.get('id'): known.get(news.get('id')) or score for news, score in zip(news_data, local)}
+        preview = ai_report.news_analysis_from_scores(news_data, preview_scores)
+        counts = ai_report.sentiment_counts(preview['news'], min(len(news_data), 5))
+        await processing.edit_text(
+            f"🤖 {symbol}: ผลประเมินเบื้องต้น\n"
+            f"📊 คะแนนความเชื่อมั่น: {preview['score']:+d}/10 ({ai_report.sentiment_label(preview['score'])})\n"
+            f"📈 สัดส่วนข่าว: 🟢 {counts['positive'][1]}% | 🟡 {counts['neutral'][1]}% | 🔴 {counts['negative'][1]}%\n\n"
+            f"⏳ AI กำลังวิเคราะห์รายละเอียด..."
+        )
     
-    if not ai_analysis:
+    # คะแนนรายข่าวจากดัชนี (ข่าวที่ยังไม่มีคะแนนถูกให้คะแนนตอนนี้ในคำขอเดียว)
+    scores = await asyncio.to_thread(SENTIMENT.scores_for, symbol, news_data)
+    for news, score in zip(news_data, lexicon_sentiment.score_news(news_data)):
+        if news.get('id') not in scores:
+            scores[news.get('id')] = dict(score, provisional=True)
+    ai_analysis = ai_report.news_analysis_from_scores(news_data, scores)
+    providers = {entry.get('scorer') for entry in scores.values()} - {None}
+    ai_analysis['provider'] = ", ".join(sorted(providers))
+    
+    # บทสรุปจาก AI (ข้ามในโหมดเร็ว หรือเมื่อเพิ่งให้คะแนนด้วย AI ไม่สำเร็จเลย)
+    ai_down = bool(scores) and all(entry.get('provisional') for entry in scores.values())
+    if not fast and not ai_down:
+        narrative = await asyncio.to_thread(analyze_news_with_gemini, news_data, symbol, scores)
+        if narrative:
+            ai_analysis['summary'] = narrative['summary']
+            providers.add(narrative['provider'])
+            ai_analysis['provider'] = ", ".join(sorted(providers))
+    
+    if not ai_analysis['news'] and not ai_analysis['summary']:
         await processing.edit_text(
             f"❌ **ไม่สามารถวิเคราะห์ข่าวได้**\n\n"
             f"อาจเป็นเพราะ:\n"
@@ -1456,149 +2261,36 @@ async def ai_analysis_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return
     
-    # นับจำนวนข่าวแต่ละประเภท
-    positive_count = ai_analysis.lower().count('🟢')
-    negative_count = ai_analysis.lower().count('🔴')
-    neutral_count = ai_analysis.lower().count('🟡')
-    
-    total_news = max(positive_count + negative_count + neutral_count, len(news_data))
-    if total_news > 0:
-        positive_pct = int((positive_count / total_news) * 100)
-        negative_pct = int((negative_count / total_news) * 100)
-        neutral_pct = int((neutral_count / total_news) * 100)
-    else:
-        positive_pct = negative_pct = neutral_pct = 0
+    # สัดส่วนข่าวและคะแนนรวมจากคะแนนรายข่าว
+    news_count = min(len(news_data), 5)
+    counts = ai_report.sentiment_counts(ai_analysis['news'], news_count)
+    score = ai_analysis['score']
     
     # สร้างรายงานการวิเคราะห์แบบใหม่
-    report = f"🤖 **AI วิเคราะห์ {symbol.upper()}**\n"
-    
-    # แสดงคะแนนความเชื่อมั่น (พยายามดึงจาก AI analysis)
-    score_line = ""
-    if "คะแนนความเชื่อมั่น:" in ai_analysis:
-        # ดึงคะแนนจาก AI analysis
-        import re
-        score_match = re.search(r'คะแนนความเชื่อมั่น:\s*([+-]?\d+)', ai_analysis)
-        if score_match:
-            score = int(score_match.group(1))
-            if score >= 7:
-                sentiment = "ข่าวดีมาก 🟢"
-            elif score >= 4:
-                sentiment = "ข่าวดี 🟢"
-            elif score >= 1:
-                sentiment = "ค่อนข้างดี 🟢"
-            elif score == 0:
-                sentiment = "เป็นกลาง 🟡"
-            elif score >= -3:
-                sentiment = "ค่อนข้างไม่ดี 🔴"
-            elif score >= -6:
-                sentiment = "ข่าวไม่ดี 🔴"
-            else:
-                sentiment = "ข่าวไม่ดีมาก 🔴"
-            
-            score_line = f"📊 คะแนนความเชื่อมั่น: {score:+d}/10 ({sentiment})\n"
-    
-    report += score_line
-    
-    # แสดงสัดส่วนข่าว
-    if total_news > 0:
-        report += f"📈 สัดส่วนข่าว: 🟢 {positive_pct}% | 🟡 {neutral_pct}% | 🔴 {negative_pct}%\n"
-    
-    report += f"\n{'─'*35}\n"
-    
-    # ทำความสะอาด AI analysis ก่อนแสดงผล
-    # แทนที่ markdown ที่อาจทำให้เกิด error
-    cleaned_analysis = ai_analysis
-    
-    # ลบหรือแทนที่ markdown ที่ซับซ้อน
-    # เก็บเฉพาะ text ธรรมดา โดยไม่ใช้ markdown ในส่วนของ AI analysis
-    # เพื่อป้องกัน parse error
+    report = ReportBuilder()
+    report.bold(f"🤖 AI วิเคราะห์ {symbol.upper()}").line()
+    report.line(f"📊 คะแนนความเชื่อมั่น: {score:+d}/10 ({ai_report.sentiment_label(score)})")
+    report.line(
+        f"📈 สัดส่วนข่าว: 🟢 {counts['positive'][1]}% | 🟡 {counts['neutral'][1]}% | 🔴 {counts['negative'][1]}%"
+    )
+    report.line(f"\n{'─'*35}")
     
-    report += cleaned_analysis
+    ai_report.render_news_analysis(report, ai_analysis, news_data)
+    report.line("═══════")
+    report.line(f"🤖 วิเคราะห์โดย: {ai_analysis['provider']}" + (" (โหมดเร็ว)" if fast else "")).line()
     
-    # เพิ่ม disclaimer และข้อมูลเพิ่มเติม
-    #report += f"\n\n{'─'*35}\n\n"
-    #report += f"⚠️ **คำเตือน:** AI Analysis - ไม่ใช่คำแนะนำทางการเงิน\n"
-    report += f"📅 วิเคราะห์จากข่าว {len(news_data)} ข่าวใน 7 วันล่าสุด\n"
-    report += f"⏰ อัพเดท: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n\n"
-    report += f"💡 ดูข่าวแบบละเอียด: /news {symbol}"
+    report.line(f"📅 วิเคราะห์จากข่าว {len(news_data)} ข่าวใน 7 วันล่าสุด")
+    report.line(f"⏰ อัพเดท: {datetime.now().strftime('%d/%m/%Y %H:%M')}").line()
+    report.text(f"💡 ดูข่าวแบบละเอียด: /news {symbol}")
     
     try:
-        await processing.edit_text(report, parse_mode='Markdown', disable_web_page_preview=True)
-    except telegram.error.BadRequest as e:
-        # ถ้า Markdown parse error ให้ลองส่งแบบไม่มี Markdown
-        if "can't parse entities" in str(e).lower() or "can't find end" in str(e).lower():
-            logger.warning(f"Markdown parse error, sending without markdown: {e}")
-            try:
-                # ส่งแบบ plain text (ไม่มี parse_mode)
-                plain_report = report.replace('**', '').replace('_', '').replace('`', '')
-                await processing.edit_text(plain_report, disable_web_page_preview=True)
-            except Exception as e2:
-                logger.error(f"Error sending plain text: {e2}")
-                await processing.edit_text(
-                    f"❌ เกิดข้อผิดพลาดในการแสดงผล\n\n"
-                    f"กรุณาลองใหม่อีกครั้ง",
-                )
-        else:
-            raise
+        await send_report(processing, report)
     except Exception as e:
-        # ถ้า message ยาวเกินไป ให้ส่งแบบย่อ
-        if "too long" in str(e).lower() or "message is too long" in str(e).lower():
-            # แยกเฉพาะส่วนสำคัญ
-            short_report = f"🤖 **AI วิเคราะห์ {symbol.upper()}**\n"
-            short_report += score_line
-            
-            if total_news > 0:
-                short_report += f"📈 สัดส่วนข่าว: 🟢 {positive_pct}% | 🟡 {neutral_pct}% | 🔴 {negative_pct}%\n"
-            
-            short_report += f"\n{'─'*35}\n\n"
-            
-            # ตัดเฉพาะสรุปภาพรวมและคะแนน
-            if "1. สรุปภาพรวม:" in ai_analysis:
-                summary_start = ai_analysis.find("1. สรุปภาพรวม:")
-                summary_end = ai_analysis.find("2. ผลกระทบต่อหุ้น:")
-                if summary_end == -1:
-                    summary_end = ai_analysis.find("3. คะแนนความเชื่อมั่น:")
-                
-                if summary_end > summary_start:
-                    summary = ai_analysis[summary_start:summary_end].strip()
-                    short_report += summary + "\n\n"
-            
-            # เพิ่มคะแนนความเชื่อมั่น
-            if "3. คะแนนความเชื่อมั่น:" in ai_analysis:
-                score_section = ai_analysis[ai_analysis.find("3. คะแนนความเชื่อมั่น:"):]
-                short_report += score_section.strip() + "\n\n"
-            
-            short_report += f"{'─'*35}\n\n"
-            short_report += f"📅 วิเคราะห์จาก {len(news_data)} ข่าวใน 7 วัน\n"
-            short_report += f"⏰ {datetime.now().strftime('%d/%m/%Y %H:%M')}\n\n"
-            short_report += f"💡 ดูข่าวเต็ม: /news {symbol}"
-            
-            try:
-                await processing.edit_text(short_report, parse_mode='Markdown', disable_web_page_preview=True)
-            except telegram.error.BadRequest as e2:
-                # ถ้ายังมี Markdown error อีก ส่งแบบ plain text
-                if "can't parse entities" in str(e2).lower():
-                    logger.warning(f"Short report markdown error, sending plain text")
-                    plain_report = short_report.replace('**', '').replace('_', '').replace('`', '')
-                    await processing.edit_text(plain_report, disable_web_page_preview=True)
-                else:
-                    logger.error(f"Error sending short AI analysis: {e2}")
-                    await processing.edit_text(
-                        f"❌ ข้อความยาวเกินไป\n\n"
-                        f"💡 ลอง /news {symbol} เพื่อดูข่าวแทน",
-                    )
-            except Exception as e2:
-                logger.error(f"Error sending short AI analysis: {e2}")
-                await processing.edit_text(
-                    f"❌ ข้อความยาวเกินไป\n\n"
-                    f"💡 ลอง /news {symbol} เพื่อดูข่าวแทน",
-                )
-        else:
-            logger.error(f"Error sending AI analysis: {e}")
-            await processing.edit_text(
-                f"❌ เกิดข้อผิดพลาดในการส่งผล\n\n"
-                f"กรุณาลองใหม่อีกครั้ง หรือติดต่อผู้ดูแลระบบ",
-            )
+        logger.error(f"Error sending AI analysis: {e}")
+        await processing.edit_text(
+            f"❌ เกิดข้อผิดพลาดในการส่งผล\n\n"
+            f"กรุณาลองใหม่อีกครั้ง หรือติดต่อผู้ดูแลระบบ",
+        )
              
              
 
@@ -1840,6 +2532,7 @@ def get_stock_analysis(symbol):
 # --- Telegram Handlers ---
 
 
+@track_command("aiplus")
 async def aiplus_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """วิเคราะห์แบบรวม: ข่าว + เทคนิค ด้วย AI"""
     
@@ -1900,10 +2593,11 @@ async def aiplus_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # เรียกใช้ฟังก์ชันวิเคราะห์
-    await perform_aiplus_analysis(processing, symbol)
+    await run_expensive('aiplus', processing, lambda: perform_aiplus_analysis(processing, symbol))
 
 
 
+@track_command("compare")
 async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """เปรียบเทียบ 2 หุ้น - /compare SYMBOL1 SYMBOL2"""
     
@@ -1963,6 +2657,11 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
     
+    await run_expensive('compare', processing, lambda: perform_compare_analysis(processing, symbol1, symbol2))
+
+
+async def perform_compare_analysis(processing, symbol1, symbol2):
+    """ดึงข้อมูลหุ้นทั้งสองตัวแล้วให้ AI เปรียบเทียบ (รันในคิวของ SCHEDULER)"""
     # ตรวจสอบ API Keys
     if not TWELVE_DATA_KEY or TWELVE_DATA_KEY == "":
         await processing.edit_text(
@@ -1992,8 +2691,10 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # ดึงข้อมูลหุ้นทั้ง 2 ตัว
-    stock1_data = await get_stock_data_for_comparison(symbol1)
-    stock2_data = await get_stock_data_for_comparison(symbol2)
+    stock1_data, stock2_data = await asyncio.gather(
+        asyncio.to_thread(get_stock_data_for_comparison, symbol1),
+        asyncio.to_thread(get_stock_data_for_comparison, symbol2),
+    )
     
     # ตรวจสอบว่าดึงข้อมูลได้หรือไม่
     if not stock1_data:
@@ -2013,8 +2714,8 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # วิเคราะห์เปรียบเทียบด้วย AI
-    comparison_analysis = analyze_comparison_with_gemini(
-        stock1_data, stock2_data, symbol1, symbol2
+    comparison_analysis = await asyncio.to_thread(
+        analyze_comparison_with_gemini, stock1_data, stock2_data, symbol1, symbol2
     )
     
     if not comparison_analysis:
@@ -2041,8 +2742,11 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     report += f"{'═'*35}\n\n"
     
-    # AI Analysis
-    report += comparison_analysis
+    # AI Analysis (render จาก JSON ที่ AI ตอบ)
+    report += ai_report.render_comparison(
+        comparison_analysis, {symbol1: stock1_data, symbol2: stock2_data}
+    )
+    report += f"\n═══════\n🤖 วิเคราะห์โดย: {comparison_analysis['provider']}"
     
     # Footer
     report += f"\n\n{'─'*35}\n"
@@ -2068,8 +2772,8 @@ async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 second_part = report[max_length:]
             
             await processing.edit_text(first_part, disable_web_page_preview=True)
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
+            await processing.get_bot().send_message(
+                chat_id=processing.chat_id,
                 text=second_part,
                 disable_web_page_preview=True
             )
@@ -2124,7 +2828,7 @@ async def perform_aiplus_analysis(message, symbol: str):
         return
     
     # 1. ดึงข้อมูลข่าว
-    news_data = get_company_news(symbol, days=NEWS_DAYS_RANGE)
+    news_data = await asyncio.to_thread(get_company_news, symbol, days=NEWS_DAYS_RANGE)
     
     if not news_data or len(news_data) == 0:
         await message.edit_text(
@@ -2137,126 +2841,26 @@ async def perform_aiplus_analysis(message, symbol: str):
         )
         return
     
-    # 2. ดึงข้อมูลเทคนิค
-    quote = get_quote(symbol)
-    if not quote or 'close' not in quote:
+    # 2. ดึงข้อมูลเทคนิค (router เลือกแหล่งที่เร็วที่สุดและ failover ภายใน deadline)
+    technical_data = await asyncio.to_thread(collect_technical_data, symbol)
+    if technical_data is None:
         await message.edit_text(
             f"❌ ไม่สามารถดึงข้อมูลเทคนิคของ {symbol} ได้\n\n"
             f"กรุณาตรวจสอบ Symbol หรือลองใหม่อีกครั้ง",
             parse_mode='Markdown'
         )
         return
-
-
-
-
-
-# เก็บข้อมูลเทคนิค
-    current = float(quote['close'])
-    prev_close = float(quote.get('previous_close', current))
-    change = current - prev_close
-    change_pct = (change / prev_close) * 100
-    
-    technical_data = {
-        'current': current,
-        'change_pct': change_pct,
-        'rsi': get_rsi(symbol),
-        'macd': None,
-        'macd_signal': None,
-        'ema_20': get_ema(symbol, 20),
-        'ema_50': get_ema(symbol, 50),
-        'ema_200': get_ema(symbol, 200),
-        'bb_lower': None,
-        'bb_upper': None,
-        'bb_position': None,
-        'analyst_buy_pct': None,
-        'upside_pct': None,
-        'data_source': 'API',  # เพิ่มบรรทัดนี้
-        'recorded_at': None    # เพิ่มบรรทัดนี้
-    }
-    
-    # MACD
-    macd, macd_signal = get_macd(symbol)
-    if macd is not None:
-        technical_data['macd'] = macd
-        technical_data['macd_signal'] = macd_signal
-    
-    # Bollinger Bands
-    bb_lower, bb_upper = get_bbands(symbol)
-    if bb_lower and bb_upper:
-        technical_data['bb_lower'] = bb_lower
-        technical_data['bb_upper'] = bb_upper
-        technical_data['bb_position'] = ((current - bb_lower) / (bb_upper - bb_lower)) * 100
-    
-    # ตรวจสอบว่ามีข้อมูลครบหรือไม่ ถ้าไม่ครบให้ดึงจาก Supabase
-    missing_data = (
-        technical_data['rsi'] is None or 
-        technical_data['macd'] is None or 
-        technical_data['ema_20'] is None or 
-        technical_data['bb_lower'] is None
-    )
-    
-    if missing_data:
-        logger.info(f"⚠️ Some technical indicators missing for {symbol}, checking Supabase...")
-        supabase_data = get_stock_data_from_supabase(symbol)
-        
-        if supabase_data:
-            # ใช้ข้อมูลจาก Supabase ถ้าไม่มีจาก API
-            if technical_data['rsi'] is None and supabase_data.get('rsi'):
-                technical_data['rsi'] = float(supabase_data['rsi'])
-            
-            if technical_data['macd'] is None and supabase_data.get('macd'):
-                technical_data['macd'] = float(supabase_data['macd'])
-                if supabase_data.get('macd_signal'):
-                    technical_data['macd_signal'] = float(supabase_data['macd_signal'])
-            
-            if technical_data['ema_20'] is None and supabase_data.get('ema_20'):
-                technical_data['ema_20'] = float(supabase_data['ema_20'])
-            
-            if technical_data['ema_50'] is None and supabase_data.get('ema_50'):
-                technical_data['ema_50'] = float(supabase_data['ema_50'])
-            
-            if technical_data['ema_200'] is None and supabase_data.get('ema_200'):
-                technical_data['ema_200'] = float(supabase_data['ema_200'])
-            
-            if technical_data['bb_lower'] is None and supabase_data.get('bb_lower'):
-                technical_data['bb_lower'] = float(supabase_data['bb_lower'])
-                if supabase_data.get('bb_upper'):
-                    technical_data['bb_upper'] = float(supabase_data['bb_upper'])
-                    technical_data['bb_position'] = ((current - technical_data['bb_lower']) / 
-                                                     (technical_data['bb_upper'] - technical_data['bb_lower'])) * 100
-            
-            # เก็บข้อมูลแหล่งที่มาและวันที่
-            technical_data['data_source'] = 'Supabase (Snapshot)'
-            technical_data['recorded_at'] = supabase_data.get('recorded_at')
-            
-            logger.info(f"✅ Filled missing data from Supabase for {symbol}")
-            
-     
-    
-    # Analyst recommendations
-    recommendations = get_analyst_recommendations(symbol)
-    if recommendations:
-        buy = recommendations.get('buy', 0)
-        hold = recommendations.get('hold', 0)
-        sell = recommendations.get('sell', 0)
-        total = buy + hold + sell
-        if total > 0:
-            technical_data['analyst_buy_pct'] = (buy / total) * 100
     
-    # Price target
-    price_target = get_price_target(symbol)
-    if price_target and price_target['target_mean']:
-        target_mean = price_target['target_mean']
-        technical_data['upside_pct'] = ((target_mean - current) / current) * 100
+    current = technical_data['current']
+    change_pct = technical_data['change_pct']
     
     # 3. แปลข่าว
-    news_data = translate_news_batch(news_data)
+    news_data = await asyncio.to_thread(translate_news_batch, news_data)
     
-    # 4. วิเคราะห์ด้วย AI แบบรวม
-    combined_analysis = analyze_combined_with_gemini(news_data, symbol, technical_data)
+    # 4. วิเคราะห์ด้วย AI แบบรวม (ได้ JSON แล้ว render เป็นรายงานภาษาไทยในเครื่อง)
+    analysis = await asyncio.to_thread(analyze_combined_with_gemini, news_data, symbol, technical_data)
     
-    if not combined_analysis:
+    if not analysis:
         await message.edit_text(
             f"❌ **ไม่สามารถวิเคราะห์ได้**\n\n"
             f"อาจเป็นเพราะ:\n"
@@ -2268,6 +2872,9 @@ async def perform_aiplus_analysis(message, symbol: str):
         )
         return
     
+    combined_analysis = ai_report.render_combined_analysis(analysis, technical_data, min(len(news_data), 5))
+    combined_analysis += f"\n═══════\n🤖 วิเคราะห์โดย: {analysis['provider']}"
+    
     # 5. สร้างรายงาน
     report = f"🤖 AI วิเคราะห์เต็มรูปแบบ {symbol.upper()}\n"
     report += f"💰 ราคา: ${current:.2f} ({change_pct:+.2f}%)\n"
@@ -2313,7 +2920,145 @@ async def perform_aiplus_analysis(message, symbol: str):
         except:
             await message.edit_text("❌ ข้อความยาวเกินไป กรุณาลองใหม่")
 
+# Dictionary หมวดหมู่หุ้น (เพิ่มหุ้นเยอะขึ้น)
+STOCK_CATEGORIES = {
+    "cat_toppicks": {
+        "name": "🔥 ยอดนิยมสุด",
+        "stocks": [
+            ["NVDA", "AAPL", "MSFT"],
+            ["GOOGL", "META", "TSLA"],
+            ["AMZN", "NFLX", "AMD"],
+            ["AVGO", "V", "MA"]
+        ]
+    },
+    "cat_ai_tech": {
+        "name": "🤖 AI & เทคโนโลยี",
+        "stocks": [
+            ["NVDA", "AMD", "INTC"],
+            ["AVGO", "QCOM", "ASML"],
+            ["ORCL", "CRM", "NOW"],
+            ["ADBE", "PLTR", "SNOW"],
+            ["CRWD", "PANW", "NET"]
+        ]
+    },
+    "cat_finance": {
+        "name": "💰 การเงิน & FinTech",
+        "stocks": [
+            ["V", "MA", "PYPL"],
+            ["JPM", "BAC", "GS"],
+            ["MS", "C", "WFC"],
+            ["BLK", "SCHW", "AXP"],
+            ["SQ", "COIN", "SOFI"]
+        ]
+    },
+    "cat_consumer": {
+        "name": "🛒 อุปโภคบริโภค",
+        "stocks": [
+            ["WMT", "COST", "TGT"],
+            ["HD", "LOW", "NKE"],
+            ["SBUX", "MCD", "CMG"],
+            ["KO", "PEP", "PG"],
+            ["AMZN", "BABA", "JD"]
+        ]
+    },
+    "cat_healthcare": {
+        "name": "🏥 สุขภาพ & ยา",
+        "stocks": [
+            ["JNJ", "UNH", "LLY"],
+            ["PFE", "ABBV", "NVO"],
+            ["TMO", "ABT", "DHR"],
+            ["ISRG", "VRTX", "REGN"],
+            ["MDT", "BMY", "AMGN"]
+        ]
+    },
+    "cat_energy": {
+        "name": "⚡ พลังงาน",
+        "stocks": [
+            ["XOM", "CVX", "COP"],
+            ["SLB", "EOG", "PSX"],
+            ["MPC", "VLO", "OXY"],
+            ["FANG", "DVN", "HAL"],
+            ["ENPH", "SEDG", "RUN"]  # Solar
+        ]
+    },
+    "cat_aerospace": {
+        "name": "🚀 อวกาศ & กลาโหม",
+        "stocks": [
+            ["RKLB", "BA", "LMT"],
+            ["RTX", "NOC", "GD"],
+            ["LHX", "HII", "TDG"],
+            ["AVAV", "KTOS", "AJRD"]
+        ]
+    },
+    "cat_media": {
+        "name": "📱 สื่อสาร & บันเทิง",
+        "stocks": [
+            ["NFLX", "DIS", "PARA"],
+            ["WBD", "CMCSA", "T"],
+            ["VZ", "TMUS", "CHTR"],
+            ["SPOT", "RBLX", "EA"],
+            ["TTWO", "ATVI", "U"]
+        ]
+    },
+    "cat_industrial": {
+        "name": "🏭 อุตสาหกรรม",
+        "stocks": [
+            ["CAT", "DE", "GE"],
+            ["HON", "MMM", "EMR"],
+            ["UPS", "FEDEX", "CSX"],
+            ["NSC", "UNP", "CP"],
+            ["ITW", "ETN", "PH"]
+        ]
+    },
+    "cat_etf": {
+        "name": "📊 ETF & กองทุน",
+        "stocks": [
+            ["SPY", "QQQ", "IVV"],
+            ["VOO", "VTI", "DIA"],
+            ["IWM", "EEM", "VEA"],
+            ["GLD", "SLV", "TLT"],
+            ["ARKK", "ARKW", "ARKG"]
+        ]
+    }
+}
+
+async def perform_category_analysis(message, category):
+    """วิเคราะห์หุ้นทุกตัวในหมวดด้วย AI คำขอเดียว แล้วแสดงตารางจัดอันดับ"""
+    cat_data = STOCK_CATEGORIES[category]
+    symbols = [symbol for row in cat_data["stocks"] for symbol in row]
+    
+    if not GEMINI_API_KEY and not GROQ_API_KEY:
+        await message.edit_text("⚠️ ไม่พบ GEMINI_API_KEY หรือ GROQ_API_KEY")
+        return
+    
+    quotes, technicals, news = await asyncio.to_thread(_bulk(collect_category_data), symbols)
+    if not quotes:
+        await message.edit_text(f"❌ ไม่สามารถดึงราคาหุ้นในหมวด {cat_data['name']} ได้ กรุณาลองใหม่อีกครั้ง")
+        return
+    
+    await message.edit_text(
+        f"🧠 {cat_data['name']}: ได้ข้อมูล {len(quotes)}/{len(symbols)} ตัว\n"
+        f"⏳ AI กำลังจัดอันดับ..."
+    )
+    analysis = await asyncio.to_thread(analyze_category_with_gemini, cat_data['name'], quotes, technicals, news)
+    if not analysis:
+        await message.edit_text(
+            f"❌ ไม่สามารถวิเคราะห์หมวด {cat_data['name']} ได้\n\n"
+            f"💡 กดเลือกหุ้นทีละตัวเพื่อวิเคราะห์แบบเต็มรูปแบบ"
+        )
+        return
+    
+    report = ReportBuilder()
+    report.bold(f"🧠 AI จัดอันดับหมวด {cat_data['name']}").line().line()
+    ai_report.render_batch_analysis(report, analysis, quotes)
+    report.line(f"\n{'─'*35}")
+    report.line(f"🤖 วิเคราะห์โดย: {analysis['provider']} (คำขอเดียว {len(quotes)} หุ้น)")
+    report.line(f"⏰ {datetime.now().strftime('%d/%m/%Y %H:%M')}").line()
+    report.text("💡 วิเคราะห์เต็มรูปแบบรายตัว: /aiplus SYMBOL")
+    await send_report(message, report)
+
 # เพิ่มฟังก์ชัน callback handler สำหรับจัดการปุ่ม
+@track_command("category_button")
 async def stock_category_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """จัดการ callback จากปุ่มเลือกหมวดหมู่"""
     query = update.callback_query
@@ -2321,110 +3066,8 @@ async def stock_category_callback(update: Update, context: ContextTypes.DEFAULT_
     
     category = query.data
     
-    # Dictionary หมวดหมู่หุ้น (เพิ่มหุ้นเยอะขึ้น)
-    stock_categories = {
-        "cat_toppicks": {
-            "name": "🔥 ยอดนิยมสุด",
-            "stocks": [
-                ["NVDA", "AAPL", "MSFT"],
-                ["GOOGL", "META", "TSLA"],
-                ["AMZN", "NFLX", "AMD"],
-                ["AVGO", "V", "MA"]
-            ]
-        },
-        "cat_ai_tech": {
-            "name": "🤖 AI & เทคโนโลยี",
-            "stocks": [
-                ["NVDA", "AMD", "INTC"],
-                ["AVGO", "QCOM", "ASML"],
-                ["ORCL", "CRM", "NOW"],
-                ["ADBE", "PLTR", "SNOW"],
-                ["CRWD", "PANW", "NET"]
-            ]
-        },
-        "cat_finance": {
-            "name": "💰 การเงิน & FinTech",
-            "stocks": [
-                ["V", "MA", "PYPL"],
-                ["JPM", "BAC", "GS"],
-                ["MS", "C", "WFC"],
-                ["BLK", "SCHW", "AXP"],
-                ["SQ", "COIN", "SOFI"]
-            ]
-        },
-        "cat_consumer": {
-            "name": "🛒 อุปโภคบริโภค",
-            "stocks": [
-                ["WMT", "COST", "TGT"],
-                ["HD", "LOW", "NKE"],
-                ["SBUX", "MCD", "CMG"],
-                ["KO", "PEP", "PG"],
-                ["AMZN", "BABA", "JD"]
-            ]
-        },
-        "cat_healthcare": {
-            "name": "🏥 สุขภาพ & ยา",
-            "stocks": [
-                ["JNJ", "UNH", "LLY"],
-                ["PFE", "ABBV", "NVO"],
-                ["TMO", "ABT", "DHR"],
-                ["ISRG", "VRTX", "REGN"],
-                ["MDT", "BMY", "AMGN"]
-            ]
-        },
-        "cat_energy": {
-            "name": "⚡ พลังงาน",
-            "stocks": [
-                ["XOM", "CVX", "COP"],
-                ["SLB", "EOG", "PSX"],
-                ["MPC", "VLO", "OXY"],
-                ["FANG", "DVN", "HAL"],
-                ["ENPH", "SEDG", "RUN"]  # Solar
-            ]
-        },
-        "cat_aerospace": {
-            "name": "🚀 อวกาศ & กลาโหม",
-            "stocks": [
-                ["RKLB", "BA", "LMT"],
-                ["RTX", "NOC", "GD"],
-                ["LHX", "HII", "TDG"],
-                ["AVAV", "KTOS", "AJRD"]
-            ]
-        },
-        "cat_media": {
-            "name": "📱 สื่อสาร & บันเทิง",
-            "stocks": [
-                ["NFLX", "DIS", "PARA"],
-                ["WBD", "CMCSA", "T"],
-                ["VZ", "TMUS", "CHTR"],
-                ["SPOT", "RBLX", "EA"],
-                ["TTWO", "ATVI", "U"]
-            ]
-        },
-        "cat_industrial": {
-            "name": "🏭 อุตสาหกรรม",
-            "stocks": [
-                ["CAT", "DE", "GE"],
-                ["HON", "MMM", "EMR"],
-                ["UPS", "FEDEX", "CSX"],
-                ["NSC", "UNP", "CP"],
-                ["ITW", "ETN", "PH"]
-            ]
-        },
-        "cat_etf": {
-            "name": "📊 ETF & กองทุน",
-            "stocks": [
-                ["SPY", "QQQ", "IVV"],
-                ["VOO", "VTI", "DIA"],
-                ["IWM", "EEM", "VEA"],
-                ["GLD", "SLV", "TLT"],
-                ["ARKK", "ARKW", "ARKG"]
-            ]
-        }
-    }
-    
-    if category in stock_categories:
-        cat_data = stock_categories[category]
+    if category in STOCK_CATEGORIES:
+        cat_data = STOCK_CATEGORIES[category]
         keyboard = []
         
         # สร้างปุ่มจากรายการหุ้น
@@ -2435,6 +3078,9 @@ async def stock_category_callback(update: Update, context: ContextTypes.DEFAULT_
             ]
             keyboard.append(button_row)
         
+        # วิเคราะห์ทั้งหมวดในคำขอ AI เดียว
+        keyboard.append([InlineKeyboardButton("🧠 วิเคราะห์ทั้งหมวด (จัดอันดับ)", callback_data=f"catall_{category}")])
+        
         # ปุ่มกลับ
         keyboard.append([InlineKeyboardButton("🔙 กลับเมนูหลัก", callback_data="back_to_main")])
         
@@ -2445,6 +3091,10 @@ async def stock_category_callback(update: Update, context: ContextTypes.DEFAULT_
             f"💡 กดปุ่มเพื่อให้ AI วิเคราะห์แบบรวม (ข่าว + เทคนิค)",
             reply_markup=reply_markup
         )
+        
+        # เติมราคาย้อนหลังของทั้งหมวดใน background ระหว่างที่ผู้ใช้เลือกหุ้น
+        symbols = [symbol for row in cat_data["stocks"] for symbol in row]
+        context.application.create_task(asyncio.to_thread(backfill_history, symbols))
     
     elif category == "back_to_main":
         # กลับไปเมนูหลัก
@@ -2469,6 +3119,14 @@ async def stock_category_callback(update: Update, context: ContextTypes.DEFAULT_
             parse_mode='Markdown'
         )
     
+    elif category.startswith("catall_") and category[len("catall_"):] in STOCK_CATEGORIES:
+        category = category[len("catall_"):]
+        await query.edit_message_text(
+            f"🧠 กำลังวิเคราะห์ทั้งหมวด {STOCK_CATEGORIES[category]['name']}...\n"
+            f"⏳ กำลังรวบรวมราคา ตัวชี้วัด และข่าวของทุกตัว"
+        )
+        await run_expensive('category', query.message, lambda: perform_category_analysis(query.message, category))
+    
     elif category.startswith("aiplus_"):
         # เริ่มวิเคราะห์หุ้น
         symbol = category.replace("aiplus_", "")
@@ -2484,276 +3142,9 @@ async def stock_category_callback(update: Update, context: ContextTypes.DEFAULT_
         )
         
         # เรียกใช้ฟังก์ชันวิเคราะห์
-        await perform_aiplus_analysis(query.message, symbol)
+        await run_expensive('aiplus', query.message, lambda: perform_aiplus_analysis(query.message, symbol))
 
 
-async def aiplus_button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button clicks from /aiplus menu"""
-    query = update.callback_query
-    await query.answer()
-    
-    # ดึง symbol จาก callback_data (รูปแบบ: "aiplus_SYMBOL")
-    callback_data = query.data
-    if not callback_data.startswith("aiplus_"):
-        return
-    
-    symbol = callback_data.replace("aiplus_", "").strip().upper()
-    
-    # Validate symbol
-    if len(symbol) < MIN_SYMBOL_LENGTH or len(symbol) > MAX_SYMBOL_LENGTH or not symbol.isalpha():
-        await query.edit_message_text(
-            f"❌ Symbol {symbol} ไม่ถูกต้อง",
-            parse_mode='Markdown'
-        )
-        return
-    
-    # แก้ไขข้อความเป็น processing
-    processing = await query.edit_message_text(
-        f"🚀 กำลังวิเคราะห์ {symbol} แบบเต็มรูปแบบ...\n"
-        f"⏳ กำลังรวบรวมข้อมูล:\n"
-        f"  • ข่าวล่าสุด\n"
-        f"  • ตัวชี้วัดเทคนิค\n"
-        f"  • ข้อมูลนักวิเคราะห์\n"
-        f"  • AI กำลังวิเคราะห์...",
-        parse_mode='Markdown'
-    )
-    
-    # ตรวจสอบ API Keys
-    if not FINNHUB_KEY or FINNHUB_KEY == "":
-        await query.edit_message_text(
-            "⚠️ **ไม่พบ FINNHUB_KEY**\n\n"
-            "กรุณาตั้งค่า FINNHUB_KEY ใน Environment\n"
-            "รับ Free API Key: https://finnhub.io/register",
-            parse_mode='Markdown'
-        )
-        return
-    
-    if not GEMINI_API_KEY or GEMINI_API_KEY == "":
-        await query.edit_message_text(
-            "⚠️ **ไม่พบ GEMINI_API_KEY**\n\n"
-            "กรุณาตั้งค่า GEMINI_API_KEY ใน Environment\n"
-            "รับ Free API Key: https://makersuite.google.com/app/apikey",
-            parse_mode='Markdown'
-        )
-        return
-    
-    if not TWELVE_DATA_KEY or TWELVE_DATA_KEY == "":
-        await query.edit_message_text(
-            "⚠️ **ไม่พบ TWELVE_DATA_KEY**\n\n"
-            "กรุณาตั้งค่า TWELVE_DATA_KEY ใน Environment\n"
-            "รับ Free API Key: https://twelvedata.com/apikey",
-            parse_mode='Markdown'
-        )
-        return
-    
-    # 1. ดึงข้อมูลข่าว
-    news_data = get_company_news(symbol, days=NEWS_DAYS_RANGE)
-    
-    if not news_data or len(news_data) == 0:
-        await query.edit_message_text(
-            f"❌ ไม่พบข่าวสำหรับ {symbol}\n\n"
-            f"อาจเป็นเพราะ:\n"
-            f"• Symbol ไม่ถูกต้อง\n"
-            f"• ไม่มีข่าวในช่วง 7 วันที่ผ่านมา\n\n"
-            f"ลอง /popular เพื่อดูหุ้นยอดนิยม",
-            parse_mode='Markdown'
-        )
-        return
-    
-    # 2. ดึงข้อมูลเทคนิค
-    quote = get_quote(symbol)
-    if not quote or 'close' not in quote:
-        await query.edit_message_text(
-            f"❌ ไม่สามารถดึงข้อมูลเทคนิคของ {symbol} ได้\n\n"
-            f"กรุณาตรวจสอบ Symbol หรือลองใหม่อีกครั้ง",
-            parse_mode='Markdown'
-        )
-        return
-    
-    # เก็บข้อมูลเทคนิค 
- 
-    current = float(quote['close'])
-    prev_close = float(quote.get('previous_close', current))
-    change = current - prev_close
-    change_pct = (change / prev_close) * 100
-    
-    technical_data = {
-        'current': current,
-        'change_pct': change_pct,
-        'rsi': get_rsi(symbol),
-        'macd': None,
-        'macd_signal': None,
-        'ema_20': get_ema(symbol, 20),
-        'ema_50': get_ema(symbol, 50),
-        'ema_200': get_ema(symbol, 200),
-        'bb_lower': None,
-        'bb_upper': None,
-        'bb_position': None,
-        'analyst_buy_pct': None,
-        'upside_pct': None,
-        'data_source': 'API',
-        'recorded_at': None
-    }
-    
-    # MACD
-    macd, macd_signal = get_macd(symbol)
-    if macd is not None:
-        technical_data['macd'] = macd
-        technical_data['macd_signal'] = macd_signal
-    
-    # Bollinger Bands
-    bb_lower, bb_upper = get_bbands(symbol)
-    if bb_lower and bb_upper:
-        technical_data['bb_lower'] = bb_lower
-        technical_data['bb_upper'] = bb_upper
-        technical_data['bb_position'] = ((current - bb_lower) / (bb_upper - bb_lower)) * 100
-    
-    # ตรวจสอบว่ามีข้อมูลครบหรือไม่ ถ้าไม่ครบให้ดึงจาก Supabase
-    missing_data = (
-        technical_data['rsi'] is None or 
-        technical_data['macd'] is None or 
-        technical_data['ema_20'] is None or 
-        technical_data['bb_lower'] is None
-    )
-    
-    if missing_data:
-        logger.info(f"⚠️ Some technical indicators missing for {symbol}, checking Supabase...")
-        supabase_data = get_stock_data_from_supabase(symbol)
-        
-        if supabase_data:
-            if technical_data['rsi'] is None and supabase_data.get('rsi'):
-                technical_data['rsi'] = float(supabase_data['rsi'])
-            
-            if technical_data['macd'] is None and supabase_data.get('macd'):
-                technical_data['macd'] = float(supabase_data['macd'])
-                if supabase_data.get('macd_signal'):
-                    technical_data['macd_signal'] = float(supabase_data['macd_signal'])
-            
-            if technical_data['ema_20'] is None and supabase_data.get('ema_20'):
-                technical_data['ema_20'] = float(supabase_data['ema_20'])
-            
-            if technical_data['ema_50'] is None and supabase_data.get('ema_50'):
-                technical_data['ema_50'] = float(supabase_data['ema_50'])
-            
-            if technical_data['ema_200'] is None and supabase_data.get('ema_200'):
-                technical_data['ema_200'] = float(supabase_data['ema_200'])
-            
-            if technical_data['bb_lower'] is None and supabase_data.get('bb_lower'):
-                technical_data['bb_lower'] = float(supabase_data['bb_lower'])
-                if supabase_data.get('bb_upper'):
-                    technical_data['bb_upper'] = float(supabase_data['bb_upper'])
-                    technical_data['bb_position'] = ((current - technical_data['bb_lower']) / 
-                                                     (technical_data['bb_upper'] - technical_data['bb_lower'])) * 100
-            
-            technical_data['data_source'] = 'Supabase (Snapshot)'
-            technical_data['recorded_at'] = supabase_data.get('recorded_at')
-            
-            logger.info(f"✅ Filled missing data from Supabase for {symbol}")
- 
-    
-    
-    # Analyst recommendations
-    recommendations = get_analyst_recommendations(symbol)
-    if recommendations:
-        buy = recommendations.get('buy', 0)
-        hold = recommendations.get('hold', 0)
-        sell = recommendations.get('sell', 0)
-        total = buy + hold + sell
-        if total > 0:
-            technical_data['analyst_buy_pct'] = (buy / total) * 100
-    
-    # Price target
-    price_target = get_price_target(symbol)
-    if price_target and price_target['target_mean']:
-        target_mean = price_target['target_mean']
-        technical_data['upside_pct'] = ((target_mean - current) / current) * 100
-    
-    # 3. แปลข่าว
-    news_data = translate_news_batch(news_data)
-    
-    # 4. วิเคราะห์ด้วย AI แบบรวม
-    combined_analysis = analyze_combined_with_gemini(news_data, symbol, technical_data)
-    
-    if not combined_analysis:
-        await query.edit_message_text(
-            f"❌ **ไม่สามารถวิเคราะห์ได้**\n\n"
-            f"อาจเป็นเพราะ:\n"
-            f"• Gemini API มีปัญหา\n"
-            f"• API Key ไม่ถูกต้อง\n"
-            f"• Network error\n\n"
-            f"💡 ลอง /ai {symbol} หรือ /news {symbol}",
-            parse_mode='Markdown'
-        )
-        return
-    
- 
-
-    # 5. สร้างรายงาน
-    report = f"🤖 AI วิเคราะห์เต็มรูปแบบ {symbol.upper()}\n"
-    report += f"💰 ราคา: ${current:.2f} ({change_pct:+.2f}%)\n"
-    
-    # แสดงข้อมูลแหล่งที่มาถ้าเป็น Supabase
-    if technical_data.get('data_source') == 'Supabase (Snapshot)':
-        from datetime import datetime
-        recorded_at = technical_data.get('recorded_at', '')
-        if recorded_at:
-            try:
-                dt = datetime.fromisoformat(recorded_at.replace('Z', '+00:00'))
-                date_str = dt.strftime('%d/%m/%Y %H:%M')
-                report += f"📊 ข้อมูลเทคนิคจาก: Supabase Snapshot\n"
-                report += f"🕐 บันทึกเมื่อ: {date_str}\n"
-            except:
-                report += f"📊 ข้อมูลเทคนิคจาก: Supabase Snapshot\n"
-        else:
-            report += f"📊 ข้อมูลเทคนิคจาก: Supabase Snapshot\n"
-    
-    report += "\n"
-    # AI Analysis
-    report += combined_analysis
-    
-    # Footer
-    report += f"\n\n{'─'*35}\n" 
-    report += f"📅 วิเคราะห์จาก {len(news_data)} ข่าว + ข้อมูลเทคนิค\n"
-    report += f"⏰ {datetime.now().strftime('%d/%m/%Y %H:%M')}\n\n"
-    report += f"💡 ข่าว: /news {symbol}"
-     
-    try:
-        # เช็คความยาวก่อนส่ง
-        if len(report) > 4000:
-            # แบ่งส่งทันที
-            max_length = 3500
-            
-            first_part = report[:max_length]
-            last_newline = first_part.rfind('\n')
-            if last_newline > 3000:
-                first_part = report[:last_newline]
-                second_part = report[last_newline+1:]
-            else:
-                first_part = report[:max_length]
-                second_part = report[max_length:]
-            
-            await query.edit_message_text(first_part, disable_web_page_preview=True)
-            await context.bot.send_message(
-                chat_id=query.message.chat_id,
-                text=second_part,
-                disable_web_page_preview=True
-            )
-        else:
-            await query.edit_message_text(report, disable_web_page_preview=True)
-            
-    except Exception as e:
-        logger.error(f"Error sending aiplus analysis from button: {e}")
-        # Fallback: ส่งแบบสั้น
-        short_report = f"🤖 AI วิเคราะห์ {symbol.upper()}\n"
-        short_report += f"💰 ${current:.2f} ({change_pct:+.2f}%)\n\n"
-        short_report += combined_analysis[:3000] + "\n\n...(ตัดข้อความ)\n\n"
-        short_report += f"📅 {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-        
-        try:
-            await query.edit_message_text(short_report, disable_web_page_preview=True)
-        except:
-            await query.edit_message_text("❌ ข้อความยาวเกินไป กรุณาลองใหม่")
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     welcome = """🤖 **ยินดีต้อนรับสู่ Stock Analysis Bot!** 📈
 
@@ -2763,6 +3154,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 - /ai SYMBOL - AI วิเคราะห์ข่าว 
 - /aiplus SYMBOL - AI วิเคราะห์แบบรวม (ข่าว+เทคนิค) 🚀
 - /compare SYMBOL1 SYMBOL2 - เปรียบเทียบ 2 หุ้น ⚖️ NEW!
+- /chart SYMBOL - กราฟราคาและตัวชี้วัด 📈
+- /backtest SYMBOL - ทดสอบสัญญาณย้อนหลัง 🧪
+- /portfolio - ติดตามพอร์ตหุ้น 💼
 - /help - ดูคำแนะนำ
 - /popular - ดูหุ้นยอดนิยม
 
@@ -2822,7 +3216,13 @@ Death Cross: EMA 50 ตัดลง EMA 200 = สัญญาณขายแร
 /news SYMBOL - ดูข่าวของหุ้น
 /ai SYMBOL - AI วิเคราะห์ว่าข่าวดีหรือไม่ดี
 /compare AAPL MSFT - เปรียบเทียบ 2 หุ้น ⚖️
-/popular - ดูหุ้นยอดนิยม"""
+/chart AAPL - กราฟราคา + EMA + Bollinger Bands 📈
+/backtest AAPL - สัญญาณในรายงานเคยแม่นแค่ไหน 🧪
+/portfolio add AAPL 10 185.5 - เพิ่มหุ้นเข้าพอร์ต, /portfolio - ดูพอร์ต 💼
+/popular - ดูหุ้นยอดนิยม
+
+**Inline (ใช้ได้ทุกแชท):**
+พิมพ์ @ชื่อบอท AAPL MSFT - การ์ดราคา, RSI, MACD, แนวโน้ม EMA"""
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
 async def popular_stocks(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2851,6 +3251,7 @@ async def popular_stocks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 แค่พิมพ์ symbol เพื่อดูข้อมูลและตัวชี้วัด! 🚀"""
     await update.message.reply_text(popular, parse_mode='Markdown')
 
+@track_command("symbol")
 async def analyze_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text: 
         return
@@ -2861,7 +3262,7 @@ async def analyze_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     processing = await update.message.reply_text(f"🔍 กำลังวิเคราะห์ {user_input}...\n⏳ กำลังดึงข้อมูล RSI, MACD, EMA, Bollinger Bands, Valuation...")
-    analysis = get_stock_analysis(user_input)
+    analysis = await asyncio.to_thread(get_stock_analysis, user_input)
     
     if analysis == "no_key":
         await processing.edit_text(
@@ -2879,6 +3280,222 @@ async def analyze_stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
+@track_command("chart")
+async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """กราฟราคา + EMA 20/50/200 + Bollinger Bands - /chart SYMBOL"""
+    if not context.args:
+        await update.message.reply_text(
+            "📈 **กราฟราคาและตัวชี้วัด**\n\n"
+            "**วิธีใช้:** /chart SYMBOL\n"
+            "**ตัวอย่าง:** /chart AAPL\n\n"
+            "แสดงราคาปิดย้อนหลัง ~9 เดือน พร้อม EMA 20/50/200 และ Bollinger Bands",
+            parse_mode='Markdown'
+        )
+        return
+    
+    symbol = context.args[0].strip().upper()
+    if len(symbol) < MIN_SYMBOL_LENGTH or len(symbol) > MAX_SYMBOL_LENGTH or not symbol.isalpha():
+        await update.message.reply_text(
+            f"❌ Symbol '{symbol}' ไม่ถูกต้อง\n"
+            f"กรุณาใช้ตัวอักษร 1-6 ตัว เช่น: /chart AAPL"
+        )
+        return
+    
+    processing = await update.message.reply_text(f"📈 กำลังสร้างกราฟ {symbol}...")
+    try:
+        bars = await asyncio.to_thread(ensure_history, symbol)
+    except Exception as e:
+        logger.error(f"❌ Cannot load history for {symbol}: {e}")
+        bars = None
+    if bars is None or len(bars.close) == 0:
+        await processing.edit_text(f"❌ ไม่พบราคาย้อนหลังของ {symbol}\n\nกรุณาตรวจสอบ Symbol หรือลอง /popular")
+        return
+    
+    bar_date = _bar_date(bars)
+    key = make_key(symbol, bar_date)
+    caption = f"📈 {symbol} ราคาปิดถึง {bar_date}\nEMA 20/50/200 + Bollinger Bands (20, 2)"
+    
+    # กราฟของแท่งนี้เคยส่งแล้ว: ส่ง file_id เดิม ไม่ต้อง render / upload ใหม่
+    file_id = await asyncio.to_thread(_chart_file_id, key)
+    if file_id:
+        try:
+            await update.message.reply_photo(file_id, caption=caption)
+            await processing.delete()
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Cached chart file_id for {symbol} rejected: {e}")
+            await asyncio.to_thread(_store_chart_file_id, key, None)
+    
+    try:
+        png = await render_chart_png(symbol, bars)
+    except ImportError:
+        await processing.edit_text("⚠️ ยังไม่ได้ติดตั้ง matplotlib บนเซิร์ฟเวอร์ จึงสร้างกราฟไม่ได้")
+        return
+    except Exception as e:
+        logger.error(f"❌ Chart render failed for {symbol}: {e}")
+        await processing.edit_text(f"❌ สร้างกราฟ {symbol} ไม่สำเร็จ กรุณาลองใหม่อีกครั้ง")
+        return
+    
+    sent = await update.message.reply_photo(png, caption=caption)
+    if sent.photo:
+        await asyncio.to_thread(_store_chart_file_id, key, sent.photo[-1].file_id)
+    await processing.delete()
+
+@track_command("backtest")
+async def backtest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ทดสอบสัญญาณย้อนหลัง - /backtest SYMBOL [SYMBOL ...]"""
+    if not context.args:
+        await update.message.reply_text(
+            "🧪 **ทดสอบสัญญาณย้อนหลัง (Backtest)**\n\n"
+            "**วิธีใช้:** /backtest SYMBOL\n"
+            "**ตัวอย่าง:** /backtest AAPL หรือ /backtest NVDA AMD AVGO (รวมผลหลายตัว)\n\n"
+            "วัดว่าสัญญาณ RSI, MACD และ EMA ในรายงานเคยถูกทางแค่ไหน "
+            "พร้อมผลตอบแทนเฉลี่ยและ drawdown",
+            parse_mode='Markdown'
+        )
+        return
+    
+    symbols = list(dict.fromkeys(arg.strip().upper() for arg in context.args))[:BACKTEST_MAX_SYMBOLS]
+    for symbol in symbols:
+        if len(symbol) < MIN_SYMBOL_LENGTH or len(symbol) > MAX_SYMBOL_LENGTH or not symbol.isalpha():
+            await update.message.reply_text(
+                f"❌ Symbol '{symbol}' ไม่ถูกต้อง\n"
+                f"กรุณาใช้ตัวอักษร 1-6 ตัว เช่น: /backtest AAPL"
+            )
+            return
+    
+    processing = await update.message.reply_text(f"🧪 กำลังทดสอบสัญญาณย้อนหลัง {', '.join(symbols)}...")
+    await run_expensive('backtest', processing, lambda: perform_backtest(processing, symbols))
+
+async def perform_backtest(processing, symbols):
+    """รัน backtest ใน thread แล้วแก้ข้อความ processing เป็นรายงาน (รันในคิวของ SCHEDULER)"""
+    try:
+        outcome = await asyncio.to_thread(run_backtest, symbols)
+    except Exception as e:
+        logger.error(f"❌ Backtest failed for {symbols}: {e}")
+        outcome = None
+    if outcome is None:
+        await processing.edit_text(
+            f"❌ ราคาย้อนหลังของ {', '.join(symbols)} ไม่พอสำหรับ backtest "
+            f"(ต้องมีอย่างน้อย {backtest.MIN_BARS} วันทำการ)"
+        )
+        return
+    
+    result, period = outcome
+    title = ', '.join(result['symbols'])
+    await processing.edit_text(backtest.render_report(title, result, period), parse_mode='Markdown')
+
+PORTFOLIO_USAGE = """💼 **พอร์ตหุ้น**
+
+**วิธีใช้:**
+/portfolio - ดูมูลค่า กำไร/ขาดทุน และสัดส่วน
+/portfolio add SYMBOL จำนวน ราคา - เพิ่มหุ้น (ซื้อซ้ำจะเฉลี่ยต้นทุน)
+/portfolio remove SYMBOL - ลบหุ้นออกจากพอร์ต
+
+**ตัวอย่าง:**
+/portfolio add AAPL 10 185.5"""
+
+@track_command("portfolio")
+async def portfolio_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """พอร์ตหุ้นของ chat - /portfolio [add SYMBOL QTY PRICE | remove SYMBOL]"""
+    chat_id = update.effective_chat.id
+    args = context.args or []
+    action = args[0].lower() if args else ''
+    
+    if action == 'add':
+        try:
+            symbol = args[1].strip().upper()
+            quantity, price = float(args[2]), float(args[3])
+        except (IndexError, ValueError):
+            await update.message.reply_text(PORTFOLIO_USAGE, parse_mode='Markdown')
+            return
+        if len(symbol) < MIN_SYMBOL_LENGTH or len(symbol) > MAX_SYMBOL_LENGTH or not symbol.isalpha():
+            await update.message.reply_text(f"❌ Symbol '{symbol}' ไม่ถูกต้อง\nกรุณาใช้ตัวอักษร 1-6 ตัว เช่น: AAPL")
+            return
+        if not (quantity > 0 and price > 0):
+            await update.message.reply_text("❌ จำนวนและราคาต้องมากกว่า 0")
+            return
+        holdings = await asyncio.to_thread(PORTFOLIOS.holdings, chat_id)
+        if len(holdings) >= PORTFOLIO_MAX_POSITIONS and symbol not in {held[0] for held in holdings}:
+            await update.message.reply_text(f"⚠️ พอร์ตมีได้สูงสุด {PORTFOLIO_MAX_POSITIONS} ตัว")
+            return
+        total, average = await asyncio.to_thread(PORTFOLIOS.add, chat_id, symbol, quantity, price)
+        await update.message.reply_text(
+            f"✅ เพิ่ม {symbol} {quantity:g} หุ้น @ ${price:,.2f}\n"
+            f"📦 ถืออยู่ {total:g} หุ้น ต้นทุนเฉลี่ย ${average:,.2f}"
+        )
+        return
+    
+    if action == 'remove':
+        symbol = args[1].strip().upper() if len(args) > 1 else ''
+        if not symbol:
+            await update.message.reply_text(PORTFOLIO_USAGE, parse_mode='Markdown')
+        elif await asyncio.to_thread(PORTFOLIOS.remove, chat_id, symbol):
+            await update.message.reply_text(f"🗑️ ลบ {symbol} ออกจากพอร์ตแล้ว")
+        else:
+            await update.message.reply_text(f"❌ ไม่มี {symbol} ในพอร์ต")
+        return
+    
+    if action:
+        await update.message.reply_text(PORTFOLIO_USAGE, parse_mode='Markdown')
+        return
+    
+    processing = await update.message.reply_text("💼 กำลังประเมินมูลค่าพอร์ต...")
+    try:
+        report = await asyncio.to_thread(value_portfolio, chat_id)
+    except Exception as e:
+        logger.error(f"❌ Portfolio valuation failed for chat {chat_id}: {e}")
+        await processing.edit_text("❌ ประเมินพอร์ตไม่สำเร็จ กรุณาลองใหม่อีกครั้ง")
+        return
+    if report is None:
+        await processing.edit_text("💼 พอร์ตยังว่างอยู่\n\nเพิ่มหุ้นด้วย /portfolio add AAPL 10 185.5")
+        return
+    await processing.edit_text(report, parse_mode='Markdown')
+
+def _inline_symbols(text):
+    """symbol จากข้อความ inline query เช่น "aapl, msft" -> ['AAPL', 'MSFT'] (ไม่ซ้ำ ไม่เกิน INLINE_MAX_SYMBOLS)"""
+    symbols = []
+    for word in re.split(r'[\s,]+', text.strip().upper()):
+        valid = MIN_SYMBOL_LENGTH <= len(word) <= MAX_SYMBOL_LENGTH and word.replace('.', '').isalpha()
+        if valid and word not in symbols:
+            symbols.append(word)
+    return symbols[:INLINE_MAX_SYMBOLS]
+
+@track_command("inline")
+async def inline_quote_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ตอบ @bot AAPL ด้วยการ์ดราคา/สัญญาณจาก cache (symbol ที่ยังไม่มีการ์ดรอได้ไม่เกิน INLINE_DEADLINE_SECONDS)"""
+    query = update.inline_query
+    symbols = _inline_symbols(query.query)
+    if not symbols:
+        await query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+    
+    user_id = query.from_user.id
+    _remember_inline_query(user_id, symbols)
+    cards = await asyncio.to_thread(cached_quote_cards, symbols)
+    missing = [symbol for symbol, card in cards.items() if card is None]
+    # งานที่เกิน deadline ยังรันต่อใน executor และเก็บการ์ดไว้ให้ query ถัดไป (งานค้างเกินกำหนดถูกข้าม)
+    futures = {symbol: submit_quote_card(symbol, user_id) for symbol in missing}
+    pending = {symbol: asyncio.wrap_future(future) for symbol, future in futures.items() if future is not None}
+    if pending:
+        done, _ = await asyncio.wait(pending.values(), timeout=INLINE_DEADLINE_SECONDS)
+        for symbol, future in pending.items():
+            if future in done:
+                cards[symbol] = future.result()
+    
+    results = [
+        InlineQueryResultArticle(
+            id=f"{card['symbol']}-{int(card['updated_at'])}",
+            title=quote_card.render_title(card),
+            description=quote_card.render_description(card),
+            input_message_content=InputTextMessageContent(quote_card.render_text(card)),
+        )
+        for card in cards.values() if card
+    ]
+    # ผลไม่ครบ: ไม่ให้ Telegram cache เพื่อให้การพิมพ์ครั้งถัดไปได้การ์ดที่ดึงเสร็จแล้ว
+    complete = len(results) == len(symbols)
+    await query.answer(results, cache_time=INLINE_CACHE_TIME if complete else 0)
+
 # Health check handler
 async def health_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /health command"""
@@ -2887,11 +3504,98 @@ async def health_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Update {update} caused error {context.error}")
 
-# --- Main ---
+# --- Warm-up ---
 
-def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+def restore_cache_snapshot():
+    """แนบ snapshot ที่เก็บไว้ตอนปิดครั้งก่อนเข้ากับ CACHE (อ่านแค่ index ค่าจริงอ่านเมื่อถูกขอ)"""
+    if CACHE_SNAPSHOT_PATH:
+        cache_snapshot.restore_snapshot(CACHE, CACHE_SNAPSHOT_PATH)
+
+# ฟังก์ชันที่คืนค่า cache ตอนเริ่ม process (รันใน post_init เสมอ ไม่ขึ้นกับ WARMUP)
+CACHE_RESTORE_HOOKS = [restore_cache_snapshot]
+
+def restore_caches():
+    """รัน CACHE_RESTORE_HOOKS ทีละตัว (hook ที่ล้มเหลวไม่ขวางตัวอื่น)"""
+    for hook in CACHE_RESTORE_HOOKS:
+        start = time.perf_counter()
+        try:
+            hook()
+            logger.info(f"♻️ {hook.__name__} finished in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"❌ {hook.__name__} failed: {e}")
+
+def _preconnect(url):
+    """เปิด TCP/TLS connection ไว้ใน HTTP_SESSION ล่วงหน้า (ไม่เสีย API credit)"""
+    HTTP_SESSION.head(url, timeout=5)
+
+def _preconnect_step(name, url):
+    """ขั้นตอน warm-up ที่ preconnect ไป url (เติม https:// ให้ endpoint ที่ระบุแค่ host)"""
+    if '://' not in url:
+        url = f"https://{url}"
+    return (f"connect {name}", lambda: _preconnect(url))
+
+def _import_step(module_name):
+    return (f"import {module_name}", lambda: importlib.import_module(module_name))
+
+def build_warmup():
+    """สร้างขั้นตอน warm-up: import โมดูลหนัก -> สร้าง client / เปิด connection"""
+    warmup = Warmup()
+    warmup.stage(
+        _import_step('google.generativeai'),
+        _import_step('groq'),
+        _import_step('supabase'),
+        _import_step('deep_translator'),
+    )
     
+    clients = []
+    if GEMINI_API_KEY:
+        clients.append(("gemini client", lambda: _configure_gemini(importlib.import_module('google.generativeai'))))
+    if GROQ_API_KEY:
+        clients.append(("groq client", get_groq_client))
+    if SUPABASE_URL and SUPABASE_KEY:
+        clients.append(("supabase client", get_supabase_client))
+    if cassette.CASSETTE.mode != 'replay':  # replay ต้องรันแบบ offline ได้
+        # SDK ของ AI / Supabase ใช้ connection pool ของตัวเอง แต่ DNS และ TLS session ของ host ยังได้อุ่นไว้
+        clients.append(_preconnect_step("twelvedata", TWELVE_DATA_BASE_URL))
+        clients.append(_preconnect_step("finnhub", FINNHUB_BASE_URL))
+        clients.append(_preconnect_step("translate", GOOGLE_TRANSLATE_URL or "https://translate.google.com/m"))
+        if GEMINI_API_KEY:
+            clients.append(_preconnect_step("gemini", GEMINI_API_ENDPOINT or "https://generativelanguage.googleapis.com"))
+        if GROQ_API_KEY:
+            clients.append(_preconnect_step("groq", os.environ.get("GROQ_BASE_URL") or "https://api.groq.com"))
+        if SUPABASE_URL and SUPABASE_KEY:
+            clients.append(_preconnect_step("supabase", SUPABASE_URL))
+    if clients:
+        warmup.stage(*clients)
+    return warmup
+
+async def post_init(application):
+    """เรียกหลัง initialize: บันทึกเวลา cold start คืน cache จาก snapshot แล้วเริ่ม warm-up ใน background"""
+    ready = time.perf_counter() - PROCESS_START
+    metrics.PROCESS_READY_SECONDS.set(round(ready, 4))
+    logger.info(f"⏱️ Bot initialized in {ready:.2f}s")
+    # restore อ่านแค่ index ของ snapshot (เร็ว) จึงรันเสมอ WARMUP=0 ปิดแค่การ import / เปิด connection ล่วงหน้า
+    await asyncio.to_thread(restore_caches)
+    if WARMUP:
+        build_warmup().start()
+
+async def post_shutdown(application):
+    """หยุดการให้คะแนนข่าวเบื้องหลัง แล้วเก็บ cache ที่ยังไม่หมดอายุลง snapshot เพื่อ restore หลัง restart/redeploy"""
+    await asyncio.to_thread(SENTIMENT.stop)
+    if not CACHE_SNAPSHOT_PATH:
+        return
+    try:
+        start = time.perf_counter()
+        count = cache_snapshot.write_snapshot(CACHE, CACHE_SNAPSHOT_PATH, SNAPSHOT_NAMESPACES)
+        logger.info(f"💾 Saved {count} cache entries to {CACHE_SNAPSHOT_PATH} in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logger.error(f"❌ Cannot save cache snapshot: {e}")
+
+
+# --- Main ---
+
+def register_handlers(application):
+    """ลงทะเบียน handler ทั้งหมด (ใช้ร่วมกันระหว่าง main และ benchmarks)"""
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("popular", popular_stocks))
@@ -2899,16 +3603,59 @@ def main():
     application.add_handler(CommandHandler("ai", ai_analysis_command))  
     application.add_handler(CommandHandler("aiplus", aiplus_command))
     application.add_handler(CommandHandler("compare", compare_command))
+    application.add_handler(CommandHandler("chart", chart_command))
+    application.add_handler(CommandHandler("backtest", backtest_command))
+    application.add_handler(CommandHandler("portfolio", portfolio_command))
     application.add_handler(CommandHandler("health", health_check))
+    application.add_handler(InlineQueryHandler(inline_quote_query))
     application.add_handler(CallbackQueryHandler(stock_category_callback))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, analyze_stock))
-    application.add_handler(CallbackQueryHandler(aiplus_button_callback, pattern="^aiplus_"))  # เพิ่มบรรทัดนี้
     application.add_error_handler(error_handler)
 
- 
+
+def build_application(updater=True):
+    """สร้าง Application พร้อม handler (updater=False สำหรับ webhook worker ที่ป้อน update เอง)"""
+    # pool size เท่าค่า default ของ ApplicationBuilder
+    builder = Application.builder() \
+        .token(BOT_TOKEN) \
+        .request(InstrumentedRequest(connection_pool_size=256)) \
+        .post_init(post_init) \
+        .post_shutdown(post_shutdown) \
+        .concurrent_updates(CONCURRENT_UPDATES)
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+    register_handlers(application)
+    return application
+
+
+def main():
+    use_webhook = WEBHOOK_URL and ("onrender.com" in WEBHOOK_URL or USE_WEBHOOK)
+    
+    if use_webhook and WEB_WORKERS > 1:
+        port = int(os.environ.get("PORT", 10000))
+        if CACHE.name == 'memory':
+            logger.warning("⚠️ CACHE_URL is in-memory: workers will not share cached data")
+        logger.info(f"🚀 Starting {WEB_WORKERS} webhook workers on port {port}...")
+        webhook_workers.run_workers(
+            WEB_WORKERS, build_application, port,
+            url_path=BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL}/{BOT_TOKEN}",
+            metrics_port=int(METRICS_PORT) if METRICS_PORT else None,
+        )
+        return
     
+    application = build_application()
+    
+    if METRICS_PORT:
+        try:
+            metrics.start_metrics_server(int(METRICS_PORT))
+        except OSError as e:
+            logger.warning(f"⚠️ Cannot start metrics server on port {METRICS_PORT}: {e}")
     
-    if WEBHOOK_URL and "onrender.com" in WEBHOOK_URL:
+    if use_webhook:
         try:
             port = int(os.environ.get("PORT", 10000))
             logger.info(f"🚀 Starting Webhook on port {port}...")
@@ -0,0 +1,139 @@
+"""Tracing แบบเบาๆ: span ต่อ update และ child span ต่อการเรียก upstream
+
+เมื่อ trace ราก (update) จบ จะเขียน JSON 1 บรรทัดต่อ request ผ่าน logger "trace"
+มีโครง span ทั้งต้นพร้อมเวลาเริ่ม/ระยะเวลาเป็น ms สามารถแปลงเป็น folded stacks
+สำหรับ flame graph ได้ด้วย `python tracing.py trace.log > folded.txt`
+"""
+import contextvars
+import json
+import logging
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger('trace')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'start', 'end', 'children', 'error')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.error = None
+
+    @property
+    def duration(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, origin):
+        record = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 2),
+            'duration_ms': round(self.duration * 1000, 2),
+        }
+        if self.attrs:
+            record['attrs'] = self.attrs
+        if self.error:
+            record['error'] = self.error
+        if self.children:
+            record['children'] = [child.to_dict(origin) for child in list(self.children)]
+        return record
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def _activate(span_obj):
+    token = _current_span.set(span_obj)
+    try:
+        yield span_obj
+    except BaseException as e:
+        span_obj.error = type(e).__name__
+        raise
+    finally:
+        span_obj.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace(name, sample_rate=1.0, **attrs):
+    """เปิด span ราก (1 ต่อ update) และเขียน JSON record เมื่อจบ
+
+    ถ้าไม่ถูกสุ่มเลือก (sampling) จะไม่สร้าง span และ child span ทั้งหมดเป็น no-op
+    """
+    if _current_span.get() is not None or random.random() >= sample_rate:
+        yield None
+        return
+
+    root = Span(name, attrs)
+    trace_id = uuid.uuid4().hex[:16]
+    try:
+        with _activate(root):
+            yield root
+    finally:
+        record = {
+            'trace_id': trace_id,
+            'ts': time.time(),
+            **root.to_dict(root.start),
+        }
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def span(name, **attrs):
+    """เปิด child span ใต้ span ปัจจุบัน (no-op ถ้าไม่มี trace ที่ active)"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, attrs)
+    parent.children.append(child)
+    with _activate(child):
+        yield child
+
+
+def to_folded(record):
+    """แปลง trace record เป็น folded stacks (self time เป็น µs) สำหรับ flamegraph/speedscope"""
+    lines = []
+
+    def walk(node, stack):
+        path = stack + [node['name']]
+        children = node.get('children', [])
+        self_ms = node['duration_ms'] - sum(child['duration_ms'] for child in children)
+        if self_ms > 0:
+            lines.append(f"{';'.join(path)} {int(self_ms * 1000)}")
+        for child in children:
+            walk(child, path)
+
+    walk(record, [])
+    return lines
+
+
+def main(argv):
+    """อ่าน log (มี JSON trace record ในแต่ละบรรทัด) แล้วพิมพ์ folded stacks"""
+    stream = open(argv[1], encoding='utf-8') if len(argv) > 1 else sys.stdin
+    for line in stream:
+        start = line.find('{"trace_id"')
+        if start == -1:
+            continue
+        for folded in to_folded(json.loads(line[start:])):
+            print(folded)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,65 @@
+"""Warm-up ตอนเริ่ม process: import โมดูลหนัก, สร้าง client, เปิด connection ล่วงหน้า
+
+บอทรับ update ได้ทันที ส่วน warm-up รันใน background thread เป็นลำดับ stage
+(step ใน stage เดียวกันรันพร้อมกัน) แล้วสรุปเวลาที่ใช้ของแต่ละ step ลง log
+และ gauge stockbot_startup_step_seconds
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    def __init__(self):
+        self.stages = []     # [[(name, fn), ...], ...]
+        self.timings = {}    # name -> (seconds, error หรือ None)
+        self.done = threading.Event()
+
+    def stage(self, *steps):
+        """เพิ่ม stage ใหม่ (steps เป็น tuple (name, fn))"""
+        self.stages.append(list(steps))
+        return self
+
+    def _run_step(self, name, fn):
+        start = time.perf_counter()
+        error = None
+        try:
+            fn()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+        self.timings[name] = (elapsed, error)
+        metrics.STARTUP_STEP_SECONDS.set(round(elapsed, 4), step=name)
+
+    def run(self):
+        """รันทุก stage ตามลำดับ (blocking) แล้วคืน dict ของเวลาที่ใช้"""
+        start = time.perf_counter()
+        workers = max((len(steps) for steps in self.stages), default=1)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='warmup') as pool:
+            for steps in self.stages:
+                list(pool.map(lambda step: self._run_step(*step), steps))
+        total = time.perf_counter() - start
+        metrics.STARTUP_STEP_SECONDS.set(round(total, 4), step='total')
+        self.report(total)
+        self.done.set()
+        return self.timings
+
+    def start(self):
+        """รัน warm-up ใน daemon thread (ไม่ block การรับ update)"""
+        thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def report(self, total):
+        lines = [f"🔥 Warm-up finished in {total:.2f}s"]
+        for steps in self.stages:
+            for name, _fn in steps:
+                elapsed, error = self.timings.get(name, (0.0, None))
+                status = f"❌ {error}" if error else "✅"
+                lines.append(f"   {name:<28}{elapsed:>7.3f}s  {status}")
+        logger.info('\n'.join(lines))
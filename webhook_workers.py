@@ -0,0 +1,99 @@
+"""รับ webhook ด้วยหลาย worker process บนพอร์ตเดียวกัน (SO_REUSEPORT, Linux)
+
+แต่ละ worker มี Application ของตัวเอง (ไม่มี Updater) และ aiohttp server ที่ป้อน
+update เข้า application.update_queue ส่วน kernel กระจาย connection ให้ worker
+worker 0 เป็นตัวตั้ง webhook กับ Telegram ส่วน cache แชร์กันผ่าน CACHE_URL
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+async def _serve(index, build_application, port, url_path, webhook_url, metrics_port):
+    application = build_application(updater=False)
+    if metrics_port:
+        try:
+            metrics.start_metrics_server(metrics_port + index)
+        except OSError as e:
+            logger.warning(f"⚠️ Worker {index}: cannot start metrics server: {e}")
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    if index == 0:
+        await application.bot.set_webhook(webhook_url, allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        logger.info(f"✅ Worker 0 set webhook to {webhook_url.rsplit('/', 1)[0]}/...")
+
+    async def handle_update(request):
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(f'/{url_path}', handle_update)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port, reuse_port=True).start()
+    logger.info(f"🚀 Worker {index} listening on port {port}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    logger.info(f"🛑 Worker {index} stopping...")
+    await runner.cleanup()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def _worker_main(index, build_application, port, url_path, webhook_url, metrics_port):
+    asyncio.run(_serve(index, build_application, port, url_path, webhook_url, metrics_port))
+
+
+def run_workers(count, build_application, port, url_path, webhook_url, metrics_port=None):
+    """เริ่ม worker `count` ตัวแล้วรอจนทุกตัวจบ (SIGTERM/SIGINT ส่งต่อให้ worker)
+
+    build_application(updater=False) ต้องเป็นฟังก์ชันระดับ module (ส่งข้าม process ด้วย spawn)
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(index, build_application, port, url_path, webhook_url, metrics_port),
+            name=f'webhook-worker-{index}',
+        )
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    for process in processes:
+        process.join()
+        if process.exitcode:
+            logger.error(f"❌ {process.name} exited with code {process.exitcode}")
@@ -0,0 +1,120 @@
+"""ผู้ให้บริการข้อมูลราคาจาก yfinance (ไม่เสียเครดิต Twelve Data)
+
+ใช้ yfinance.download แบบ multi-ticker (threaded) ดึงราคาย้อนหลังของหลาย symbol
+ในการเรียกครั้งเดียว เหมาะกับการ backfill ทั้งหมวดหมู่และการ scan
+quote คืนในรูปแบบเดียวกับ Twelve Data /quote เพื่อใช้แทนกันได้
+
+ฟังก์ชัน download เปลี่ยนได้ (เช่น stand-in ใน benchmarks/stubs.py) ผ่าน constructor
+หรือ YFINANCE_DOWNLOAD=module:function
+history / get_quotes ผ่าน cassette (บันทึก dict ของคอลัมน์ต่อ symbol) replay จึงไม่ออก network
+"""
+import importlib
+import logging
+import math
+
+import cassette
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+def load_download(spec):
+    """โหลดฟังก์ชัน download จาก 'module:function' (ว่าง = yfinance.download)"""
+    if spec:
+        module_name, _, attr = spec.partition(':')
+        return getattr(importlib.import_module(module_name), attr)
+    import yfinance
+    return yfinance.download
+
+
+def _column(frame, name):
+    return [float(v) for v in frame[name].tolist()]
+
+
+class YFinanceProvider:
+    def __init__(self, download=None):
+        self._download = download
+
+    @property
+    def download(self):
+        if self._download is None:
+            self._download = load_download('')
+        return self._download
+
+    def _fetch(self, symbols, **kwargs):
+        """เรียก download ครั้งเดียวแล้วแยก DataFrame ต่อ symbol"""
+        symbols = [s.upper() for s in symbols]
+        with tracing.span('yfinance.download', symbols=len(symbols)), \
+                metrics.UPSTREAM_LATENCY.time(provider='yfinance', endpoint='download'):
+            try:
+                frame = self.download(
+                    symbols, group_by='ticker', auto_adjust=False, threads=True, progress=False, **kwargs
+                )
+            except Exception:
+                metrics.UPSTREAM_ERRORS.inc(provider='yfinance')
+                raise
+        if frame is None or frame.empty:
+            return {}
+        frames = {}
+        multi = getattr(frame.columns, 'nlevels', 1) > 1
+        for symbol in symbols:
+            if multi:
+                if symbol not in frame.columns.get_level_values(0):
+                    continue
+                sub = frame[symbol]
+            else:
+                sub = frame  # yfinance รุ่นเก่าคืนคอลัมน์ชั้นเดียวเมื่อมี symbol เดียว
+            sub = sub.dropna(subset=['Close'])
+            if not sub.empty:
+                frames[symbol] = sub
+        return frames
+
+    def history(self, symbols, period='20y', start=None):
+        """คืน {symbol: dict ของคอลัมน์ ts/open/high/low/close/volume} (เรียงเก่าไปใหม่)"""
+        kwargs = {'start': start} if start else {'period': period}
+        request = {'endpoint': 'history', 'params': {'symbols': sorted(s.upper() for s in symbols), **kwargs}}
+        return cassette.call('yfinance', request, lambda: self._history(symbols, kwargs))
+
+    def _history(self, symbols, kwargs):
+        result = {}
+        for symbol, frame in self._fetch(symbols, interval='1d', **kwargs).items():
+            index = frame.index.tz_localize(None) if getattr(frame.index, 'tz', None) else frame.index
+            result[symbol] = {
+                'ts': [int(ts.value // 10 ** 9) for ts in index],
+                'open': _column(frame, 'Open'),
+                'high': _column(frame, 'High'),
+                'low': _column(frame, 'Low'),
+                'close': _column(frame, 'Close'),
+                'volume': [v if not math.isnan(v) else 0.0 for v in _column(frame, 'Volume')],
+            }
+        return result
+
+    def get_quotes(self, symbols):
+        """คืน {symbol: quote แบบ Twelve Data} จากแท่งรายวัน 2 แท่งล่าสุด"""
+        request = {'endpoint': 'quotes', 'params': {'symbols': sorted(s.upper() for s in symbols)}}
+        return cassette.call('yfinance', request, lambda: self._quotes(symbols))
+
+    def _quotes(self, symbols):
+        quotes = {}
+        for symbol, frame in self._fetch(symbols, period='5d', interval='1d').items():
+            latest = frame.iloc[-1]
+            previous_close = float(frame['Close'].iloc[-2]) if len(frame) > 1 else float(latest['Close'])
+            close = float(latest['Close'])
+            change = close - previous_close
+            quotes[symbol] = {
+                'symbol': symbol,
+                'close': str(close),
+                'open': str(float(latest['Open'])),
+                'high': str(float(latest['High'])),
+                'low': str(float(latest['Low'])),
+                'volume': str(int(latest['Volume'])) if not math.isnan(latest['Volume']) else '0',
+                'previous_close': str(previous_close),
+                'change': str(change),
+                'percent_change': str(change / previous_close * 100 if previous_close else 0.0),
+                'source': 'yfinance',
+            }
+        return quotes
+
+    def get_quote(self, symbol):
+        return self.get_quotes([symbol]).get(symbol.upper())